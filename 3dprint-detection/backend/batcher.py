@@ -0,0 +1,127 @@
+# backend/batcher.py
+"""
+Dynamic micro-batching: รวมภาพจากหลาย request ที่เข้ามาพร้อมกัน
+แล้วเรียก model.predict([...]) ครั้งเดียว จากนั้นส่งผลกลับให้แต่ละ request ที่รออยู่
+
+- รวบ batch จนครบ max_batch ภาพ หรือครบ max_wait_ms นับจากภาพแรก (อย่างใดอย่างหนึ่ง)
+- predict รันบน thread เดียวของ batcher (โมเดลตัวเดียว ไม่ต้องห่วง thread-safety)
+- batch ที่ predict ไม่ผ่าน → รันใหม่ทีละภาพ: ภาพเสียภาพเดียวไม่ลาก request อื่นที่บังเอิญอยู่ batch เดียวกันให้ล้มด้วย
+- stats() คืนสถิติขนาด batch ที่ทำได้จริง
+"""
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from typing import Callable, List
+
+
+class MicroBatcher:
+    def __init__(
+        self,
+        predict_fn: Callable[[List], List],
+        max_batch: int,
+        max_wait_ms: float,
+    ):
+        self._predict_fn = predict_fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._q: "queue.Queue[tuple | None]" = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+
+        # สถิติ (เขียนจาก batcher thread เท่านั้น)
+        self._sizes: Counter = Counter()
+        self._frames = 0
+        self._batches = 0
+        self._split = 0     # batch ที่ล้มแล้วต้องรันใหม่ทีละภาพ
+
+    # ---------- public ----------
+    def submit(self, img) -> Future:
+        """ส่งภาพเข้าคิว batch คืน Future ของผล predict (1 ภาพ) — ต้องเป็นภาพที่ decode แล้ว (HxWxC)"""
+        if getattr(img, "ndim", None) != 3:
+            raise ValueError(f"expected a decoded HxWxC image, got {type(img).__name__}")
+        self._ensure_started()
+        fut: Future = Future()
+        self._q.put((img, fut))
+        return fut
+
+    def predict(self, img):
+        """แบบ blocking — ใช้จาก inference worker thread"""
+        return self.submit(img).result()
+
+    def stats(self) -> dict:
+        batches = self._batches
+        return {
+            "batches": batches,
+            "frames": self._frames,
+            "avg_batch_size": round(self._frames / batches, 3) if batches else 0.0,
+            "max_batch_size": max(self._sizes) if self._sizes else 0,
+            "batch_size_hist": {str(k): v for k, v in sorted(self._sizes.items())},
+            "split_batches": self._split,
+            "queued": self._q.qsize(),
+            "config": {"max_batch": self.max_batch, "max_wait_ms": self.max_wait * 1000},
+        }
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._q.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    # ---------- internal ----------
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                t = threading.Thread(target=self._loop, name="infer-batcher", daemon=True)
+                t.start()
+                self._thread = t
+
+    def _loop(self) -> None:
+        while True:
+            item = self._q.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.max_wait
+            # เก็บภาพเพิ่มจนเต็ม batch หรือหมดเวลารอ
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    nxt = self._q.get(timeout=remaining) if remaining > 0 else self._q.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    stop = True
+                    break
+                batch.append(nxt)
+
+            self._run(batch)
+            if stop:
+                return
+
+    def _run(self, batch: list) -> None:
+        imgs = [img for img, _ in batch]
+        try:
+            results = self._predict_fn(imgs)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+            else:
+                # ไม่รู้ว่าภาพไหนทำพัง → แยกรันทีละภาพ แต่ละ Future ได้ผล/ error ของตัวเอง
+                self._split += 1
+                for img, fut in batch:
+                    try:
+                        fut.set_result(self._predict_fn([img])[0])
+                    except Exception as e1:
+                        fut.set_exception(e1)
+        else:
+            for (_, fut), res in zip(batch, results):
+                fut.set_result(res)
+
+        self._batches += 1
+        self._frames += len(batch)
+        self._sizes[len(batch)] += 1
@@ -0,0 +1,296 @@
+# backend/blobstore.py
+"""
+Content-addressed blob store ของไฟล์อัปโหลด (อยู่หลัง temp_store)
+
+- เก็บไฟล์ตาม content hash (digest จากตอน ingest) ใน shard 2 ชั้น: <root>/ab/cd/<digest>.jpg
+  ภาพเดียวกันจากหลาย session/card → เก็บไฟล์เดียว
+- link = การอ้างถึง blob จาก card/session (symlink ใน session, sidecar ของผลลัพธ์)
+  เก็บบนดิสก์เป็น hard link ของ blob ใน <root>/refs/<hash ของชื่อ link>/ → st_nlink ของ blob = 1 + จำนวน link
+  ทุก process (หลาย uvicorn worker) เห็น refcount เดียวกัน; link ตัวสุดท้ายหาย → ลบ blob ทันที
+- การแก้ไข (put/link/unlink/ลบ) ถือ flock ของ <root>/.lock → ไม่มี process ไหนลบ blob ระหว่างที่อีกตัวกำลัง link
+- รวมขนาดเกิน quota → ไล่ลบ blob ที่ใช้ล่าสุดนานที่สุด (LRU) แม้ยังมี link: ลบ ref ใน refs/ ของมันก่อนแล้วลบ blob
+  symlink ใน session / sidecar ที่ชี้ blob นั้นกลายเป็น dangling → /temp/results ตอบ 404 (เหมือนหมดอายุ)
+- index ในแรม (LRU + ขนาด) เป็นของแต่ละ process: quota คิดจาก blob ที่ process นี้รู้จัก (สแกนตอน start + ที่ put เอง)
+"""
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:   # ไม่ใช่ POSIX → ไม่มี lock ข้าม process (ใช้ได้ process เดียว)
+    fcntl = None
+
+_NAME_FILE = "name"          # ชื่อ link เต็มใน refs/<hash>/ (ไว้ตรวจตอน rebuild ว่า link ยังอยู่ไหม)
+_STALE_INCOMING = 3600.0     # ไฟล์ใน incoming เก่ากว่านี้ = spool ค้างจาก process ที่ตายไป
+_REF_GRACE = 60.0            # ref ที่เพิ่งสร้าง (link อาจยังเขียนไม่เสร็จ) ไม่ถูก rebuild ลบ
+
+
+@dataclass
+class _Blob:
+    path: Path
+    size: int
+
+
+class BlobStore:
+    def __init__(self, root: Path, quota_bytes: int):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.incoming = root / "incoming"     # ไฟล์ที่กำลัง spool (ยังไม่รู้ hash)
+        self.refs = root / "refs"
+        self.incoming.mkdir(parents=True, exist_ok=True)
+        self.refs.mkdir(parents=True, exist_ok=True)
+        self._blobs: "OrderedDict[str, _Blob]" = OrderedDict()   # digest → blob (ซ้าย = ใช้นานสุด)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._lock_file = open(root / ".lock", "a+b") if fcntl is not None else None
+        self._puts = 0
+        self._dedup_hits = 0
+        self._evicted_quota = 0
+        self._evicted_unref = 0
+
+    def path_for(self, digest: str, ext: str = ".jpg") -> Path:
+        return self.root / digest[:2] / digest[2:4] / f"{digest}{ext}"
+
+    @staticmethod
+    def digest_of(path: Path) -> str | None:
+        """<root>/ab/cd/<digest>.jpg → digest (ไม่ใช่ blob → None)"""
+        stem = Path(path).stem
+        return stem if len(stem) >= 4 and Path(path).parent.name == stem[2:4] else None
+
+    def _ref_dir(self, name: str) -> Path:
+        h = hashlib.blake2b(name.encode(), digest_size=16).hexdigest()
+        return self.refs / h[:2] / h
+
+    @contextmanager
+    def _locked(self):
+        """lock ของ thread ใน process นี้ + flock ข้าม process (สั้น ๆ: แค่ metadata ของไฟล์)"""
+        with self._lock:
+            if self._lock_file is None:
+                yield
+                return
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    # ---------- put / link ----------
+    def put(self, src: Path, digest: str, ext: str = ".jpg", link: str | None = None) -> Path:
+        """
+        ย้ายไฟล์ที่ spool แล้ว (src) เข้า store — มี blob นี้อยู่แล้ว (จาก process ไหนก็ได้) → ทิ้ง src ใช้ตัวเดิม
+        link = ชื่อ link ที่จะอ้างถึง blob นี้ (ทำใน lock เดียวกัน → ไม่มีช่องให้ถูกลบก่อน link)
+        คืน path ของ blob
+        """
+        with self._locked():
+            self._puts += 1
+            b = self._blobs.get(digest)
+            dest = b.path if b is not None and b.path.exists() else self.path_for(digest, ext)
+            if dest.exists():
+                self._dedup_hits += 1
+                src.unlink(missing_ok=True)
+            else:
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                try:
+                    os.replace(src, dest)
+                except OSError:
+                    shutil.move(str(src), dest)   # คนละ filesystem
+            self._index(digest, dest)
+            if link is not None:
+                self._link(link, dest)
+            self._enforce_quota(keep=digest)
+        return dest
+
+    def link(self, name: str, path: Path) -> bool:
+        """
+        ให้ link `name` อ้างถึง blob ที่ path — name เดิมเคยชี้ blob อื่น → ปล่อยตัวเก่า (refcount ลด)
+        path ไม่ใช่ blob ใน store (หรือถูกลบไปแล้ว) → False
+        """
+        path = Path(path)
+        digest = self.digest_of(path)
+        if digest is None:
+            return False
+        with self._locked():
+            if not path.exists():
+                return False
+            self._index(digest, path)
+            self._link(name, path)
+        return True
+
+    def unlink(self, name: str) -> None:
+        with self._locked():
+            self._unlink(name)
+
+    def touch(self, path: Path) -> None:
+        """มีคนอ่าน blob → ย้ายไปท้าย LRU"""
+        digest = self.digest_of(path)
+        with self._lock:
+            if digest in self._blobs:
+                self._blobs.move_to_end(digest)
+
+    # ---------- internal (เรียกตอนถือ lock) ----------
+    def _index(self, digest: str, path: Path) -> None:
+        b = self._blobs.get(digest)
+        if b is None or b.path != path:
+            size = path.stat().st_size
+            if b is not None:
+                self._bytes -= b.size
+            self._blobs[digest] = _Blob(path, size)
+            self._bytes += size
+        self._blobs.move_to_end(digest)
+
+    def _link(self, name: str, blob: Path) -> None:
+        d = self._ref_dir(name)
+        ref = d / blob.name
+        if ref.exists():
+            return
+        d.mkdir(parents=True, exist_ok=True)
+        old = [p for p in d.iterdir() if p.name != _NAME_FILE]
+        if not (d / _NAME_FILE).exists():
+            (d / _NAME_FILE).write_text(name, encoding="utf-8")
+        os.link(blob, ref)
+        for p in old:
+            p.unlink(missing_ok=True)
+            self._drop_if_unreferenced(p.name)
+
+    def _unlink(self, name: str) -> None:
+        d = self._ref_dir(name)
+        try:
+            entries = list(d.iterdir())
+        except FileNotFoundError:
+            return
+        for p in entries:
+            p.unlink(missing_ok=True)
+            if p.name != _NAME_FILE:
+                self._drop_if_unreferenced(p.name)
+        try:
+            d.rmdir()
+        except OSError:
+            pass
+
+    def _drop_if_unreferenced(self, filename: str) -> None:
+        """ไม่มี hard link อื่นเหลือ (ทุก process) → ลบ blob ทันที"""
+        digest = Path(filename).stem
+        path = self.path_for(digest, Path(filename).suffix)
+        try:
+            if path.stat().st_nlink > 1:
+                return
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        else:
+            self._evicted_unref += 1
+        b = self._blobs.pop(digest, None)
+        if b is not None:
+            self._bytes -= b.size
+
+    def _enforce_quota(self, keep: str | None = None) -> None:
+        if self._bytes <= self.quota_bytes:
+            return
+        over = self._bytes - self.quota_bytes
+        victims = []
+        for digest, b in self._blobs.items():
+            if over <= 0:
+                break
+            if digest != keep:
+                victims.append(digest)
+                over -= b.size
+        # ref (hard link) ของ process ไหนก็ได้ต้องหายด้วย ไม่งั้นลบ blob ไปก็ไม่คืนที่ดิสก์
+        self._drop_refs({self._blobs[d].path.name for d in victims})
+        for digest in victims:
+            b = self._blobs.pop(digest)
+            self._bytes -= b.size
+            try:
+                b.path.unlink()
+                self._evicted_quota += 1
+            except FileNotFoundError:
+                pass                  # process อื่นลบไปแล้ว
+
+    def _drop_refs(self, filenames: set[str]) -> None:
+        """ลบ ref ทุกตัวที่ชี้ blob ใน filenames (สแกน refs/ รอบเดียวต่อการ evict หนึ่งครั้ง)"""
+        if not filenames:
+            return
+        for d in self.refs.glob("??/*"):
+            try:
+                entries = [p for p in d.iterdir() if p.name != _NAME_FILE]
+            except FileNotFoundError:
+                continue
+            hit = [p for p in entries if p.name in filenames]
+            for p in hit:
+                p.unlink(missing_ok=True)
+            if hit and len(hit) == len(entries):
+                (d / _NAME_FILE).unlink(missing_ok=True)
+                try:
+                    d.rmdir()
+                except OSError:
+                    pass
+
+    # ---------- rebuild ----------
+    def rebuild(self, links: dict[str, Path] | None = None) -> int:
+        """
+        สแกน root ใหม่ (ลำดับ LRU ตาม mtime) แล้วผูก link ที่ยังอยู่ (`links`: name → path ของ blob) ให้มี ref
+        ref ที่ link หายไปแล้ว (หมดอายุระหว่างที่ไม่มี process รัน) ถูกลบ → blob ที่ไม่มี link เหลือถูกลบตาม
+        process อื่นที่รันอยู่ไม่กระทบ: ref ของมันอยู่บนดิสก์ และ incoming ลบเฉพาะไฟล์ที่ค้างนานแล้ว
+        """
+        found = []
+        for shard in self.root.glob("??/??"):
+            for entry in os.scandir(shard):
+                if entry.is_file():
+                    st = entry.stat()
+                    found.append((st.st_mtime, Path(entry.path), st.st_size))
+        found.sort()
+        now = time.time()
+        with self._locked():
+            self._blobs.clear()
+            self._bytes = 0
+            for _, path, size in found:
+                self._blobs[path.stem] = _Blob(path, size)
+                self._bytes += size
+            for d in self.refs.glob("??/*"):
+                try:
+                    name = (d / _NAME_FILE).read_text(encoding="utf-8")
+                    recent = now - d.stat().st_mtime < _REF_GRACE
+                except OSError:
+                    name, recent = None, False
+                if not recent and (name is None or not os.path.lexists(name)):
+                    for p in d.iterdir():
+                        p.unlink(missing_ok=True)
+                        if p.name != _NAME_FILE:
+                            self._drop_if_unreferenced(p.name)
+                    try:
+                        d.rmdir()
+                    except OSError:
+                        pass
+            for name, path in (links or {}).items():
+                path = Path(path)
+                if self.digest_of(path) and path.exists():
+                    self._link(name, path)
+            # ไม่มี link ไหนอ้างถึงแล้ว → ลบ
+            for b in list(self._blobs.values()):
+                self._drop_if_unreferenced(b.path.name)
+            self._enforce_quota()
+        for f in self.incoming.iterdir():
+            try:
+                if now - f.stat().st_mtime > _STALE_INCOMING:
+                    f.unlink()
+            except OSError:
+                continue
+        return len(found)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "blobs": len(self._blobs),
+                "bytes": self._bytes,
+                "quota_bytes": self.quota_bytes,
+                "puts": self._puts,
+                "dedup_hits": self._dedup_hits,
+                "evicted_quota": self._evicted_quota,
+                "evicted_unref": self._evicted_unref,
+            }
@@ -0,0 +1,104 @@
+# backend/cache.py
+"""
+Detection cache: ภาพที่ byte ตรงกันทุกตัว (เช่นเครื่องพิมพ์ idle/pause ส่งภาพเดิมซ้ำ)
+ไม่ต้อง decode/predict ใหม่ — คืน scores/status + รายการกรอบเดิม
+
+- key = hash(bytes) + model identity + CONF_THRESHOLD
+- LRU (จำกัดทั้งจำนวน entry และขนาดรวม) + TTL — LRUCache ใช้ร่วมกับ render cache ด้วย
+- thread-safe (ถูกเรียกจาก inference worker หลายตัว)
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+
+def new_hasher():
+    # blake2b เร็วกว่า sha256 บน CPU 64-bit และพอสำหรับใช้เป็น cache key
+    return hashlib.blake2b(digest_size=16)
+
+
+def content_hash(data: bytes) -> str:
+    h = new_hasher()
+    h.update(data)
+    return h.hexdigest()
+
+
+class LRUCache:
+    """LRU + TTL จำกัดทั้งจำนวน entry และขนาดรวม (bytes) — thread-safe"""
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple[float, int, Any]]" = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def get(self, key: str):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, size, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self._bytes -= size
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: Any, size: int = 0) -> None:
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[key] = (time.monotonic() + self.ttl, size, value)
+            self._bytes += size
+            # ไล่ entry เก่าสุดออกจนอยู่ในงบ
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, old_size, _) = self._data.popitem(last=False)
+                self._bytes -= old_size
+                self.evictions += 1
+
+    def pop(self, key: str) -> None:
+        """invalidate entry เดียว"""
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "evictions": self.evictions,
+                "expired": self.expired,
+            }
+
+
+class DetectionCache(LRUCache):
+    @staticmethod
+    def make_key(content_digest: str, model_id: str, conf: float) -> str:
+        return f"{content_digest}:{model_id}:{conf}"
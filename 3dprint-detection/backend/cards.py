@@ -1,24 +1,37 @@
 # backend/cards.py
-from fastapi import APIRouter, UploadFile, File, HTTPException, Header, Request, Response
+from fastapi import APIRouter, HTTPException, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from pathlib import Path
 from typing import Dict, Optional
 from datetime import datetime
 import os
+import json
+import time
 import secrets
 import asyncio
-import httpx
-
-from backend.model import detect  # ต้องรองรับ detect(..., out_dir=Path)
-from backend.schemas import Card
-from backend.config import ALLOWED_MIME, MAX_FILE_SIZE, KEY_TTL, MODEL_PATH
+from collections import deque
+
+from backend.model import detect, detect_batch  # ต้องรองรับ detect(..., out_dir=Path)
+from backend.schemas import Card, JobAccepted
+from backend.config import KEY_TTL, MODEL_PATH, LIST_DEFAULT_LIMIT, LIST_MAX_LIMIT, LIST_CHUNK_BYTES
+from backend.config import EVENTS_HEARTBEAT, EVENTS_MAX_STREAM_SECONDS
+from backend.config import CARDS_BATCH_MAX_FILES, CARDS_BATCH_MAX_BYTES, CARDS_BATCH_CHUNK, CARDS_BATCH_INFLIGHT
+from backend.config import HISTORY_MAX_POINTS
+from backend.events import broker
+from backend.render import meta_path_for
+from backend.ingest import ingest_image, ingest_zip, iter_uploads, UploadedFile, UPLOAD_OPENAPI
 from . import database as db
+from . import executor
+from . import jobs
+from . import webhooks
+from . import history
 
 # temp store (ไฟล์ชั่วคราว + ตั้งเวลาลบ)
 from backend.temp_store import (
-    save_upload,            # save_upload(session_id, filename, data) -> Path
-    schedule_cleanup,       # schedule_cleanup(Path, delay=TTL_SECONDS)
     session_dir,            # session_dir(session_id) -> Path
-    TTL_SECONDS,
+    store_upload,           # store_upload(session_id, spooled_path, digest) -> link Path
+    link_result,            # link_result(sidecar_path, source)
+    blobs,
 )
 
 router = APIRouter()
@@ -27,9 +40,14 @@ SESSION_MAX_AGE = 60 * 60 * 24 * 30  # 30 วัน
 
 
 # ---------- helpers ----------
-def _validate_upload(image: UploadFile) -> None:
-    if image.content_type not in ALLOWED_MIME:
-        raise HTTPException(400, "Only JPEG/PNG allowed")
+async def _ingest_upload(request: Request, sid: str) -> UploadedFile:
+    """
+    stream ไฟล์ช่อง image ลง blob store (ตรวจ MIME + ตัดทันทีถ้าเกิน MAX_FILE_SIZE)
+    แล้วสร้าง link ในโฟลเดอร์ session (หมดอายุตาม TTL)
+    """
+    up = await ingest_image(request, blobs.incoming)
+    up.path = store_upload(sid, up.path, up.digest)
+    return up
 
 
 def _get_or_set_session_id(request: Request, response: Response) -> str:
@@ -56,149 +74,298 @@ def _make_card_payload(card_id: str, sid: str, result_name: str, res: Dict) -> D
         "status": res.get("status", "processed"),
         "scores": res.get("scores", {}),
         "updated_at": res.get("updated_at"),
-        "model": os.path.basename(MODEL_PATH),
+        "model": res.get("model") or os.path.basename(MODEL_PATH),   # เวอร์ชันที่ให้ผลนี้ (registry)
+        "reused": bool(res.get("reused", False)),
+        "stage": res.get("stage"),
     }
 
 
-# webhook fire-and-forget
-async def notify_callback(callback_url: str, payload: dict) -> None:
-    try:
-        async with httpx.AsyncClient(timeout=5) as client:
-            await client.post(callback_url, json=payload)
-    except Exception as e:
-        print(f"[callback] POST {callback_url} failed: {e}")
-
-
-# ---------- endpoints ----------
-@router.post("/cards", response_model=Card, status_code=201)
-async def create_card(
-    request: Request,
-    response: Response,
-    image: UploadFile = File(...),
-):
-    # 1) validate + อ่านไฟล์
-    _validate_upload(image)
-    content = await image.read()
-    if len(content) > MAX_FILE_SIZE:
-        raise HTTPException(400, "File too large (max 20MB)")
-
-    # 2) session + card id
-    sid = _get_or_set_session_id(request, response)
-    card_id = secrets.token_hex(4)  # 8 ตัว เช่น uuid4().hex[:8] ก็ได้
-
-    # 3) เซฟไฟล์อัปโหลดลง temp (ตั้งเวลาลบ)
-    up_path: Path = save_upload(sid, image.filename, content)
-    asyncio.create_task(schedule_cleanup(up_path, delay=TTL_SECONDS))
-
-    # 4) รันโมเดล → เซฟผลไว้ใน temp ของ session เดียวกัน
+async def _run_detect(src: Path | bytes, card_id: str, sid: str, digest: Optional[str] = None) -> tuple[str, Dict]:
+    """
+    รัน detect() ใน inference pool (ไม่บล็อก event loop) แล้วตั้งเวลาลบไฟล์ผลลัพธ์
+    คืน (result_name, res)
+    """
     out_dir = session_dir(sid)  # เช่น /tmp/3dprint_tmp/<sid>/
-    res = detect(content, card_id=card_id, out_dir=out_dir)
+    res = await executor.run(detect, src, card_id=card_id, out_dir=out_dir, digest=digest)
+    return _link_result(res, src, out_dir), res
 
+
+def _link_result(res: Dict, src: Path | bytes, out_dir: Path) -> str:
+    """หาไฟล์ผลของ detect() แล้วตั้งเวลาลบ → คืน result_name"""
     result_name = res.get("result_name")
     if not result_name:
         # fallback: เผื่อ detect คืน path มาแทน
         result_path = Path(res.get("detected_image_path", ""))
-        if result_path.exists():
+        if meta_path_for(result_path).exists():
             result_name = result_path.name
         else:
             raise HTTPException(500, "Detection output missing")
 
-    # 5) ตั้งเวลาลบไฟล์ผลลัพธ์
-    result_path = out_dir / result_name
-    asyncio.create_task(schedule_cleanup(result_path, delay=TTL_SECONDS))
+    # sidecar ของผลดิบ (ภาพถูก render ตอนถูกขอ) = link ไปยัง blob ต้นฉบับ + ตั้งเวลาลบ
+    link_result(meta_path_for(out_dir / result_name), src if isinstance(src, Path) else None)
+    return result_name
+
 
-    # 6) upsert DB + คืน payload
+def _stamp_payload(card_id: str, sid: str, result_name: str, res: Dict, cache_bust: bool) -> Dict:
     payload = _make_card_payload(card_id, sid, result_name, res)
-    db.upsert_card(payload)
+    payload["updated_at"] = datetime.utcnow().isoformat()
+    if cache_bust:
+        # กัน cache ฝั่ง client
+        payload["detected_image_url"] = f"{payload['detected_image_url']}?v={secrets.token_hex(3)}"
     return payload
 
 
+async def _process_upload(
+    src: Path | bytes,
+    card_id: str,
+    sid: str,
+    digest: Optional[str] = None,
+    callback_url: Optional[str] = None,
+    cache_bust: bool = False,
+) -> Dict:
+    """
+    pipeline เต็ม: detect → payload → upsert DB → callback
+    ใช้ร่วมกันทั้งโหมด sync (ใน request) และ job worker (โหมด async)
+    """
+    result_name, res = await _run_detect(src, card_id, sid, digest)
+
+    payload = _stamp_payload(card_id, sid, result_name, res, cache_bust)
+    await db.run(db.upsert_card, payload)
+    history.record(payload)
+
+    # ถ้ามี callback URL → เข้า outbox (ส่ง/ลองใหม่เบื้องหลัง ไม่รอผล)
+    if callback_url:
+        await webhooks.enqueue(card_id, callback_url, payload)
+    return payload
+
+
+# ---------- async job mode (Prefer: respond-async) ----------
+def _wants_async(prefer: Optional[str]) -> bool:
+    return bool(prefer) and "respond-async" in prefer.lower()
+
+
+async def _enqueue_job(
+    response: Response,
+    kind: str,
+    card_id: str,
+    sid: str,
+    up: UploadedFile,
+    callback_url: Optional[str] = None,
+    cache_bust: bool = False,
+) -> Dict:
+    """ใส่งาน (ไฟล์ที่ spool ไว้แล้ว) ลงคิว SQLite แล้วตอบ 202 ทันที"""
+    job_id = secrets.token_hex(8)
+    await db.run(db.create_job, job_id, card_id, kind, sid, str(up.path), callback_url, cache_bust)
+    jobs.notify()
+
+    status_url = f"/jobs/{job_id}"
+    response.status_code = 202
+    response.headers["Location"] = status_url
+    return {"job_id": job_id, "card_id": card_id, "status": "queued", "status_url": status_url}
+
+
+async def run_job(job: Dict) -> Dict:
+    """handler ของ job worker (ลงทะเบียนใน main.py ผ่าน jobs.start)"""
+    return await _process_upload(
+        Path(job["upload_path"]),
+        job["card_id"],
+        job["session_id"],
+        callback_url=job.get("callback_url"),
+        cache_bust=bool(job.get("cache_bust")),
+    )
+
+
+# ---------- endpoints ----------
+@router.post("/cards", response_model=Card | JobAccepted, status_code=201, openapi_extra=UPLOAD_OPENAPI)
+async def create_card(
+    request: Request,
+    response: Response,
+    prefer: Optional[str] = Header(default=None),
+    x_callback_url: Optional[str] = Header(default=None),
+):
+    # 1) session + card id
+    sid = _get_or_set_session_id(request, response)
+    card_id = secrets.token_hex(4)  # 8 ตัว เช่น uuid4().hex[:8] ก็ได้
+
+    # 2) stream ไฟล์อัปโหลดลง temp ของ session (validate + ตั้งเวลาลบ)
+    up = await _ingest_upload(request, sid)
+
+    # โหมด async → ตอบ 202 + job id (ผลลัพธ์ดูที่ GET /jobs/{id} หรือรอ callback)
+    if _wants_async(prefer):
+        return await _enqueue_job(response, "create", card_id, sid, up, x_callback_url)
+
+    # 3) รันโมเดล (ใน inference pool) → เซฟผลไว้ใน temp ของ session เดียวกัน → upsert DB
+    return await _process_upload(up.path, card_id, sid, digest=up.digest, callback_url=x_callback_url)
+
+
 @router.post("/cards/{card_id}/apikey")
 async def get_apikey(card_id: str):
     # สร้าง API key ใหม่ให้ card เดิม (TTL = KEY_TTL)
     # หมายเหตุ: ไม่บังคับให้มี card ใน DB ก่อนก็ได้ แต่แนะนำให้มี
-    rec = db.create_apikey(card_id, KEY_TTL)
+    rec = await db.run(db.create_apikey, card_id, KEY_TTL)
     return rec
 
 
-@router.post("/cards/{card_id}/replace", response_model=Card)
+@router.post("/cards/{card_id}/replace", response_model=Card | JobAccepted, openapi_extra=UPLOAD_OPENAPI)
 async def replace_card(
     request: Request,
     response: Response,
     card_id: str,
-    image: UploadFile = File(...),
     x_api_key: Optional[str] = Header(default=None),
     x_callback_url: Optional[str] = Header(default=None),
+    prefer: Optional[str] = Header(default=None),
 ):
     # 1) api key
     if not x_api_key:
         raise HTTPException(401, "Missing API key")
-    if not db.verify_apikey(x_api_key, card_id):
+    if not await db.run(db.verify_apikey, x_api_key, card_id):
         raise HTTPException(401, "API key expired/invalid")
 
-    # 2) validate + session
-    _validate_upload(image)
-    content = await image.read()
-    if len(content) > MAX_FILE_SIZE:
-        raise HTTPException(400, "File too large (max 20MB)")
-
+    # 2) session + stream ไฟล์อัปโหลดลง temp (validate + cleanup)
     sid = _get_or_set_session_id(request, response)
+    up = await _ingest_upload(request, sid)
 
-    # 3) เซฟอัปโหลด (optional) + cleanup
-    up_path: Path = save_upload(sid, image.filename, content)
-    asyncio.create_task(schedule_cleanup(up_path, delay=TTL_SECONDS))
+    if _wants_async(prefer):
+        return await _enqueue_job(response, "replace", card_id, sid, up, x_callback_url)
 
-    # 4) detect ใหม่แล้วเซฟผลลง temp
-    out_dir = session_dir(sid)
-    res = detect(content, card_id=card_id, out_dir=out_dir)
+    # 3) detect ใหม่ → อัปเดต DB → callback (ไม่ใส่ ?v= ฝั่ง backend)
+    payload = await _process_upload(up.path, card_id, sid, digest=up.digest, callback_url=x_callback_url)
 
-    result_name = res.get("result_name")
-    if not result_name:
-        result_path = Path(res.get("detected_image_path", ""))
-        if result_path.exists():
-            result_name = result_path.name
-        else:
-            raise HTTPException(500, "Detection output missing")
+    # ถ้าต้องการ one-time key: uncomment
+    # db.mark_apikey_used(x_api_key)
 
-    result_path = out_dir / result_name
-    asyncio.create_task(schedule_cleanup(result_path, delay=TTL_SECONDS))
+    return payload
 
-    # 5) อัปเดต DB + คืน payload (ไม่ใส่ ?v= ฝั่ง backend)
-    payload = _make_card_payload(card_id, sid, result_name, res)
-    payload["updated_at"] = datetime.utcnow().isoformat()
-    db.upsert_card(payload)
 
-    # 6) ถ้ามี callback URL → ส่งแบบ fire-and-forget
-    if x_callback_url:
-        asyncio.create_task(notify_callback(x_callback_url, payload))
+def _card_json(row) -> str:
+    # scores_json เก็บเป็น JSON อยู่แล้ว → ต่อ string ตรง ๆ ไม่ต้อง loads/dumps ซ้ำ
+    return (
+        '{"card_id":%s,"detected_image_url":%s,"status":%s,"scores":%s,"updated_at":%s,"model":%s}'
+        % (json.dumps(row["card_id"]), json.dumps(row["detected_image_url"]), json.dumps(row["status"]),
+           row["scores_json"], json.dumps(row["updated_at"]), json.dumps(row["model"]))
+    )
 
-    # ถ้าต้องการ one-time key: uncomment
-    # db.mark_apikey_used(x_api_key)
 
-    return payload
+def _stream_cards(rows: list, limit: int):
+    """
+    เขียน {"items":[...],"next_cursor":...} ทีละก้อน จากแถวที่อ่านมาแล้ว (connection คืน pool ไปก่อนส่ง)
+    rows = limit+1 แถว: ถ้ามีแถวเกิน → มีหน้าถัดไป (cursor = key ของแถวสุดท้ายที่ส่ง)
+    """
+    buf, size, n, last, more = ['{"items":['], 0, 0, None, False
+    for row in rows:
+        if n == limit:
+            more = True
+            break
+        item = _card_json(row)
+        buf.append("," + item if n else item)
+        size += len(item)
+        n += 1
+        last = (row["updated_at"], row["card_id"])
+        if size >= LIST_CHUNK_BYTES:
+            yield "".join(buf)
+            buf, size = [], 0
+    next_cursor = db.encode_cursor(*last) if more else None
+    buf.append('],"next_cursor":%s}' % json.dumps(next_cursor))
+    yield "".join(buf)
 
 
 @router.get("/cards")
-async def list_cards(limit: int = 50, cursor: str | None = None):
-    items = db.list_cards(limit=limit, cursor=cursor)
-    return {"items": items, "next_cursor": None}
+async def list_cards(
+    limit: int = Query(LIST_DEFAULT_LIMIT, ge=1, le=LIST_MAX_LIMIT),
+    cursor: str | None = None,
+    status: list[str] | None = Query(None, description="กรองตาม status (ระบุซ้ำได้ เช่น ?status=FAIL&status=NORMAL)"),
+):
+    try:
+        after = db.decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+    # อ่านทั้งหน้าใน db executor ก่อนเริ่มส่ง → client ช้าไม่ถือ connection, pool เต็มตอบ 503 ได้ก่อน header ออก
+    rows = await db.run(db.fetch_cards, limit + 1, after, status)
+    return StreamingResponse(_stream_cards(rows, limit), media_type="application/json")
+
+
+@router.get("/cards/stream")
+async def stream_cards(
+    request: Request,
+    card_id: list[str] | None = Query(None, description="รับเฉพาะ card เหล่านี้ (ระบุซ้ำได้)"),
+    status: list[str] | None = Query(None, description="รับเฉพาะ status เหล่านี้ (ระบุซ้ำได้)"),
+):
+    """
+    Server-Sent Events: ส่ง Card (event: card) ทุกครั้งที่ upsert_card ทำงาน
+    client เปิด EventSource แล้วโหลดภาพใหม่เฉพาะตอน updated_at เปลี่ยน (ไม่ต้อง poll)
+    """
+    sub = broker.subscribe(card_id, status)
+
+    async def gen():
+        deadline = time.monotonic() + EVENTS_MAX_STREAM_SECONDS
+        try:
+            yield "retry: 3000\n\n"
+            while time.monotonic() < deadline and not sub.closed:
+                cards = await sub.next(timeout=EVENTS_HEARTBEAT)
+                if await request.is_disconnected():
+                    break
+                if not cards:
+                    yield ": ping\n\n"
+                    continue
+                yield "".join(
+                    f"event: card\nid: {c['updated_at']}\ndata: {json.dumps(c)}\n\n" for c in cards
+                )
+        finally:
+            broker.unsubscribe(sub)
+
+    return StreamingResponse(
+        gen(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @router.get("/cards/{card_id}", response_model=Card)
 async def get_card(card_id: str):
-    card = db.get_card(card_id)
+    card = await db.run(db.get_card, card_id)
     if not card:
         raise HTTPException(404, "Card not found")
     return card
 
 
+@router.get("/cards/{card_id}/history")
+async def get_card_history(
+    card_id: str,
+    from_: Optional[datetime] = Query(None, alias="from", description="ISO8601 หรือ epoch seconds (default = to - 24 ชม.)"),
+    to: Optional[datetime] = Query(None, description="ISO8601 หรือ epoch seconds (default = ตอนนี้) ไม่มี timezone = UTC"),
+    resolution: str = Query("auto", pattern="^(auto|raw|minute|hour)$",
+                            description="auto = minute ถ้าช่วง ≤ 6 ชม. ไม่งั้น hour; raw = ผลรายภาพ (เก็บสั้นกว่า)"),
+):
+    """
+    ประวัติผล detect ของ card สำหรับวาดกราฟ (เช่นคะแนน spaghetti ตลอดงานพิมพ์ / เริ่ม FAIL ตอนไหน)
+    minute/hour อ่านจาก rollup — ผลล่าสุดอาจยังไม่เข้า (เขียนเป็นรอบทุก HISTORY_FLUSH_INTERVAL)
+    """
+    end = history.to_epoch(to) if to else time.time()
+    start = history.to_epoch(from_) if from_ else end - 24 * 3600
+    if start >= end:
+        raise HTTPException(400, "'from' must be earlier than 'to'")
+    if not await db.run(db.get_card, card_id):
+        raise HTTPException(404, "Card not found")
+
+    res = history.pick_resolution(resolution, start, end)
+    points = await db.run(history.query, card_id, res, start, end, HISTORY_MAX_POINTS)
+    return {
+        "card_id": card_id,
+        "resolution": res,
+        "from": datetime.utcfromtimestamp(start).isoformat(),
+        "to": datetime.utcfromtimestamp(end).isoformat(),
+        "points": points,
+        "truncated": len(points) >= HISTORY_MAX_POINTS,
+    }
+
+
 @router.post("/cards/genkey")
 async def gen_card_and_key():
     """Gen card_id + api_key พร้อมใช้งาน (ทางลัดแบบรวดเดียว)"""
     card_id = secrets.token_hex(4)
 
     # บันทึก card ว่าง (ให้ผ่าน NOT NULL ในตาราง)
-    db.upsert_card({
+    await db.run(db.upsert_card, {
         "card_id": card_id,
         "detected_image_url": "",
         "status": "PENDING",
@@ -206,7 +373,7 @@ async def gen_card_and_key():
         "updated_at": datetime.utcnow().isoformat(),
         "model": os.path.basename(MODEL_PATH),
     })
-    rec = db.create_apikey(card_id, KEY_TTL)
+    rec = await db.run(db.create_apikey, card_id, KEY_TTL)
     return {"card_id": card_id, **rec}
 
 
@@ -216,7 +383,7 @@ async def gen_empty_card():
     สร้าง card_id เปล่า (ยังไม่ gen key) — ใช้กรณีต้องการจอง card ไว้ก่อนค่อย upload
     """
     card_id = secrets.token_hex(4)
-    db.upsert_card({
+    await db.run(db.upsert_card, {
         "card_id": card_id,
         "detected_image_url": "",
         "status": "PENDING",
@@ -233,7 +400,7 @@ async def gen_card_and_key_together():
     สร้างทั้ง card_id + api_key (เทียบเท่า gen_card + genkey รวมกัน)
     """
     card_id = secrets.token_hex(4)
-    db.upsert_card({
+    await db.run(db.upsert_card, {
         "card_id": card_id,
         "detected_image_url": "",
         "status": "PENDING",
@@ -241,58 +408,196 @@ async def gen_card_and_key_together():
         "updated_at": datetime.utcnow().isoformat(),
         "model": os.path.basename(MODEL_PATH),
     })
-    rec = db.create_apikey(card_id, KEY_TTL)
+    rec = await db.run(db.create_apikey, card_id, KEY_TTL)
     return {"card_id": card_id, **rec}
-@router.post("/cards/replace", response_model=Card)
+@router.post("/cards/replace", response_model=Card | JobAccepted, openapi_extra=UPLOAD_OPENAPI)
 async def replace_card_noid(
     request: Request,
     response: Response,
-    image: UploadFile = File(...),
     x_api_key: str = Header(None),
     x_callback_url: str | None = Header(default=None),
+    prefer: str | None = Header(default=None),
 ):
     # 1) ดึง card_id จาก api_key
     if not x_api_key:
         raise HTTPException(401, "Missing API key")
-    card_id = db.get_card_id_by_apikey(x_api_key)
+    card_id = await db.run(db.get_card_id_by_apikey, x_api_key)
     if not card_id:
         raise HTTPException(401, "API key expired/invalid")
 
-    # 2) validate + session
-    _validate_upload(image)
-    content = await image.read()
-    if len(content) > MAX_FILE_SIZE:
-        raise HTTPException(400, "File too large (max 20MB)")
-
+    # 2) session + stream ไฟล์อัปโหลดลง temp (validate + ตั้งเวลาลบ)
     sid = _get_or_set_session_id(request, response)
-
-    # 3) เซฟอัปโหลดชั่วคราว + ตั้งเวลาลบ
-    up_path: Path = save_upload(sid, image.filename, content)
-    asyncio.create_task(schedule_cleanup(up_path, delay=TTL_SECONDS))
-
-    # 4) detect แล้วเซฟผลลง temp
-    out_dir = session_dir(sid)
-    res = detect(content, card_id=card_id, out_dir=out_dir)
-
-    result_name = res.get("result_name")
-    if not result_name:
-        result_path = Path(res.get("detected_image_path", ""))
-        if result_path.exists():
-            result_name = result_path.name
+    up = await _ingest_upload(request, sid)
+
+    if _wants_async(prefer):
+        return await _enqueue_job(response, "replace", card_id, sid, up, x_callback_url, cache_bust=True)
+
+    # 3) detect แล้วเซฟผลลง temp (refresh timestamp + กัน cache)
+    return await _process_upload(up.path, card_id, sid, digest=up.digest, callback_url=x_callback_url, cache_bust=True)
+
+
+# ---------- bulk upload (POST /cards/batch) ----------
+_ZIP_TYPES = {"application/zip", "application/x-zip-compressed"}
+
+BATCH_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "additionalProperties": {"type": "string", "format": "binary"},
+                    "description": "ชื่อช่องไฟล์ = <api_key> หรือ <card_id>:<api_key>",
+                }
+            },
+            "application/zip": {
+                "schema": {"type": "string", "format": "binary"},
+                "description": "ชื่อไฟล์ใน zip (ไม่รวมนามสกุล) = <api_key> หรือ <card_id>:<api_key>",
+            },
+        },
+    },
+    "responses": {"200": {"description": "NDJSON: 1 บรรทัดต่อภาพ (ตามลำดับที่ทำเสร็จ) + บรรทัดสรุป {\"done\": true, ...}"}},
+}
+
+
+async def _ingest_batch(request: Request) -> list[UploadedFile]:
+    """spool ทุกภาพใน body (multipart หรือ zip) ลง incoming ของ blob store"""
+    ctype = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if ctype in _ZIP_TYPES:
+        ups = await ingest_zip(request, blobs.incoming, CARDS_BATCH_MAX_FILES, CARDS_BATCH_MAX_BYTES)
+    else:
+        ups = []
+        try:
+            async for up in iter_uploads(request, blobs.incoming, max_body_size=CARDS_BATCH_MAX_BYTES):
+                ups.append(up)
+                if len(ups) > CARDS_BATCH_MAX_FILES:
+                    raise HTTPException(400, f"Too many files (max {CARDS_BATCH_MAX_FILES})")
+        except BaseException:
+            for up in ups:
+                up.path.unlink(missing_ok=True)
+            raise
+    if not ups:
+        raise HTTPException(422, "No image files")
+    return ups
+
+
+def _batch_error(item: int, up: UploadedFile, card_id: Optional[str], code: int, detail: str) -> str:
+    return json.dumps({"item": item, "filename": up.filename, "card_id": card_id,
+                       "status_code": code, "error": detail}) + "\n"
+
+
+def _error_of(exc: BaseException) -> tuple[int, str]:
+    if isinstance(exc, executor.QueueFull):     # คิวเต็ม / โมเดลยังไม่พร้อม / inference server ล่ม
+        return 503, str(exc)
+    if isinstance(exc, HTTPException):
+        return exc.status_code, str(exc.detail)
+    return 500, f"{type(exc).__name__}: {exc}"
+
+
+@router.post("/cards/batch", openapi_extra=BATCH_OPENAPI)
+async def batch_cards(
+    request: Request,
+    response: Response,
+    x_callback_url: Optional[str] = Header(default=None),
+):
+    """
+    อัปโหลดหลายภาพ (หลาย card) ใน request เดียว — สำหรับ controller ของฟาร์มเครื่องพิมพ์
+
+    - ตรวจ API key ทุกตัวใน query เดียว (key ที่ใช้ไม่ได้ → บรรทัด error 401 ของภาพนั้น ภาพอื่นทำต่อ)
+    - infer เป็นก้อนละ CARDS_BATCH_CHUNK ภาพ (predict ครั้งเดียวต่อก้อน)
+    - แต่ละก้อน: upsert การ์ดของก้อนใน transaction เดียว *ก่อน* ตอบบรรทัด NDJSON ของก้อนนั้น
+      (Card + "item" = ลำดับภาพใน body) → บรรทัดสำเร็จ = บันทึกแล้ว, GET /cards/{id} เห็นผลใหม่ทันที
+      บันทึกก้อนไหนไม่ผ่าน → ภาพในก้อนนั้นเป็นบรรทัด error แทน
+    - ปิดด้วยบรรทัดสรุป {"done": true, "written": n} (client ตัดกลางทาง → ก้อนที่ตอบไปแล้วถูกบันทึกแล้ว)
+    """
+    sid = _get_or_set_session_id(request, response)
+    ups = await _ingest_batch(request)
+
+    # 1) key ทุกตัวใน query เดียว
+    wanted: list[tuple[int, UploadedFile, Optional[str], str]] = []
+    for i, up in enumerate(ups):
+        hint, _, key = up.field.rpartition(":")
+        wanted.append((i, up, hint or None, key))
+    valid = await db.run(db.resolve_apikeys, [key for *_, key in wanted if key])
+
+    errors, accepted = [], []
+    for i, up, hint, key in wanted:
+        card_id = valid.get(key)
+        if not key or card_id is None or (hint is not None and hint != card_id):
+            up.path.unlink(missing_ok=True)
+            errors.append(_batch_error(i, up, hint, 401, "Missing API key" if not key else "API key expired/invalid"))
         else:
-            raise HTTPException(500, "Detection output missing")
+            accepted.append((i, up, card_id))
 
-    result_path = out_dir / result_name
-    asyncio.create_task(schedule_cleanup(result_path, delay=TTL_SECONDS))
+    # 2) ภาพที่ผ่าน → เข้า blob store + link ใน session (หมดอายุตาม TTL)
+    def _store():
+        for _, up, _ in accepted:
+            up.path = store_upload(sid, up.path, up.digest)
 
-    payload = _make_card_payload(card_id, sid, result_name, res)
-    # refresh timestamp + กัน cache
-    payload["updated_at"] = datetime.utcnow().isoformat()
-    payload["detected_image_url"] = f"{payload['detected_image_url']}?v={secrets.token_hex(3)}"
-
-    db.upsert_card(payload)
-
-    if x_callback_url:
-        asyncio.create_task(notify_callback(x_callback_url, payload))
-
-    return payload
\ No newline at end of file
+    try:
+        await asyncio.to_thread(_store)
+    except BaseException:
+        for _, up, _ in accepted:
+            up.path.unlink(missing_ok=True)
+        raise
+    out_dir = session_dir(sid)
+    chunks = [accepted[i:i + CARDS_BATCH_CHUNK] for i in range(0, len(accepted), CARDS_BATCH_CHUNK)]
+
+    async def gen():
+        written = 0
+        inflight: deque = deque()
+        pending = iter(chunks)
+
+        def submit_next() -> None:
+            chunk = next(pending, None)
+            if chunk is not None:
+                items = [(up.path, card_id, up.digest) for _, up, card_id in chunk]
+                inflight.append((chunk, asyncio.ensure_future(executor.run(detect_batch, items, out_dir))))
+
+        try:
+            for line in errors:
+                yield line
+            for _ in range(CARDS_BATCH_INFLIGHT):
+                submit_next()
+            while inflight:
+                chunk, task = inflight.popleft()
+                try:
+                    results = await task
+                except Exception as e:
+                    results = [e] * len(chunk)
+                submit_next()
+
+                lines, done = [], []
+                for (i, up, card_id), res in zip(chunk, results):
+                    if isinstance(res, BaseException):
+                        lines.append(_batch_error(i, up, card_id, *_error_of(res)))
+                    else:
+                        payload = _stamp_payload(card_id, sid, _link_result(res, up.path, out_dir), res, cache_bust=True)
+                        done.append((i, up, payload))
+
+                # 3) การ์ดของก้อนนี้ใน transaction เดียว ก่อนบอก client ว่าสำเร็จ → webhook (ถ้ามี)
+                payloads = [payload for *_, payload in done]
+                try:
+                    await db.run(db.upsert_cards, payloads)
+                except Exception as e:
+                    lines.extend(_batch_error(i, up, payload["card_id"], *_error_of(e)) for i, up, payload in done)
+                else:
+                    written += len(payloads)
+                    for payload in payloads:
+                        history.record(payload)
+                    if x_callback_url:
+                        for payload in payloads:
+                            await webhooks.enqueue(payload["card_id"], x_callback_url, payload)
+                    lines.extend(json.dumps({"item": i, **payload}) + "\n" for i, _, payload in done)
+                yield "".join(lines)
+
+            yield json.dumps({"done": True, "items": len(ups), "ok": written,
+                              "failed": len(ups) - written, "written": written}) + "\n"
+        finally:
+            for _, task in inflight:
+                task.cancel()
+
+    out = StreamingResponse(gen(), media_type="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+    # คืน Response เอง → header ที่ตั้งบน response (cookie ของ session ใหม่) ต้องย้ายมาเอง
+    out.raw_headers.extend(h for h in response.raw_headers if h[0] == b"set-cookie")
+    return out
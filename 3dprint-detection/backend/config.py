@@ -1,7 +1,165 @@
+import os
+
 CONF_THRESHOLD = 0.2
 KEY_TTL = 3600  # seconds
 MAX_FILE_SIZE = 20 * 1024 * 1024  # 20 MB
 ALLOWED_MIME = {"image/jpeg", "image/png"}
 UPLOAD_DIR = "../uploads"
 RESULT_DIR = "../results"
-MODEL_PATH = "backend/best.pt"
+MODEL_PATH = os.getenv("MODEL_PATH", "backend/best.pt")
+
+_CPU_COUNT = os.cpu_count() or 1
+
+# --- micro-batching (backend/batcher.py) ---
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", 8))        # ภาพสูงสุดต่อ 1 batch (<=1 = ปิด batching)
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", 5))  # รอรวม batch นานสุดกี่ ms หลังได้ภาพแรก
+BATCH_TORCH_THREADS = int(os.getenv("BATCH_TORCH_THREADS", _CPU_COUNT))  # batch รันทีละชุด → ใช้ทุก core
+
+# --- inference executor (backend/executor.py) ---
+# ถ้าเปิด batching worker ส่วนใหญ่แค่รอผล batch → ต้องมีอย่างน้อย BATCH_MAX_SIZE ตัวถึงจะเต็ม batch ได้
+INFER_WORKERS = int(os.getenv("INFER_WORKERS", max(1, _CPU_COUNT // 2, BATCH_MAX_SIZE if BATCH_MAX_SIZE > 1 else 1)))  # จำนวน worker thread ที่รัน detect()
+INFER_QUEUE_SIZE = int(os.getenv("INFER_QUEUE_SIZE", 32))                  # งานที่รอคิวได้สูงสุด (เกินนี้ตอบ 503)
+INFER_TORCH_THREADS = int(os.getenv("INFER_TORCH_THREADS", max(1, _CPU_COUNT // INFER_WORKERS)))  # torch intra-op threads ต่อ worker
+INFER_RETRY_AFTER = 2  # seconds (Retry-After ตอนคิวเต็ม)
+
+# --- inference backend (backend/engines.py, export: python -m backend.export) ---
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "ultralytics")          # ultralytics | onnx | openvino | remote (inference server)
+MODEL_INT8 = os.getenv("MODEL_INT8", "0") == "1"                   # ใช้ไฟล์ที่ quantize เป็น INT8 (export --int8)
+MODEL_ARTIFACT = os.getenv("MODEL_ARTIFACT") or None               # path ของไฟล์ onnx/โฟลเดอร์ openvino (ไม่ระบุ = ข้าง MODEL_PATH)
+MODEL_IMGSZ = int(os.getenv("MODEL_IMGSZ", 640))                   # ขนาด input ตอน export (กราฟ dynamic)
+MODEL_IOU = 0.7                                                    # NMS IoU (ค่าเดียวกับ default ของ ultralytics)
+MODEL_MAX_DET = 300
+MODEL_WARMUP_RUNS = int(os.getenv("MODEL_WARMUP_RUNS", 1))        # predict ภาพสังเคราะห์กี่รอบก่อน ready (0 = ไม่ warmup)
+MODEL_WARMUP_SIZE = int(os.getenv("MODEL_WARMUP_SIZE", 640))      # ด้านยาวของภาพ warmup (ควรเท่า DECODE_TARGET_SIZE)
+
+# --- model registry / canary (backend/registry.py) ---
+MODEL_CANARY_PATH = os.getenv("MODEL_CANARY_PATH") or None         # โหลดเวอร์ชันทดลองตั้งแต่ start (backend เดียวกับ MODEL_BACKEND)
+MODEL_CANARY_PERCENT = int(os.getenv("MODEL_CANARY_PERCENT", 10))  # % ของ card (ตาม hash card_id) ที่ใช้ canary
+MODEL_ADMIN_TOKEN = os.getenv("MODEL_ADMIN_TOKEN") or None          # header x-admin-token ของ /models/* (ไม่ตั้ง = ปิด)
+# intra-op threads ของ onnxruntime/openvino — batch รันทีละชุดใช้ทุก core, ไม่งั้นแบ่งตาม worker
+MODEL_THREADS = int(os.getenv("MODEL_THREADS", BATCH_TORCH_THREADS if BATCH_MAX_SIZE > 1 else INFER_TORCH_THREADS))
+
+# --- inference cascade (backend/model.py) — รอบถูกก่อน รอบเต็มเฉพาะภาพที่ก้ำกึ่ง ---
+CASCADE_MODE = os.getenv("CASCADE_MODE", "off")                    # off | lowres (โมเดลเดิม input เล็ก) | model (โมเดลเล็กแยก)
+CASCADE_IMGSZ = int(os.getenv("CASCADE_IMGSZ", 320))               # input ของรอบถูก (lowres; ต้องเป็น .pt หรือกราฟ dynamic)
+CASCADE_MODEL_PATH = os.getenv("CASCADE_MODEL_PATH") or None       # โมเดลเล็กของรอบถูก (model) — class/names ต้องตรงกับตัวหลัก
+CASCADE_BACKEND = os.getenv("CASCADE_BACKEND") or (MODEL_BACKEND if MODEL_BACKEND != "remote" else "onnx")
+# ช่วง "ไม่แน่ใจ" ของคะแนนรอบถูก [LOW, HIGH) — class ไหนตกในช่วงนี้ (หรือไม่เจออะไรเลย) → ส่งรอบเต็ม
+# ต้องคร่อม CONF_THRESHOLD (LOW <= CONF_THRESHOLD < HIGH) ไม่งั้น status อาจต่างจากรอบเต็ม
+CASCADE_BAND_LOW = float(os.getenv("CASCADE_BAND_LOW", 0.1))
+CASCADE_BAND_HIGH = float(os.getenv("CASCADE_BAND_HIGH", 0.45))
+
+# --- inference server แยก process (backend/infer_server.py, MODEL_BACKEND=remote ฝั่ง API) ---
+INFER_SERVER_ADDRESS = os.getenv("INFER_SERVER_ADDRESS") or None    # path ฐานของ Unix socket (จริงคือ <path>.0 … <path>.N-1)
+INFER_SERVER_PROCS = int(os.getenv("INFER_SERVER_PROCS", 1))        # จำนวน inference process (ตั้งให้ตรงกันทั้งฝั่ง server และ API)
+INFER_SERVER_BACKEND = os.getenv("INFER_SERVER_BACKEND", "ultralytics")  # backend ของโมเดลฝั่ง server (ultralytics | onnx | openvino)
+INFER_SERVER_AUTHKEY = os.getenv("INFER_SERVER_AUTHKEY", "3dprint-infer")  # HMAC handshake ของ socket
+INFER_SERVER_BATCH = int(os.getenv("INFER_SERVER_BATCH", max(1, BATCH_MAX_SIZE)))     # batch ข้าม API worker ต่อ process
+INFER_SERVER_BATCH_WAIT_MS = float(os.getenv("INFER_SERVER_BATCH_WAIT_MS", BATCH_MAX_WAIT_MS))
+INFER_SERVER_TIMEOUT = float(os.getenv("INFER_SERVER_TIMEOUT", 30))                # seconds ต่อ predict (เกิน = 503)
+INFER_SERVER_CONNECT_TIMEOUT = float(os.getenv("INFER_SERVER_CONNECT_TIMEOUT", 120))  # รอ server โหลดโมเดลตอน start
+INFER_RING_SLOTS = int(os.getenv("INFER_RING_SLOTS", INFER_WORKERS))  # ช่องเฟรมใน shared memory ต่อ API worker (= งาน infer พร้อมกัน)
+INFER_SLOT_BYTES = int(os.getenv("INFER_SLOT_BYTES", 4 * 1024 * 1024))  # ต่อช่อง (4 MB ≈ 1600×870 BGR; ใหญ่กว่านี้ส่งแบบ pickle)
+
+# --- async job mode (backend/jobs.py) ---
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", INFER_WORKERS))  # coroutine ที่ดึงงานจากคิว (ถูกจำกัดด้วย inference pool อีกชั้น)
+JOB_POLL_INTERVAL = 1.0          # seconds (เผื่องานจาก process อื่นที่ไม่ได้ปลุกเรา)
+JOB_LEASE_SECONDS = 300          # running เกินนี้ถือว่า worker ตาย → หยิบใหม่
+JOB_MAX_ATTEMPTS = 3
+JOB_RETENTION = 60 * 60 * 24     # seconds ที่เก็บงาน done/failed ไว้ให้ GET /jobs/{id}
+
+# --- detection result cache (backend/cache.py) ---
+DETECT_CACHE_SIZE = int(os.getenv("DETECT_CACHE_SIZE", 256))                    # จำนวน entry สูงสุด (0 = ปิด)
+DETECT_CACHE_MAX_BYTES = int(os.getenv("DETECT_CACHE_MAX_BYTES", 64 * 1024 * 1024))  # รวมขนาด entry (JSON ของผล detect)
+DETECT_CACHE_TTL = float(os.getenv("DETECT_CACHE_TTL", 600))                    # seconds
+
+# --- frame-change gate (backend/gate.py) ---
+GATE_DIFF_THRESHOLD = float(os.getenv("GATE_DIFF_THRESHOLD", 3.0))  # mean abs diff (0-255) ของภาพย่อ grayscale; <=0 = ปิด
+GATE_MAX_AGE = float(os.getenv("GATE_MAX_AGE", 60))                 # seconds — บังคับ infer เต็มอย่างน้อยทุก ๆ เท่านี้
+GATE_MAX_CARDS = int(os.getenv("GATE_MAX_CARDS", 4096))             # จำนวน card ที่จำ state ไว้ (LRU)
+GATE_THUMB_SIZE = 64                                                # ขนาดภาพย่อ (px) ที่ใช้เทียบ
+
+# --- streaming upload ingestion (backend/ingest.py) ---
+INGEST_CHUNK_SIZE = 1024 * 1024     # รวม chunk จาก socket ให้ได้ ~1MB ก่อนส่งเข้า parser/เขียนดิสก์
+INGEST_BODY_SLACK = 64 * 1024       # เผื่อ multipart headers/boundary เกินขนาดไฟล์
+
+# --- bulk upload (POST /cards/batch) ---
+CARDS_BATCH_MAX_FILES = int(os.getenv("CARDS_BATCH_MAX_FILES", 64))                 # ภาพสูงสุดต่อ request
+CARDS_BATCH_MAX_BYTES = int(os.getenv("CARDS_BATCH_MAX_BYTES", 256 * 1024 * 1024))  # body รวม (multipart/zip)
+CARDS_BATCH_CHUNK = int(os.getenv("CARDS_BATCH_CHUNK", max(1, BATCH_MAX_SIZE)))     # ภาพต่อ 1 งานใน inference pool (predict ครั้งเดียว)
+CARDS_BATCH_INFLIGHT = 2    # ก้อนที่รันพร้อมกันต่อ request (decode ก้อนถัดไประหว่าง predict ก้อนนี้)
+
+# --- detection history (backend/history.py) ---
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "1") == "1"
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", 1.0))   # seconds — รวมแถวแล้วเขียนใน transaction เดียว
+HISTORY_FLUSH_ROWS = 500                                                     # buffer ถึงเท่านี้ → เขียนทันทีไม่รอรอบ
+HISTORY_MAX_BUFFER = 50_000                                                  # DB เขียนไม่ทัน → ทิ้งแถวเก่าสุด (แรมไม่โต)
+HISTORY_RAW_RETENTION = float(os.getenv("HISTORY_RAW_RETENTION", 24 * 3600))          # seconds ที่เก็บผลรายภาพ
+HISTORY_MINUTE_RETENTION = float(os.getenv("HISTORY_MINUTE_RETENTION", 7 * 24 * 3600))  # rollup รายนาที
+HISTORY_HOUR_RETENTION = float(os.getenv("HISTORY_HOUR_RETENTION", 365 * 24 * 3600))   # rollup รายชั่วโมง
+HISTORY_PURGE_INTERVAL = 600.0
+HISTORY_PURGE_BATCH = 5000      # ลบทีละกี่แถวต่อ transaction
+HISTORY_MAX_POINTS = int(os.getenv("HISTORY_MAX_POINTS", 5000))   # จุดสูงสุดต่อ GET /cards/{id}/history
+
+# --- decode stage (backend/decode.py) ---
+DECODE_POLICY = os.getenv("DECODE_POLICY", "auto")  # full = decode เต็ม (แบบเดิม) / auto / reduced / resize
+DECODE_TARGET_SIZE = int(os.getenv("DECODE_TARGET_SIZE", 640))  # ควรตรงกับ imgsz ของโมเดล
+ANNOTATE_FULL_RES = os.getenv("ANNOTATE_FULL_RES", "0") == "1"  # วาดผลบนภาพความละเอียดเต็ม (ต้อง decode เต็มอีกรอบ)
+
+# --- lazy rendering ของภาพผลลัพธ์ (backend/render.py) ---
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", 512))
+RENDER_CACHE_MAX_BYTES = int(os.getenv("RENDER_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+RENDER_CACHE_TTL = float(os.getenv("RENDER_CACHE_TTL", 3600))
+RENDER_JPEG_QUALITY = int(os.getenv("RENDER_JPEG_QUALITY", 90))
+RENDER_WEBP_QUALITY = int(os.getenv("RENDER_WEBP_QUALITY", 80))
+RENDER_THUMB_SIZES = (160, 320, 640)   # ค่า ?size= ที่อนุญาต (ความกว้าง px)
+RESULT_HOT_SIZE = int(os.getenv("RESULT_HOT_SIZE", 256))   # sidecar ล่าสุดที่ถือไว้ในแรม (เสิร์ฟ/ตอบ 304 โดยไม่แตะดิสก์)
+RESULT_HOT_TTL = float(os.getenv("RESULT_HOT_TTL", 60))      # หลาย process: sidecar ที่ process อื่นเขียนทับจะเห็นช้าสุดเท่านี้
+
+# --- SQLite (backend/database.py) ---
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 8))          # connection ที่เปิดค้างไว้ใช้ซ้ำ (= thread ของ db executor)
+DB_BUSY_TIMEOUT = 5.0                                       # seconds ที่รอ lock ก่อน "database is locked"
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))   # seconds ที่รอ connection ว่างใน pool (เกิน = 503 + Retry-After)
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")      # WAL + NORMAL: ไม่เสียข้อมูลตอน app crash, เร็วกว่า FULL มาก
+DB_CACHE_SIZE_KB = 16 * 1024                                # page cache ต่อ connection
+DB_MMAP_SIZE = 256 * 1024 * 1024
+DB_STATEMENT_CACHE = 256                                    # prepared statements ที่ cache ต่อ connection
+
+# --- GET /cards (keyset pagination + streaming) ---
+LIST_DEFAULT_LIMIT = 50
+LIST_MAX_LIMIT = int(os.getenv("LIST_MAX_LIMIT", 1000))
+LIST_CHUNK_BYTES = 64 * 1024   # รวมแถวเป็นก้อนก่อนส่ง (ไม่ส่งทีละแถว)
+
+# --- temp files expiry (backend/temp_store.py) ---
+TEMP_SWEEP_INTERVAL = float(os.getenv("TEMP_SWEEP_INTERVAL", 60))  # sweeper ตื่นอย่างน้อยทุก ๆ กี่วินาที
+TEMP_SWEEP_BATCH = 1000                                             # ลบทีละกี่ path ต่อรอบย่อย
+
+# --- content-addressed blob store ของไฟล์อัปโหลด (backend/blobstore.py) ---
+BLOB_ROOT = os.getenv("BLOB_ROOT")   # ไม่ตั้ง → <tempdir>/3dprint_blobs
+BLOB_QUOTA_BYTES = int(os.getenv("BLOB_QUOTA_BYTES", 2 * 1024 * 1024 * 1024))   # เกิน → ลบ blob ที่ใช้ล่าสุดนานสุดก่อน
+
+# --- API key cache (backend/database.py) ---
+APIKEY_CACHE_SIZE = int(os.getenv("APIKEY_CACHE_SIZE", 10000))
+APIKEY_CACHE_TTL = float(os.getenv("APIKEY_CACHE_TTL", 60))   # ถือ entry ไว้นานสุดกี่วินาที (process อื่น mark used จะเห็นช้าสุดเท่านี้)
+APIKEY_PURGE_INTERVAL = float(os.getenv("APIKEY_PURGE_INTERVAL", 600))
+APIKEY_PURGE_BATCH = 500                                         # ลบ key หมดอายุทีละกี่แถวต่อ transaction
+
+# --- webhook delivery (backend/webhooks.py) ---
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", 5))
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", 64))   # ส่งพร้อมกันได้ทั้งหมด (= ขนาด connection pool)
+WEBHOOK_PER_HOST = int(os.getenv("WEBHOOK_PER_HOST", 4))          # ส่งพร้อมกันต่อ host ปลายทาง
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", 8))
+WEBHOOK_BACKOFF_BASE = float(os.getenv("WEBHOOK_BACKOFF_BASE", 1.0))   # 1, 2, 4, 8, ... วินาที
+WEBHOOK_BACKOFF_MAX = 600.0
+WEBHOOK_POLL_INTERVAL = 1.0
+WEBHOOK_LEASE_SECONDS = 60      # กำลังส่งค้างเกินนี้ (process ตาย) → ส่งใหม่
+WEBHOOK_RETENTION = 24 * 3600   # เก็บรายการที่ส่งแล้ว/ล้มเหลวไว้ดูกี่วินาที
+
+# --- GET /cards/stream (Server-Sent Events) ---
+EVENTS_HEARTBEAT = 15.0           # ส่ง comment กัน proxy ตัด connection ที่เงียบ
+EVENTS_MAX_STREAM_SECONDS = 300   # ปิด stream เป็นระยะ (EventSource ต่อใหม่เอง) → shutdown ไม่ค้าง
+
+# --- metrics + logging (backend/metrics.py, backend/logs.py) ---
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "printdetect")   # prefix ของชื่อ metric ที่ /metrics
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()                  # DEBUG = log ผล detect รายภาพ (ตาม sample)
+LOG_DETECT_SAMPLE = float(os.getenv("LOG_DETECT_SAMPLE", 0.01))     # สัดส่วนของ detect ที่ log กรอบที่เจอ (ที่ DEBUG)
@@ -1,11 +1,37 @@
 import sqlite3
+import sys
+import base64
 import json
 import time
+import queue
+import asyncio
+import threading
+import logging
 import secrets, hashlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
 from pathlib import Path
 
+from backend.cache import LRUCache
+from backend.metrics import APIKEY_SECONDS, DB_SECONDS
+from backend.events import broker
+from backend.executor import QueueFull
+from backend.config import (
+    DB_POOL_SIZE, DB_BUSY_TIMEOUT, DB_POOL_TIMEOUT, DB_SYNCHRONOUS,
+    DB_CACHE_SIZE_KB, DB_MMAP_SIZE, DB_STATEMENT_CACHE,
+    INFER_RETRY_AFTER,
+    APIKEY_CACHE_SIZE, APIKEY_CACHE_TTL, APIKEY_PURGE_INTERVAL, APIKEY_PURGE_BATCH,
+)
+
 DB_PATH = Path("backend/database.db")
 
+log = logging.getLogger(__name__)
+_T_UPSERT = DB_SECONDS.labels("upsert_card")
+_T_UPSERT_MANY = DB_SECONDS.labels("upsert_cards")
+_T_KEYS_MANY = DB_SECONDS.labels("resolve_apikeys")
+_T_HISTORY = DB_SECONDS.labels("write_history")
+
 DDL_CARDS = """
 CREATE TABLE IF NOT EXISTS cards (
     card_id TEXT PRIMARY KEY,
@@ -26,21 +52,243 @@ CREATE TABLE IF NOT EXISTS apikeys (
 );
 """
 
+DDL_JOBS = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    card_id TEXT NOT NULL,
+    kind TEXT NOT NULL,                 -- create / replace
+    status TEXT NOT NULL,               -- queued / running / done / failed
+    session_id TEXT NOT NULL,
+    upload_path TEXT NOT NULL,          -- ไฟล์อัปโหลดที่ spool ไว้ใน temp
+    callback_url TEXT,
+    cache_bust INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result_json TEXT,                   -- Card payload เมื่อ done
+    error TEXT,
+    created_at REAL NOT NULL,           -- epoch seconds
+    updated_at REAL NOT NULL            -- epoch seconds (ใช้เป็น lease ตอน running)
+);
+"""
+
+DDL_WEBHOOKS = """
+CREATE TABLE IF NOT EXISTS webhook_outbox (
+    card_id TEXT NOT NULL,
+    url TEXT NOT NULL,
+    host TEXT NOT NULL,                 -- ใช้จำกัดจำนวนส่งพร้อมกันต่อปลายทาง
+    payload_json TEXT NOT NULL,         -- payload ล่าสุดของ card (อันเก่าที่ยังไม่ได้ส่งถูกทับ)
+    seq INTEGER NOT NULL DEFAULT 1,     -- +1 ทุกครั้งที่ payload ถูกทับ
+    status TEXT NOT NULL,               -- pending / delivered / failed
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,      -- epoch seconds (backoff)
+    lease_until REAL,                   -- กำลังส่งอยู่ (กันส่งซ้อนของ card เดียวกัน)
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (card_id, url)
+);
+"""
+
+# ---- detection history: คะแนนเป็นคอลัมน์ตัวเลข s0..s7 (slot ของ label ตาม history_labels) แทน JSON ----
+# คะแนน 0 (label ที่ไม่เจอ) SQLite เก็บเป็น 0 byte → ช่องว่างไม่กินที่
+HISTORY_SLOTS = 8
+_SLOTS = range(HISTORY_SLOTS)
+
+DDL_HISTORY_LABELS = """
+CREATE TABLE IF NOT EXISTS history_labels (
+    slot INTEGER PRIMARY KEY,           -- 0..HISTORY_SLOTS-1 → คอลัมน์ s<slot> / sum<slot> / max<slot>
+    label TEXT NOT NULL UNIQUE          -- ชื่อ class เช่น spaghetti
+);
+"""
+
+DDL_HISTORY = """
+CREATE TABLE IF NOT EXISTS card_history (
+    card_id TEXT NOT NULL,
+    ts INTEGER NOT NULL,                -- epoch ms
+    status INTEGER NOT NULL,            -- 0 NORMAL / 1 FAIL / 2 NOT_3DPRINT_PART / 3 อื่น ๆ
+    %s
+);
+""" % ",\n    ".join(f"s{i} REAL NOT NULL DEFAULT 0" for i in _SLOTS)
+
+# rollup รายนาที/ชั่วโมง (เก็บผลรวม → avg = sum / n ตอนอ่าน)
+HISTORY_ROLLUPS = {"minute": ("card_history_1m", 60), "hour": ("card_history_1h", 3600)}
+DDL_HISTORY_ROLLUP = """
+CREATE TABLE IF NOT EXISTS {table} (
+    card_id TEXT NOT NULL,
+    bucket INTEGER NOT NULL,            -- epoch seconds ต้นช่วง
+    n INTEGER NOT NULL,
+    n_fail INTEGER NOT NULL,
+    n_normal INTEGER NOT NULL,
+    n_not3d INTEGER NOT NULL,
+    %s,
+    %s,
+    PRIMARY KEY (card_id, bucket)
+) WITHOUT ROWID;
+""" % (",\n    ".join(f"sum{i} REAL NOT NULL DEFAULT 0" for i in _SLOTS),
+       ",\n    ".join(f"max{i} REAL NOT NULL DEFAULT 0" for i in _SLOTS))
+
 DDL_INDEXES = """
 CREATE INDEX IF NOT EXISTS idx_keys_card ON apikeys(card_id);
 CREATE INDEX IF NOT EXISTS idx_keys_exp ON apikeys(expires_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at);
+CREATE INDEX IF NOT EXISTS idx_webhooks_due ON webhook_outbox(status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS idx_cards_updated ON cards(updated_at DESC, card_id DESC);
+CREATE INDEX IF NOT EXISTS idx_cards_status_updated ON cards(status, updated_at DESC, card_id DESC);
+CREATE INDEX IF NOT EXISTS idx_history_card ON card_history(card_id, ts);
+CREATE INDEX IF NOT EXISTS idx_history_ts ON card_history(ts);
+CREATE INDEX IF NOT EXISTS idx_history_1m_bucket ON card_history_1m(bucket);
+CREATE INDEX IF NOT EXISTS idx_history_1h_bucket ON card_history_1h(bucket);
 """
 
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",              # reader ไม่บล็อก writer (และกลับกัน)
+    f"PRAGMA synchronous={DB_SYNCHRONOUS}",
+    f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}",
+    f"PRAGMA mmap_size={DB_MMAP_SIZE}",
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+class DBBusy(QueueFull):
+    """รอ connection ว่างใน pool เกิน DB_POOL_TIMEOUT — ตอบ 503 + Retry-After เหมือนคิว inference เต็ม"""
+
+    def __init__(self, retry_after: int = INFER_RETRY_AFTER):
+        Exception.__init__(self, "Database busy, retry later")
+        self.retry_after = retry_after
+
+
+class ConnectionPool:
+    """
+    pool ของ sqlite3 connection ที่เปิดค้างไว้ (thread-safe)
+    - ไม่ต้อง connect + ตั้ง pragma ใหม่ทุก call
+    - prepared statement ถูก cache ต่อ connection (cached_statements) → SQL เดิมไม่ต้อง compile ซ้ำ
+    """
+
+    def __init__(self, path: Path, size: int, timeout: float = DB_POOL_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._all: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=DB_BUSY_TIMEOUT,
+            check_same_thread=False,            # ใช้ข้าม thread ได้ (แต่ทีละ thread ผ่าน pool)
+            cached_statements=DB_STATEMENT_CACHE,
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        with self._lock:
+            self._all.append(conn)
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        # ไม่รอไม่มีกำหนด: connection ถูกยืมค้างหมด → 503 ให้ client ถอย แทนที่ทุก DB call จะค้างตาม
+        if not self._slots.acquire(timeout=self.timeout):
+            raise DBBusy()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            try:
+                return self._connect()
+            except Exception:
+                self._slots.release()
+                raise
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        self._idle.put(conn)
+        self._slots.release()
+
+    def close(self) -> None:
+        with self._lock:
+            conns, self._all = self._all, []
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+_pool: ConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ConnectionPool:
+    global _pool
+    pool = _pool
+    if pool is None or pool.path != DB_PATH:
+        with _pool_lock:
+            if _pool is None or _pool.path != DB_PATH:
+                if _pool is not None:
+                    _pool.close()
+                _pool = ConnectionPool(DB_PATH, DB_POOL_SIZE)
+            pool = _pool
+    return pool
+
+
+@contextmanager
 def get_conn():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """ยืม connection จาก pool; จบ block แล้ว commit (หรือ rollback ถ้า error) แล้วคืน pool"""
+    pool = _get_pool()
+    conn = pool.acquire()
+    try:
+        with conn:
+            yield conn
+    finally:
+        pool.release(conn)
+
+
+# --------- async interface ---------
+# executor แยกของ DB (ขนาดเท่า pool) → handler แบบ async ไม่บล็อก event loop
+# และไม่แย่ง thread กับ inference pool / default executor
+_executor: ThreadPoolExecutor | None = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _pool_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+    return _executor
+
+
+async def run(fn, *args, **kwargs):
+    """เรียกฟังก์ชัน DB แบบ sync ใน db executor เช่น await db.run(db.get_card, card_id)"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), partial(fn, *args, **kwargs))
+
+
+def run_detached(fn, *args, **kwargs):
+    """เหมือน run() แต่ไม่รอผล — ใช้ตอน await ไม่ได้แล้ว (เช่น finally ของ stream ที่ client ตัดไป)"""
+    return _get_executor().submit(partial(fn, *args, **kwargs))
+
+
+def close_pool() -> None:
+    """ปิด connection ทั้งหมด + db executor (เรียกตอน shutdown)"""
+    global _pool, _executor
+    with _pool_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+        if _pool is not None:
+            _pool.close()
+            _pool = None
 
 def init_db():
     with get_conn() as conn:
         cur = conn.cursor()
         cur.execute(DDL_CARDS)
         cur.execute(DDL_APIKEYS)
+        cur.execute(DDL_JOBS)
+        cur.execute(DDL_WEBHOOKS)
+        cur.execute(DDL_HISTORY_LABELS)
+        cur.execute(DDL_HISTORY)
+        for table, _ in HISTORY_ROLLUPS.values():
+            cur.execute(DDL_HISTORY_ROLLUP.format(table=table))
         for stmt in DDL_INDEXES.strip().splitlines():
             if stmt.strip():
                 cur.execute(stmt)
@@ -51,32 +299,62 @@ def _sha256(s: str) -> str:
     return hashlib.sha256(s.encode()).hexdigest()
 
 # --------- Cards CRUD ---------
+_UPSERT_CARD = """
+    INSERT INTO cards (card_id, detected_image_url, status, scores_json, updated_at, model)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(card_id) DO UPDATE SET
+        detected_image_url = excluded.detected_image_url,
+        status = excluded.status,
+        scores_json = excluded.scores_json,
+        updated_at = excluded.updated_at,
+        model = excluded.model
+"""
+
+
+def _card_params(card: dict) -> tuple:
+    return (
+        card["card_id"],
+        card["detected_image_url"],
+        card.get("status", "PENDING"),
+        json.dumps(card.get("scores", {})),
+        card.get("updated_at"),
+        card.get("model", "unknown"),
+    )
+
+
+def _publish_card(card: dict) -> None:
+    # แจ้ง subscriber ของ GET /cards/stream (หลัง commit แล้วเท่านั้น)
+    broker.publish({
+        "card_id": card["card_id"],
+        "detected_image_url": card["detected_image_url"],
+        "status": card.get("status", "PENDING"),
+        "scores": card.get("scores", {}),
+        "updated_at": card.get("updated_at"),
+        "model": card.get("model", "unknown"),
+        "reused": card.get("reused", False),
+    })
+
+
 def upsert_card(card: dict):
     """
     บันทึกหรืออัปเดตการ์ดในตาราง cards
     - ถ้า card_id ยังไม่มี → INSERT ใหม่
     - ถ้ามีแล้ว → UPDATE ค่า image, status, scores, updated_at, model
     """
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO cards (card_id, detected_image_url, status, scores_json, updated_at, model)
-            VALUES (?, ?, ?, ?, ?, ?)
-            ON CONFLICT(card_id) DO UPDATE SET
-                detected_image_url = excluded.detected_image_url,
-                status = excluded.status,
-                scores_json = excluded.scores_json,
-                updated_at = excluded.updated_at,
-                model = excluded.model
-        """, (
-            card["card_id"],
-            card["detected_image_url"],
-            card.get("status", "PENDING"),
-            json.dumps(card.get("scores", {})),
-            card.get("updated_at"),
-            card.get("model", "unknown")
-        ))
-        conn.commit()
+    with _T_UPSERT.time(), get_conn() as conn:
+        conn.execute(_UPSERT_CARD, _card_params(card))
+    _publish_card(card)
+
+
+def upsert_cards(cards: list[dict]) -> int:
+    """upsert หลายการ์ดใน transaction เดียว (POST /cards/batch) — card ซ้ำ: ตัวหลังสุดชนะ"""
+    if not cards:
+        return 0
+    with _T_UPSERT_MANY.time(), get_conn() as conn:
+        conn.executemany(_UPSERT_CARD, [_card_params(c) for c in cards])
+    for card in cards:
+        _publish_card(card)
+    return len(cards)
 
 def get_card(card_id: str) -> dict | None:
     with get_conn() as conn:
@@ -94,24 +372,93 @@ def get_card(card_id: str) -> dict | None:
             "model": row["model"],
         }
 
-def list_cards(limit: int = 50, cursor: str | None = None) -> list[dict]:
+# --------- Listing (keyset pagination) ---------
+def encode_cursor(updated_at: str, card_id: str) -> str:
+    """cursor แบบ opaque = base64url ของ (updated_at, card_id) ของแถวสุดท้ายในหน้า"""
+    raw = json.dumps([updated_at, card_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    """แปลง cursor กลับเป็น (updated_at, card_id) — ผิดรูปแบบ → ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        updated_at, card_id = json.loads(raw)
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+    if not isinstance(updated_at, str) or not isinstance(card_id, str):
+        raise ValueError("invalid cursor")
+    return updated_at, card_id
+
+
+def fetch_cards(limit: int, after: tuple[str, str] | None = None,
+                statuses: list[str] | None = None) -> list[sqlite3.Row]:
+    """
+    แถวของหน้าหนึ่ง เรียงตาม (updated_at, card_id) ใหม่ → เก่า
+    after = key ของแถวสุดท้ายในหน้าก่อน (seek ผ่าน index แทน OFFSET)
+    อ่านทั้งหน้า (≤ LIST_MAX_LIMIT + 1 แถว) แล้วคืน connection ทันที — ไม่ถือ connection ไว้ระหว่างส่งให้ client
+    """
+    where, params = [], []
+    if statuses:
+        where.append(f"status IN ({','.join('?' * len(statuses))})")
+        params.extend(statuses)
+    if after is not None:
+        where.append("(updated_at, card_id) < (?, ?)")
+        params.extend(after)
+    sql = "SELECT card_id, detected_image_url, status, scores_json, updated_at, model FROM cards"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY updated_at DESC, card_id DESC LIMIT ?"
+    params.append(limit)
     with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM cards ORDER BY updated_at DESC LIMIT ?", (limit,))
-        rows = cur.fetchall()
-        items = []
-        for r in rows:
-            items.append({
-                "card_id": r["card_id"],
-                "detected_image_url": r["detected_image_url"],
-                "status": r["status"],
-                "scores": json.loads(r["scores_json"]),
-                "updated_at": r["updated_at"],
-                "model": r["model"],
-            })
-        return items
+        return conn.execute(sql, params).fetchall()
+
+
+def list_cards(limit: int = 50, cursor: str | None = None,
+               statuses: list[str] | None = None) -> tuple[list[dict], str | None]:
+    """คืน (items, next_cursor) — next_cursor = None เมื่อไม่มีหน้าถัดไป"""
+    after = decode_cursor(cursor) if cursor else None
+    rows = fetch_cards(limit + 1, after, statuses)
+    more = len(rows) > limit
+    items = [{
+        "card_id": r["card_id"],
+        "detected_image_url": r["detected_image_url"],
+        "status": r["status"],
+        "scores": json.loads(r["scores_json"]),
+        "updated_at": r["updated_at"],
+        "model": r["model"],
+    } for r in rows[:limit]]
+    next_cursor = encode_cursor(rows[limit - 1]["updated_at"], rows[limit - 1]["card_id"]) if more else None
+    return items, next_cursor
 
 # --------- API Keys (hashed) ---------
+# cache ในแรม: key hash → (card_id, expires_at, used) — เช็ค key ตอนอัปโหลดไม่ต้องแตะ SQLite
+# (จำกัดจำนวน entry + TTL; mark_apikey_used อัปเดต entry ทันที)
+key_cache = LRUCache(APIKEY_CACHE_SIZE, sys.maxsize, APIKEY_CACHE_TTL)
+_SQL_VARS_MAX = 500    # ตัวแปรต่อ statement (SQLite เก่าจำกัด 999)
+_T_KEY_UNKNOWN = APIKEY_SECONDS.labels("unknown")
+
+
+def _key_record(key_hash: str) -> tuple[str, float, int] | None:
+    t0 = time.perf_counter()
+    rec = key_cache.get(key_hash)
+    source = "cache"
+    if rec is None:
+        with get_conn() as conn:
+            row = conn.execute("SELECT card_id, expires_at, used FROM apikeys WHERE api_key = ?",
+                               (key_hash,)).fetchone()
+        if not row:
+            _T_KEY_UNKNOWN.observe(time.perf_counter() - t0)
+            return None
+        rec = (row["card_id"], row["expires_at"], row["used"])
+        key_cache.put(key_hash, rec)
+        source = "db"
+    APIKEY_SECONDS.labels(source).observe(time.perf_counter() - t0)
+    if rec[1] < time.time():
+        key_cache.pop(key_hash)  # หมดอายุ → ไม่ต้องถือไว้
+    return rec
+
+
 def create_apikey(card_id: str, ttl_seconds: int) -> dict:
     """Generate key (plain), store only hash"""
     plain_key = secrets.token_urlsafe(32)
@@ -123,24 +470,21 @@ def create_apikey(card_id: str, ttl_seconds: int) -> dict:
         cur.execute("INSERT INTO apikeys(api_key, card_id, expires_at, used) VALUES (?, ?, ?, 0)",
                     (key_hash, card_id, expires_at))
         conn.commit()
+    key_cache.put(key_hash, (card_id, expires_at, 0))
     return {"api_key": plain_key, "card_id": card_id, "expires_at": expires_at}
 
 def verify_apikey(api_key: str, card_id: str) -> bool:
     now = time.time()
-    key_hash = _sha256(api_key)
-    with get_conn() as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT card_id, expires_at, used FROM apikeys WHERE api_key = ?", (key_hash,))
-        row = cur.fetchone()
-        if not row:
-            return False
-        if row["card_id"] != card_id:
-            return False
-        if row["expires_at"] < now:
-            return False
-        if row["used"] == 1:  # already used
-            return False
-        return True
+    rec = _key_record(_sha256(api_key))
+    if not rec:
+        return False
+    if rec[0] != card_id:
+        return False
+    if rec[1] < now:
+        return False
+    if rec[2] == 1:  # already used
+        return False
+    return True
 
 def mark_apikey_used(api_key: str):
     key_hash = _sha256(api_key)
@@ -148,20 +492,334 @@ def mark_apikey_used(api_key: str):
         cur = conn.cursor()
         cur.execute("UPDATE apikeys SET used = 1 WHERE api_key = ?", (key_hash,))
         conn.commit()
+    key_cache.pop(key_hash)
 def get_card_id_by_apikey(api_key: str) -> str | None:
     now = time.time()
-    key_hash = _sha256(api_key)   # ✅ ต้องแฮชก่อน
+    rec = _key_record(_sha256(api_key))   # ✅ ต้องแฮชก่อน
+    if not rec:
+        return None
+    if rec[1] < now:
+        return None
+    if rec[2] == 1:
+        return None
+    return rec[0]
+
+def resolve_apikeys(api_keys: list[str]) -> dict[str, str]:
+    """
+    ตรวจหลาย key ทีเดียว (POST /cards/batch): คืน {api_key: card_id} เฉพาะ key ที่ยังใช้ได้
+    key ที่ไม่อยู่ใน cache ถูกหาใน query เดียว (แบ่งก้อนตามขีดจำกัดตัวแปรของ SQLite)
+    """
+    now = time.time()
+    hashes = {k: _sha256(k) for k in set(api_keys)}
+    recs: dict[str, tuple] = {}
+    misses = []
+    for h in hashes.values():
+        rec = key_cache.get(h)
+        if rec is None:
+            misses.append(h)
+        else:
+            recs[h] = rec
+    if misses:
+        with _T_KEYS_MANY.time(), get_conn() as conn:
+            for i in range(0, len(misses), _SQL_VARS_MAX):
+                part = misses[i:i + _SQL_VARS_MAX]
+                rows = conn.execute(
+                    f"SELECT api_key, card_id, expires_at, used FROM apikeys "
+                    f"WHERE api_key IN ({','.join('?' * len(part))})", part)
+                for row in rows:
+                    rec = (row["card_id"], row["expires_at"], row["used"])
+                    recs[row["api_key"]] = rec
+                    if rec[1] >= now:
+                        key_cache.put(row["api_key"], rec)
+    out = {}
+    for key, h in hashes.items():
+        rec = recs.get(h)
+        if rec and rec[1] >= now and rec[2] != 1:
+            out[key] = rec[0]
+    return out
+
+def purge_expired_apikeys(batch: int = APIKEY_PURGE_BATCH) -> int:
+    """ลบ key หมดอายุทีละ batch (transaction สั้น ๆ ไม่ถือ write lock นาน) → คืนจำนวนที่ลบ"""
+    now = time.time()
+    total = 0
+    while True:
+        with get_conn() as conn:
+            n = conn.execute(
+                "DELETE FROM apikeys WHERE rowid IN "
+                "(SELECT rowid FROM apikeys WHERE expires_at < ? LIMIT ?)",
+                (now, batch),
+            ).rowcount
+        total += n
+        if n < batch:
+            return total
+
+async def purge_apikeys_forever(interval: float = APIKEY_PURGE_INTERVAL) -> None:
+    """background task (เริ่มจาก lifespan): ล้าง key หมดอายุเป็นระยะ"""
+    while True:
+        try:
+            n = await run(purge_expired_apikeys)
+            if n:
+                log.info("purged %d expired api keys", n)
+        except Exception as e:
+            log.warning("api key purge failed: %s", e)
+        await asyncio.sleep(interval)
+
+# --------- Jobs (async upload queue) ---------
+def _job_row(row) -> dict:
+    job = dict(row)
+    job["result"] = json.loads(job.pop("result_json")) if job.get("result_json") else None
+    return job
+
+def create_job(job_id: str, card_id: str, kind: str, session_id: str, upload_path: str,
+               callback_url: str | None = None, cache_bust: bool = False) -> dict:
+    now = time.time()
     with get_conn() as conn:
         cur = conn.cursor()
-        cur.execute(
-            "SELECT card_id, expires_at, used FROM apikeys WHERE api_key = ?",
-            (key_hash,),
-        )
+        cur.execute("""
+            INSERT INTO jobs (job_id, card_id, kind, status, session_id, upload_path,
+                              callback_url, cache_bust, created_at, updated_at)
+            VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?, ?)
+        """, (job_id, card_id, kind, session_id, upload_path, callback_url, int(cache_bust), now, now))
+        conn.commit()
+    return {"job_id": job_id, "card_id": card_id, "kind": kind, "status": "queued",
+            "created_at": now, "updated_at": now}
+
+def claim_next_job(lease_seconds: float) -> dict | None:
+    """
+    หยิบงานถัดไปแบบ atomic (UPDATE ... RETURNING คำสั่งเดียว — ปลอดภัยแม้หลาย process)
+    งานที่ running ค้างเกิน lease (เช่น worker ตายกลางทาง) จะถูกหยิบใหม่
+    """
+    now = time.time()
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ?
+            WHERE job_id = (
+                SELECT job_id FROM jobs
+                WHERE status = 'queued' OR (status = 'running' AND updated_at < ?)
+                ORDER BY created_at LIMIT 1
+            )
+            RETURNING *
+        """, (now, now - lease_seconds))
         row = cur.fetchone()
-        if not row:
-            return None
-        if row["expires_at"] < now:
-            return None
-        if row["used"] == 1:
-            return None
-        return row["card_id"]
+        conn.commit()
+        return _job_row(row) if row else None
+
+def requeue_job(job_id: str):
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE jobs SET status = 'queued', attempts = attempts - 1, updated_at = ? WHERE job_id = ?",
+                    (time.time(), job_id))
+        conn.commit()
+
+def finish_job(job_id: str, result: dict):
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE jobs SET status = 'done', result_json = ?, error = NULL, updated_at = ? WHERE job_id = ?",
+                    (json.dumps(result), time.time(), job_id))
+        conn.commit()
+
+def fail_job(job_id: str, error: str, retry: bool = False):
+    """retry=True → กลับเข้าคิว (ยังมีสิทธิ์ลองใหม่), ไม่งั้น failed ถาวร"""
+    status = "queued" if retry else "failed"
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE job_id = ?",
+                    (status, error, time.time(), job_id))
+        conn.commit()
+
+def get_job(job_id: str) -> dict | None:
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,))
+        row = cur.fetchone()
+        return _job_row(row) if row else None
+
+def count_jobs(status: str = "queued") -> int:
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,))
+        return cur.fetchone()[0]
+
+def purge_jobs(older_than: float) -> int:
+    """ลบงานที่จบแล้ว (done/failed) ที่เก่ากว่า older_than (epoch)"""
+    with get_conn() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (older_than,))
+        conn.commit()
+        return cur.rowcount
+
+# --------- Webhook outbox ---------
+def enqueue_webhook(card_id: str, url: str, host: str, payload: dict) -> bool:
+    """
+    เพิ่ม/ทับ payload ของ (card_id, url) — ค้างส่งอยู่แล้วจะเหลือแค่อันล่าสุด
+    คืน True ถ้าทับของเดิมที่ยังไม่ได้ส่ง (coalesced)
+    """
+    now = time.time()
+    with get_conn() as conn:
+        row = conn.execute("SELECT status FROM webhook_outbox WHERE card_id = ? AND url = ?",
+                           (card_id, url)).fetchone()
+        conn.execute("""
+            INSERT INTO webhook_outbox (card_id, url, host, payload_json, status, next_attempt_at,
+                                        created_at, updated_at)
+            VALUES (?, ?, ?, ?, 'pending', ?, ?, ?)
+            ON CONFLICT (card_id, url) DO UPDATE SET
+                payload_json = excluded.payload_json, seq = seq + 1, status = 'pending',
+                attempts = 0, next_attempt_at = excluded.next_attempt_at, last_error = NULL,
+                updated_at = excluded.updated_at
+        """, (card_id, url, host, json.dumps(payload), now, now, now))
+    return bool(row) and row["status"] == "pending"
+
+def claim_webhooks(limit: int, lease_seconds: float, exclude_hosts: list[str] | None = None) -> list[dict]:
+    """
+    หยิบรายการที่ถึงเวลาส่ง (ไม่ติด lease) แบบ atomic แล้วตั้ง lease
+    lease หมด (worker ตายกลางทาง) → ถูกหยิบใหม่
+    """
+    now = time.time()
+    exclude_hosts = exclude_hosts or []
+    host_filter = f"AND host NOT IN ({','.join('?' * len(exclude_hosts))})" if exclude_hosts else ""
+    with get_conn() as conn:
+        rows = conn.execute(f"""
+            UPDATE webhook_outbox SET lease_until = ?, attempts = attempts + 1, updated_at = ?
+            WHERE rowid IN (
+                SELECT rowid FROM webhook_outbox
+                WHERE status = 'pending' AND next_attempt_at <= ?
+                  AND (lease_until IS NULL OR lease_until < ?) {host_filter}
+                ORDER BY next_attempt_at LIMIT ?
+            )
+            RETURNING card_id, url, host, payload_json, seq, attempts
+        """, (now + lease_seconds, now, now, now, *exclude_hosts, limit)).fetchall()
+    return [dict(r) for r in rows]
+
+def release_webhook(card_id: str, url: str):
+    """คืนรายการที่หยิบมาแต่ยังไม่ได้ส่ง (ไม่นับ attempt)"""
+    with get_conn() as conn:
+        conn.execute("UPDATE webhook_outbox SET lease_until = NULL, attempts = attempts - 1 "
+                     "WHERE card_id = ? AND url = ?", (card_id, url))
+
+def finish_webhook(card_id: str, url: str, seq: int, status: str = "delivered",
+                   error: str | None = None, retry_at: float | None = None) -> bool:
+    """
+    ปิดผลการส่ง payload รุ่น seq: delivered / failed / retry (retry_at = เวลาที่จะลองใหม่)
+    ถ้าระหว่างส่งมี payload ใหม่ทับแล้ว (seq เปลี่ยน) → ปล่อย lease อย่างเดียว คืน False
+    """
+    with get_conn() as conn:
+        cur = conn.execute("""
+            UPDATE webhook_outbox SET status = ?, next_attempt_at = COALESCE(?, next_attempt_at),
+                   last_error = ?, lease_until = NULL, updated_at = ?
+            WHERE card_id = ? AND url = ? AND seq = ?
+        """, ("pending" if retry_at is not None else status, retry_at, error, time.time(), card_id, url, seq))
+        if cur.rowcount:
+            return True
+        conn.execute("UPDATE webhook_outbox SET lease_until = NULL WHERE card_id = ? AND url = ?",
+                     (card_id, url))
+        return False
+
+def next_webhook_due() -> float | None:
+    with get_conn() as conn:
+        row = conn.execute("SELECT MIN(next_attempt_at) FROM webhook_outbox WHERE status = 'pending'").fetchone()
+        return row[0]
+
+def count_webhooks(status: str = "pending") -> int:
+    with get_conn() as conn:
+        return conn.execute("SELECT COUNT(*) FROM webhook_outbox WHERE status = ?", (status,)).fetchone()[0]
+
+def purge_webhooks(older_than: float) -> int:
+    """ลบรายการที่จบแล้ว (delivered/failed) ที่เก่ากว่า older_than (epoch)"""
+    with get_conn() as conn:
+        return conn.execute("DELETE FROM webhook_outbox WHERE status IN ('delivered', 'failed') AND updated_at < ?",
+                            (older_than,)).rowcount
+
+# --------- Detection history (backend/history.py) ---------
+_INSERT_HISTORY = "INSERT INTO card_history (card_id, ts, status, %s) VALUES (?, ?, ?, %s)" % (
+    ", ".join(f"s{i}" for i in _SLOTS), ", ".join("?" * HISTORY_SLOTS))
+
+# รวมเข้ากับช่วงเดิม (ถ้ามี): นับ/ผลรวมบวกเพิ่ม, max เอาค่ามากกว่า
+_UPSERT_ROLLUP = """
+    INSERT INTO {table} (card_id, bucket, n, n_fail, n_normal, n_not3d, %s, %s)
+    VALUES (?, ?, ?, ?, ?, ?, %s)
+    ON CONFLICT(card_id, bucket) DO UPDATE SET
+        n = n + excluded.n,
+        n_fail = n_fail + excluded.n_fail,
+        n_normal = n_normal + excluded.n_normal,
+        n_not3d = n_not3d + excluded.n_not3d,
+        %s
+""" % (
+    ", ".join(f"sum{i}" for i in _SLOTS),
+    ", ".join(f"max{i}" for i in _SLOTS),
+    ", ".join("?" * (2 * HISTORY_SLOTS)),
+    ",\n        ".join([f"sum{i} = sum{i} + excluded.sum{i}" for i in _SLOTS]
+                       + [f"max{i} = max(max{i}, excluded.max{i})" for i in _SLOTS]),
+)
+
+
+def history_slots(labels: set[str] | None = None) -> dict[str, int]:
+    """
+    {label: slot} ทั้งหมด — label ใหม่ใน labels ได้ slot ถัดไป (ร่วมกันทุก process ผ่านตาราง)
+    slot เต็มแล้ว → label นั้นไม่ถูกเก็บใน history
+    อ่าน + จอง slot ใน write transaction เดียว (BEGIN IMMEDIATE) → หลาย process ไม่ได้ slot ซ้ำ/ข้ามกัน
+    """
+    with get_conn() as conn:
+        known = {r["label"]: r["slot"] for r in conn.execute("SELECT slot, label FROM history_labels")}
+        if not (labels or set()) - known.keys():
+            return known
+        conn.execute("BEGIN IMMEDIATE")       # ถือ write lock ตั้งแต่อ่าน → ค่าที่อ่านไม่เปลี่ยนจนกว่าจะ commit
+        known = {r["label"]: r["slot"] for r in conn.execute("SELECT slot, label FROM history_labels")}
+        for label in sorted(labels - known.keys()):
+            slot = len(known)                 # slot ถูกแจกต่อกันจาก 0 และไม่เคยลบ → ตัวถัดไป = จำนวนที่มี
+            if slot >= HISTORY_SLOTS:
+                break
+            conn.execute("INSERT INTO history_labels (slot, label) VALUES (?, ?)", (slot, label))
+            known[label] = slot
+    return known
+
+
+def write_history(raw: list[tuple], rollups: dict[str, list[tuple]]) -> None:
+    """
+    แถวรายภาพ + rollup ที่รวมไว้แล้วใน transaction เดียว
+    raw = (card_id, ts_ms, status, s0..s7), rollups = {"minute"/"hour": (card_id, bucket, n, n_fail, n_normal, n_not3d, sum0..7, max0..7)}
+    """
+    with _T_HISTORY.time(), get_conn() as conn:
+        conn.executemany(_INSERT_HISTORY, raw)
+        for resolution, rows in rollups.items():
+            conn.executemany(_UPSERT_ROLLUP.format(table=HISTORY_ROLLUPS[resolution][0]), rows)
+
+
+def read_history(card_id: str, resolution: str, start: float, end: float, limit: int) -> list[sqlite3.Row]:
+    """
+    แถวของ card ในช่วง [start, end) (epoch seconds) เรียงตามเวลา
+    resolution = raw (card_history, ts เป็น ms) หรือ minute / hour (rollup, bucket เป็น s)
+    """
+    if resolution == "raw":
+        sql = ("SELECT ts, status, %s FROM card_history WHERE card_id = ? AND ts >= ? AND ts < ? "
+               "ORDER BY ts LIMIT ?" % ", ".join(f"s{i}" for i in _SLOTS))
+        params = (card_id, int(start * 1000), int(end * 1000), limit)
+    else:
+        table, width = HISTORY_ROLLUPS[resolution]
+        sql = f"SELECT * FROM {table} WHERE card_id = ? AND bucket >= ? AND bucket < ? ORDER BY bucket LIMIT ?"
+        params = (card_id, int(start // width * width), end, limit)
+    with get_conn() as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+def purge_history(older_than: dict[str, float], batch: int) -> int:
+    """
+    ลบ history เก่ากว่า retention ทีละ batch → คืนจำนวนที่ลบ
+    older_than = {"raw" / "minute" / "hour": epoch seconds}
+    """
+    total = 0
+    for resolution, cutoff in older_than.items():
+        if resolution == "raw":
+            sql = "DELETE FROM card_history WHERE rowid IN (SELECT rowid FROM card_history WHERE ts < ? LIMIT ?)"
+            cutoff = int(cutoff * 1000)
+        else:
+            table = HISTORY_ROLLUPS[resolution][0]
+            sql = (f"DELETE FROM {table} WHERE (card_id, bucket) IN "
+                   f"(SELECT card_id, bucket FROM {table} WHERE bucket < ? LIMIT ?)")
+        while True:
+            with get_conn() as conn:
+                n = conn.execute(sql, (cutoff, batch)).rowcount
+            total += n
+            if n < batch:
+                break
+    return total
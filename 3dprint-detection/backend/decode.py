@@ -0,0 +1,104 @@
+# backend/decode.py
+"""
+Decode stage ก่อน inference: YOLO ย่อภาพเหลือ imgsz อยู่แล้ว
+การ decode ภาพ 12MP เต็ม ๆ + แปลงสีจึงเปลืองกว่าตัว inference เอง
+
+policy (DECODE_POLICY):
+- full    : IMREAD_COLOR เต็มความละเอียด (พฤติกรรมเดิม)
+- reduced : JPEG ใช้ IMREAD_REDUCED_COLOR_2/4/8 (libjpeg ย่อระหว่าง decode) ไม่ resize ต่อ
+- resize  : decode เต็มแล้ว resize ครั้งเดียวให้ด้านยาว = target
+- auto    : JPEG → reduced, ไฟล์อื่น (PNG) → resize
+เลือก factor จากขนาดใน header เพื่อให้ด้านยาวยังไม่ต่ำกว่า target
+"""
+import mmap
+import os
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+_REDUCED = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+# SOF markers ที่มีขนาดภาพ (ไม่รวม DHT=C4, JPG=C8, DAC=CC)
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_PNG_SIG = b"\x89PNG\r\n\x1a\n"
+
+
+def load_buffer(src: bytes | Path) -> np.ndarray:
+    """
+    bytes → view ตรง ๆ, path → memory-map ไฟล์ (ไม่ copy เข้า heap)
+    mmap จะถูก unmap เองเมื่อ array ถูกทิ้ง
+    """
+    if isinstance(src, (str, Path)):
+        with open(src, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return np.empty(0, np.uint8)
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return np.frombuffer(mm, np.uint8)
+    return np.frombuffer(src, np.uint8)
+
+
+def is_jpeg(buf) -> bool:
+    return len(buf) > 3 and bytes(buf[:2]) == b"\xff\xd8"
+
+
+def image_size(buf) -> tuple[int, int] | None:
+    """อ่าน (width, height) จาก header ของ JPEG/PNG โดยไม่ decode; ไม่รู้จักคืน None"""
+    mv = memoryview(buf).cast("B")
+    n = len(mv)
+    if n >= 24 and bytes(mv[:8]) == _PNG_SIG:
+        w = int.from_bytes(mv[16:20], "big")
+        h = int.from_bytes(mv[20:24], "big")
+        return w, h
+    if not is_jpeg(mv):
+        return None
+    i = 2
+    while i + 9 < n:
+        if mv[i] != 0xFF:
+            return None
+        marker = mv[i + 1]
+        if marker == 0xFF:          # fill byte
+            i += 1
+            continue
+        if marker in _JPEG_SOF:
+            h = (mv[i + 5] << 8) | mv[i + 6]
+            w = (mv[i + 7] << 8) | mv[i + 8]
+            return w, h
+        if marker == 0xD8 or 0xD0 <= marker <= 0xD7:   # ไม่มี length
+            i += 2
+            continue
+        i += 2 + ((mv[i + 2] << 8) | mv[i + 3])
+    return None
+
+
+def decode_for_inference(buf: np.ndarray, target: int, policy: str = "auto") -> tuple[np.ndarray | None, float]:
+    """
+    คืน (img BGR, scale) โดย scale = ด้านยาวของภาพต้นฉบับ / ด้านยาวของภาพที่คืน (>= 1)
+    ใช้ map กรอบกลับพิกัดเดิมเมื่อต้องการภาพ annotate ความละเอียดเต็ม
+    """
+    if policy == "full":
+        return cv2.imdecode(buf, cv2.IMREAD_COLOR), 1.0
+
+    dims = image_size(buf)
+    img = None
+    if dims is not None and policy in ("auto", "reduced") and is_jpeg(buf):
+        long_side = max(dims)
+        for factor, flag in _REDUCED:
+            if long_side // factor >= target:
+                img = cv2.imdecode(buf, flag)
+                break
+    if img is None:
+        img = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+        if img is None:
+            return None, 1.0
+        if policy in ("auto", "resize"):
+            h, w = img.shape[:2]
+            long_side = max(h, w)
+            if long_side > target:
+                r = target / long_side
+                img = cv2.resize(img, (max(1, round(w * r)), max(1, round(h * r))), interpolation=cv2.INTER_AREA)
+            dims = (w, h)
+    if img is None:
+        return None, 1.0
+
+    orig_long = max(dims) if dims else max(img.shape[:2])
+    return img, max(1.0, orig_long / max(img.shape[:2]))
@@ -0,0 +1,406 @@
+# backend/engines.py
+"""
+Inference backend ของ detect() — เลือกด้วย MODEL_BACKEND ใน backend/config.py
+
+- ultralytics : โหลด .pt ผ่าน ultralytics/PyTorch (แบบเดิม)
+- onnx        : ONNX Runtime (CPUExecutionProvider) — ไฟล์จาก `python -m backend.export --format onnx`
+- openvino    : OpenVINO (CPU) — โฟลเดอร์จาก `python -m backend.export --format openvino`
+  (ใส่ --int8 ตอน export = post-training quantization ด้วยชุดภาพ calibration)
+
+ทุก backend คืนผลรูปแบบเดียวกัน: list (ต่อภาพ) ของ Detection ในพิกัดของภาพที่ส่งเข้าไป
+import onnxruntime / openvino / torch เฉพาะตอนสร้าง engine ที่ใช้จริง
+"""
+import ast
+import hashlib
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from backend.config import (
+    MODEL_PATH, MODEL_BACKEND, MODEL_INT8, MODEL_ARTIFACT,
+    MODEL_IMGSZ, MODEL_IOU, MODEL_MAX_DET, MODEL_THREADS, CASCADE_BACKEND,
+)
+
+BACKENDS = ("ultralytics", "onnx", "openvino", "remote")
+
+_threads_configured = False
+
+
+def configure_threads(threads: int = MODEL_THREADS, backends=(MODEL_BACKEND, CASCADE_BACKEND)) -> None:
+    """
+    ตั้ง intra-op threads ของ torch ครั้งเดียวต่อ process ตอน start (main.py / infer_server.py)
+    torch.set_num_threads มีผลทั้ง process → ไม่ตั้งใน engine/batcher (โหลดเวอร์ชันใหม่หรือมีหลาย batcher จะทับกันเอง)
+    onnxruntime/openvino ตั้ง threads ต่อ session ใน engine; ไม่มี backend ไหนใช้ torch → ไม่ import torch
+    """
+    global _threads_configured
+    if _threads_configured or "ultralytics" not in backends:
+        return
+    try:
+        import torch
+    except ImportError:   # ให้ UltralyticsEngine แจ้ง error ตอนโหลดเอง
+        return
+    torch.set_num_threads(threads)
+    _threads_configured = True
+
+
+@dataclass(frozen=True)
+class Detection:
+    xyxy: tuple[float, float, float, float]
+    conf: float
+    cls: int
+
+
+def artifact_path(backend: str, weights: str = MODEL_PATH, int8: bool = False) -> Path:
+    """path มาตรฐานของไฟล์ที่ export แล้ว: best.pt → best.onnx / best_int8.onnx / best_openvino_model/ ..."""
+    w = Path(weights)
+    stem = f"{w.stem}_int8" if int8 else w.stem
+    if backend == "onnx":
+        return w.with_name(f"{stem}.onnx")
+    if backend == "openvino":
+        return w.with_name(f"{stem}_openvino_model")
+    return w
+
+
+def file_identity(path: str | Path) -> str:
+    # รวม mtime/size ของไฟล์โมเดล → เปลี่ยนไฟล์แล้ว cache เก่าใช้ไม่ได้อัตโนมัติ
+    p = Path(path)
+    if p.is_dir():
+        p = next(iter(sorted(p.glob("*.xml"))), p)
+    try:
+        st = os.stat(p)
+        return f"{p.name}@{st.st_mtime_ns}:{st.st_size}"
+    except OSError:
+        return p.name
+
+
+def file_digest(path: str | Path, length: int = 8) -> str:
+    """sha256 ของไฟล์โมเดล (โฟลเดอร์ = ทุกไฟล์ในนั้น) ย่อ — ใช้เป็นชื่อเวอร์ชันที่ไม่ขึ้นกับ mtime"""
+    p = Path(path)
+    h = hashlib.sha256()
+    for f in sorted(p.rglob("*")) if p.is_dir() else [p]:
+        if f.is_file():
+            with open(f, "rb") as fh:
+                for chunk in iter(lambda: fh.read(1 << 20), b""):
+                    h.update(chunk)
+    return h.hexdigest()[:length]
+
+
+def summarize(dets: list[Detection], names: dict[int, str], threshold: float) -> tuple[dict, str]:
+    """
+    (scores ต่อ label = conf สูงสุด, status รวม) — กติกาเดียวกับที่ detect() ใช้ตัดสิน
+    class 0/1 = ชิ้นงาน 3D print; class อื่น = ไม่ใช่ชิ้นงาน
+    """
+    scores: dict[str, float] = {}
+    has_non_3dprint = False
+    for d in dets:
+        label = names.get(d.cls, f"class_{d.cls}")
+        if d.cls not in [0, 1]:
+            has_non_3dprint = True
+        scores[label] = max(scores.get(label, 0.0), d.conf)
+
+    if not dets:
+        status = "NOT_3DPRINT_PART"
+    elif has_non_3dprint:
+        status = "NOT_3DPRINT_PART"
+    elif scores.get("spaghetti", 0.0) >= threshold:
+        status = "FAIL"
+    else:
+        status = "NORMAL"
+    return scores, status
+
+
+class Engine:
+    name = "base"
+    client_batching = True   # False = ปลายทางรวม batch เอง (remote) → ไม่ต้องมี MicroBatcher ใน worker
+    variable_imgsz = False   # True = predict(..., imgsz=) ย่อ input ได้จริง (cascade แบบ lowres)
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.names: dict[int, str] = {}
+
+    def predict(self, imgs: list, conf: float, imgsz: int | None = None) -> list[list[Detection]]:
+        """
+        imgs = ภาพ BGR (ndarray) หลายภาพ → detections ต่อภาพ (thread-safe)
+        imgsz = ขนาด input ของโมเดลรอบนี้ (None = ค่าปกติ; ใช้ได้เมื่อ variable_imgsz)
+        """
+        raise NotImplementedError
+
+    def identity(self) -> str:
+        return f"{self.name}:{file_identity(self.path)}"
+
+    def version(self) -> str:
+        """ชื่อเวอร์ชันที่บันทึกลง card ("best.pt@1a2b3c4d")"""
+        return f"{self.path.name}@{file_digest(self.path)}"
+
+    def close(self) -> None:
+        """ปล่อยโมเดล/session (เรียกตอน retire เวอร์ชันนี้ หลังไม่มีงานค้างแล้ว)"""
+
+
+# ---------- ultralytics / PyTorch ----------
+class UltralyticsEngine(Engine):
+    name = "ultralytics"
+    variable_imgsz = True
+
+    def __init__(self, path: str | Path, iou: float = MODEL_IOU):
+        super().__init__(path)
+        import torch
+        from ultralytics import YOLO
+
+        torch.serialization.add_safe_globals([
+            torch.nn.modules.container.Sequential,
+            torch.nn.Module,
+            YOLO.__class__,
+        ])
+        self._YOLO = YOLO
+        self.iou = iou
+        # predictor ของ ultralytics ไม่ thread-safe → ให้แต่ละ thread มีโมเดลของตัวเอง
+        # (ตัวแรกที่โหลดไว้แล้วยกให้ thread แรกที่เรียก) เก็บใน dict → close() ปล่อยได้ครบทุก thread
+        self._spare = [YOLO(str(path))]
+        self.names = dict(self._spare[0].names)
+        self._models: dict[int, object] = {}
+        self._lock = threading.Lock()
+
+    def _model(self):
+        tid = threading.get_ident()
+        m = self._models.get(tid)
+        if m is None:
+            with self._lock:
+                m = self._spare.pop() if self._spare else None
+            if m is None:
+                m = self._YOLO(str(self.path))
+            with self._lock:
+                self._models[tid] = m
+        return m
+
+    def close(self) -> None:
+        with self._lock:
+            self._models.clear()
+            self._spare.clear()
+
+    def predict(self, imgs: list, conf: float, imgsz: int | None = None) -> list[list[Detection]]:
+        kw = {"imgsz": imgsz} if imgsz else {}
+        results = self._model().predict(imgs, conf=conf, iou=self.iou, verbose=False, **kw)
+        out = []
+        for r in results:
+            b = r.boxes
+            xyxy = b.xyxy.cpu().numpy()
+            confs = b.conf.cpu().numpy()
+            clss = b.cls.cpu().numpy()
+            out.append([
+                Detection(tuple(float(v) for v in xyxy[i]), float(confs[i]), int(clss[i]))
+                for i in range(len(b))
+            ])
+        return out
+
+
+# ---------- exported graph (ONNX / OpenVINO) ----------
+def letterbox(img: np.ndarray, size: int, stride: int | None = None) -> tuple[np.ndarray, float, tuple[float, float]]:
+    """
+    resize รักษาสัดส่วน + pad สีเทา (114) ให้เป็น size x size แบบเดียวกับ ultralytics
+    stride → pad แค่ให้ลงตัวกับ stride (สี่เหลี่ยมผืนผ้า เหมือน .pt) ใช้ได้กับกราฟ dynamic เท่านั้น
+    คืน (NCHW float32 0-1 ของภาพเดียว, ratio, (pad_x, pad_y))
+    """
+    h, w = img.shape[:2]
+    r = min(size / h, size / w)
+    nw, nh = round(w * r), round(h * r)
+    dw, dh = (size - nw) / 2, (size - nh) / 2
+    if stride:
+        dw, dh = (size - nw) % stride / 2, (size - nh) % stride / 2
+    if (nw, nh) != (w, h):
+        img = cv2.resize(img, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    top, bottom = round(dh - 0.1), round(dh + 0.1)
+    left, right = round(dw - 0.1), round(dw + 0.1)
+    img = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    blob = cv2.dnn.blobFromImage(img, 1 / 255.0, swapRB=True)   # BGR HWC uint8 → RGB NCHW float32
+    return blob, r, (left, top)
+
+
+class _ExportedYolo(Engine):
+    """pre/post-processing ร่วมของกราฟที่ export จาก YOLOv8 (output = [B, 4 + nc, N])"""
+
+    def __init__(self, path: str | Path, imgsz: int = MODEL_IMGSZ, iou: float = MODEL_IOU,
+                 max_det: int = MODEL_MAX_DET):
+        super().__init__(path)
+        self.imgsz = imgsz
+        self.iou = iou
+        self.max_det = max_det
+        self.fixed_batch: int | None = None   # กราฟที่ batch ตายตัว → รันทีละภาพ
+        self.dynamic_shape = False            # กราฟรับขนาดภาพไม่ตายตัว → pad แบบ rect ได้
+        self.stride = 32
+
+    @property
+    def variable_imgsz(self) -> bool:
+        return self.dynamic_shape
+
+    def _forward(self, batch: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def predict(self, imgs: list, conf: float, imgsz: int | None = None) -> list[list[Detection]]:
+        # กราฟขนาดตายตัวย่อ input ไม่ได้ → imgsz ถูกข้าม
+        size = imgsz if imgsz and self.dynamic_shape else self.imgsz
+        # ภาพขนาดเท่ากันทั้ง batch + กราฟ dynamic → rect padding (คำนวณน้อยลง, ผลตรงกับ .pt)
+        rect = self.dynamic_shape and len({img.shape[:2] for img in imgs}) == 1
+        preps = [letterbox(img, size, self.stride if rect else None) for img in imgs]
+        if self.fixed_batch == 1 or len(preps) == 1:
+            outs = [self._forward(p[0])[0] for p in preps]
+        else:
+            outs = list(self._forward(np.concatenate([p[0] for p in preps])))
+        return [
+            self._postprocess(out, conf, r, pad, img.shape[:2])
+            for out, (_, r, pad), img in zip(outs, preps, imgs)
+        ]
+
+    def _postprocess(self, out: np.ndarray, conf: float, r: float, pad: tuple, shape) -> list[Detection]:
+        pred = out.T                                   # [N, 4 + nc]
+        cls_scores = pred[:, 4:]
+        cls = cls_scores.argmax(1)
+        scores = cls_scores[np.arange(len(cls)), cls]
+        keep = scores >= conf
+        if not keep.any():
+            return []
+        pred, cls, scores = pred[keep], cls[keep], scores[keep]
+
+        # cx,cy,w,h (พิกัดภาพ letterbox) → x,y,w,h สำหรับ NMS
+        xywh = pred[:, :4].copy()
+        xywh[:, 0] -= xywh[:, 2] / 2
+        xywh[:, 1] -= xywh[:, 3] / 2
+        idx = cv2.dnn.NMSBoxesBatched(xywh.tolist(), scores.tolist(), cls.tolist(), conf, self.iou)
+        idx = np.asarray(idx, dtype=int).reshape(-1)[: self.max_det]
+
+        h, w = shape
+        dets = []
+        for i in idx:
+            x, y, bw, bh = xywh[i]
+            x1 = min(max((x - pad[0]) / r, 0.0), w)
+            y1 = min(max((y - pad[1]) / r, 0.0), h)
+            x2 = min(max((x + bw - pad[0]) / r, 0.0), w)
+            y2 = min(max((y + bh - pad[1]) / r, 0.0), h)
+            dets.append(Detection((float(x1), float(y1), float(x2), float(y2)), float(scores[i]), int(cls[i])))
+        dets.sort(key=lambda d: d.conf, reverse=True)
+        return dets
+
+
+def _parse_names(raw) -> dict[int, str]:
+    if isinstance(raw, dict):
+        return {int(k): str(v) for k, v in raw.items()}
+    if isinstance(raw, str) and raw.strip():
+        return _parse_names(ast.literal_eval(raw))
+    return {}
+
+
+class OnnxEngine(_ExportedYolo):
+    name = "onnx"
+
+    def __init__(self, path: str | Path, threads: int = MODEL_THREADS, **kw):
+        super().__init__(path, **kw)
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError("MODEL_BACKEND=onnx ต้องติดตั้ง onnxruntime (pip install onnxruntime)") from e
+        so = ort.SessionOptions()
+        so.intra_op_num_threads = threads
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # session.run() thread-safe → ใช้ session เดียวทั้ง process
+        self._sess = ort.InferenceSession(str(path), so, providers=["CPUExecutionProvider"])
+        inp = self._sess.get_inputs()[0]
+        self._input = inp.name
+        self.fixed_batch = inp.shape[0] if isinstance(inp.shape[0], int) else None
+        self.dynamic_shape = not isinstance(inp.shape[2], int)
+        if not self.dynamic_shape:
+            self.imgsz = inp.shape[2]
+        meta = self._sess.get_modelmeta().custom_metadata_map   # ultralytics ฝัง names/stride/imgsz ไว้
+        self.names = _parse_names(meta.get("names"))
+        self.stride = int(meta.get("stride", self.stride))
+
+    def _forward(self, batch: np.ndarray) -> np.ndarray:
+        return self._sess.run(None, {self._input: batch})[0]
+
+    def close(self) -> None:
+        self._sess = None
+
+
+class OpenVinoEngine(_ExportedYolo):
+    name = "openvino"
+
+    def __init__(self, path: str | Path, threads: int = MODEL_THREADS, **kw):
+        super().__init__(path, **kw)
+        try:
+            import openvino as ov
+        except ImportError as e:
+            raise RuntimeError("MODEL_BACKEND=openvino ต้องติดตั้ง openvino (pip install openvino)") from e
+        p = Path(path)
+        xml = next(iter(sorted(p.glob("*.xml")))) if p.is_dir() else p
+        core = ov.Core()
+        model = core.read_model(str(xml))
+        self._compiled = core.compile_model(model, "CPU", {"INFERENCE_NUM_THREADS": threads})
+        shape = self._compiled.input(0).get_partial_shape()
+        self.fixed_batch = shape[0].get_length() if shape[0].is_static else None
+        self.dynamic_shape = not shape[2].is_static
+        if not self.dynamic_shape:
+            self.imgsz = shape[2].get_length()
+        self.names = _load_metadata_names(xml.parent / "metadata.yaml")
+        # compiled model ใช้ร่วมกันได้ แต่ infer request ต้องแยกต่อ thread
+        self._reqs: dict[int, object] = {}
+
+    def _forward(self, batch: np.ndarray) -> np.ndarray:
+        tid = threading.get_ident()
+        req = self._reqs.get(tid)
+        if req is None:
+            req = self._reqs[tid] = self._compiled.create_infer_request()
+        req.infer({0: batch})
+        return req.get_output_tensor(0).data.copy()
+
+    def close(self) -> None:
+        self._reqs.clear()
+        self._compiled = None
+
+
+def _load_metadata_names(path: Path) -> dict[int, str]:
+    """names จาก metadata.yaml ที่ ultralytics เขียนไว้ข้างโมเดล (ไม่บังคับติดตั้ง PyYAML)"""
+    if not path.exists():
+        return {}
+    text = path.read_text(encoding="utf-8")
+    try:
+        import yaml
+        return _parse_names(yaml.safe_load(text).get("names"))
+    except ImportError:
+        pass
+    names, in_names = {}, False
+    for line in text.splitlines():
+        if line.startswith("names:"):
+            in_names = True
+            continue
+        if in_names:
+            if not line.startswith(" "):
+                break
+            k, _, v = line.strip().partition(":")
+            names[int(k)] = v.strip().strip("'\"")
+    return names
+
+
+def load_engine(backend: str = MODEL_BACKEND, path: str | Path | None = None, int8: bool = MODEL_INT8,
+                threads: int = MODEL_THREADS) -> Engine:
+    """
+    สร้าง engine ตาม config — path ไม่ระบุ → MODEL_ARTIFACT หรือ path มาตรฐานจาก MODEL_PATH
+    remote = ใช้โมเดลของ inference server (backend/infer_server.py) — path/int8 ตั้งที่ฝั่ง server
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"MODEL_BACKEND must be one of {BACKENDS}, got {backend!r}")
+    if backend == "remote":
+        from backend.infer_client import RemoteEngine
+
+        return RemoteEngine()
+    if path is None:
+        path = MODEL_ARTIFACT or artifact_path(backend, MODEL_PATH, int8)
+    if backend == "ultralytics":
+        return UltralyticsEngine(path)   # threads ของ torch ตั้งทั้ง process ใน configure_threads()
+    if not Path(path).exists():
+        raise FileNotFoundError(f"{path} not found — run `python -m backend.export --format {backend}"
+                                f"{' --int8 --calib <dir>' if int8 else ''}` first")
+    if backend == "onnx":
+        return OnnxEngine(path, threads=threads)
+    return OpenVinoEngine(path, threads=threads)
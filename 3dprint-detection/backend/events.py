@@ -0,0 +1,96 @@
+# backend/events.py
+"""
+Push การอัปเดต card ให้ client (GET /cards/stream, Server-Sent Events)
+
+- database.upsert_card เรียก publish() หลัง commit (รันใน thread ของ DB executor → ส่งเข้า event loop แบบ threadsafe)
+- subscriber แต่ละตัวกรองตาม card_id / status ได้
+- ต่อ subscriber เก็บแค่ "สถานะล่าสุดต่อ card" ที่ยังไม่ได้ส่ง → client ช้าก็ไม่ทำให้คิวโต
+- ใช้ได้ภายใน process เดียว (หลาย worker process → แต่ละตัวเห็นเฉพาะ upsert ของตัวเอง)
+"""
+import asyncio
+import threading
+
+
+class Subscriber:
+    def __init__(self, card_ids: set[str] | None, statuses: set[str] | None):
+        self.card_ids = card_ids
+        self.statuses = statuses
+        self.pending: dict[str, dict] = {}    # card_id → card ล่าสุดที่ยังไม่ได้ส่ง
+        self.event = asyncio.Event()
+        self.closed = False
+
+    def matches(self, card: dict) -> bool:
+        if self.card_ids and card.get("card_id") not in self.card_ids:
+            return False
+        if self.statuses and card.get("status") not in self.statuses:
+            return False
+        return True
+
+    def offer(self, card: dict) -> None:
+        self.pending[card["card_id"]] = card
+        self.event.set()
+
+    async def next(self, timeout: float) -> list[dict]:
+        """รอการอัปเดตชุดถัดไป (timeout → [] ใช้ส่ง heartbeat)"""
+        if not self.pending and not self.closed:
+            try:
+                await asyncio.wait_for(self.event.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        self.event.clear()
+        batch, self.pending = list(self.pending.values()), {}
+        return batch
+
+
+class CardBroker:
+    def __init__(self):
+        self._subs: set[Subscriber] = set()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._lock = threading.Lock()
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(self, card_ids=None, statuses=None) -> Subscriber:
+        self._loop = asyncio.get_running_loop()
+        sub = Subscriber(set(card_ids) if card_ids else None, set(statuses) if statuses else None)
+        with self._lock:
+            self._subs.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        with self._lock:
+            self._subs.discard(sub)
+
+    def _dispatch(self, card: dict) -> None:
+        # รันบน event loop
+        with self._lock:
+            subs = list(self._subs)
+        for sub in subs:
+            if sub.matches(card):
+                sub.offer(card)
+                self.delivered += 1
+
+    def publish(self, card: dict) -> None:
+        """เรียกได้จากทุก thread — ไม่มี subscriber ก็ไม่ทำอะไร"""
+        self.published += 1
+        loop = self._loop
+        if not self._subs or loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(self._dispatch, card)
+        except RuntimeError:
+            pass  # loop ปิดไปแล้ว
+
+    def close(self) -> None:
+        """ปลุกทุก stream ให้จบ (ตอน shutdown)"""
+        with self._lock:
+            subs = list(self._subs)
+        for sub in subs:
+            sub.closed = True
+            sub.event.set()
+
+    def stats(self) -> dict:
+        return {"subscribers": len(self._subs), "published": self.published, "delivered": self.delivered}
+
+
+broker = CardBroker()
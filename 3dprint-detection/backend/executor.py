@@ -0,0 +1,86 @@
+# backend/executor.py
+"""
+Inference executor: รัน detect() (decode → predict → imwrite) ใน thread pool แยก
+event loop ของ uvicorn จะได้ว่างรับ request อื่น (GET /cards, ไฟล์ผลลัพธ์ ฯลฯ)
+
+- pool size     = INFER_WORKERS
+- คิวมีขอบเขต   = INFER_QUEUE_SIZE (เกินแล้ว raise QueueFull → main.py ตอบ 503 + Retry-After)
+- จำนวน intra-op threads ของโมเดล: torch ตั้งครั้งเดียวตอน start (engines.configure_threads), onnxruntime/openvino ตั้งต่อ session (MODEL_THREADS)
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from backend.config import (
+    INFER_WORKERS,
+    INFER_QUEUE_SIZE,
+    INFER_RETRY_AFTER,
+)
+
+
+class QueueFull(Exception):
+    """คิว inference เต็ม — ให้ client ถอยแล้วลองใหม่"""
+
+    def __init__(self, retry_after: int = INFER_RETRY_AFTER):
+        super().__init__("Inference queue full, retry later")
+        self.retry_after = retry_after
+
+
+_pool: ThreadPoolExecutor | None = None
+_pool_lock = threading.Lock()
+_pending = 0  # งานที่รอ + กำลังรัน (แก้ค่าบน event loop thread เท่านั้น)
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(
+                    max_workers=INFER_WORKERS,
+                    thread_name_prefix="infer",
+                )
+    return _pool
+
+
+def _release() -> None:
+    global _pending
+    _pending -= 1
+
+
+def _release_threadsafe(loop: asyncio.AbstractEventLoop) -> None:
+    try:
+        loop.call_soon_threadsafe(_release)
+    except RuntimeError:
+        pass  # loop ปิดไปแล้ว (งานจบหลัง shutdown)
+
+
+def pending() -> int:
+    """จำนวนงานในคิว (รวมที่กำลังรัน)"""
+    return _pending
+
+
+async def run(fn, *args, **kwargs):
+    """
+    ส่ง fn(*args, **kwargs) ไปรันใน inference pool แล้วรอผล
+    ถ้างานค้างเกิน INFER_WORKERS + INFER_QUEUE_SIZE → raise QueueFull ทันที
+    """
+    global _pending
+    if _pending >= INFER_WORKERS + INFER_QUEUE_SIZE:
+        raise QueueFull()
+
+    loop = asyncio.get_running_loop()
+    cfut = _get_pool().submit(partial(fn, *args, **kwargs))
+    _pending += 1
+    # ปล่อยโควต้าตอนงานใน thread จบจริง (แม้ client จะตัดการเชื่อมต่อไปก่อน)
+    cfut.add_done_callback(lambda _f: _release_threadsafe(loop))
+    return await asyncio.wrap_future(cfut, loop=loop)
+
+
+def shutdown(wait: bool = True) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=wait, cancel_futures=True)
+            _pool = None
@@ -0,0 +1,150 @@
+# backend/export.py
+"""
+Export best.pt เป็น backend ที่เร็วกว่าบน CPU (ใช้กับ MODEL_BACKEND ใน backend/config.py)
+
+    python -m backend.export --format onnx
+    python -m backend.export --format openvino
+    python -m backend.export --format onnx --int8 --calib path/to/frames/     # INT8 (post-training)
+
+- กราฟ export แบบ dynamic batch/ขนาดภาพ → ใช้กับ micro-batching ได้
+- --int8 ต้องมีชุดภาพ calibration ที่หน้าตาเหมือนภาพจริงจากกล้อง (ใช้ letterbox เดียวกับตอน infer)
+  ONNX: onnxruntime.quantization (QDQ, per-channel)  /  OpenVINO: nncf (pip install nncf)
+- หลัง export ให้เช็คผลเทียบกับ .pt ด้วย `python -m backend.parity` ก่อนเปลี่ยน backend จริง
+"""
+import argparse
+import re
+import shutil
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from backend.config import MODEL_PATH, MODEL_IMGSZ
+from backend.engines import artifact_path, letterbox
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+
+def calibration_images(calib_dir: str, limit: int, imgsz: int):
+    """ภาพ calibration → tensor NCHW (1, 3, imgsz, imgsz) ทีละภาพ"""
+    files = sorted(p for p in Path(calib_dir).rglob("*") if p.suffix.lower() in IMAGE_EXTS)[:limit]
+    if not files:
+        raise SystemExit(f"no images found in {calib_dir}")
+    for f in files:
+        img = cv2.imread(str(f), cv2.IMREAD_COLOR)
+        if img is not None:
+            yield letterbox(img, imgsz)[0]
+
+
+def export_fp32(weights: str, fmt: str, imgsz: int) -> Path:
+    from ultralytics import YOLO
+
+    out = YOLO(weights).export(format=fmt, imgsz=imgsz, dynamic=True, simplify=fmt == "onnx", half=False)
+    return Path(out)
+
+
+def _onnx_head_nodes(path: Path) -> list[str]:
+    """
+    node ของ layer สุดท้าย (Detect) ที่ไม่ใช่ Conv — decode box/sigmoid/concat ไวต่อ quantization
+    (conf ต่ำ ๆ กลายเป็น 0) → คงเป็น FP32 ไว้
+    """
+    import onnx
+
+    nodes = onnx.load(str(path), load_external_data=False).graph.node
+    layers = [int(m.group(1)) for n in nodes if (m := re.match(r"/model\.(\d+)/", n.name))]
+    if not layers:
+        return []
+    head = f"/model.{max(layers)}/"
+    return [n.name for n in nodes if n.name.startswith(head) and n.op_type != "Conv"]
+
+
+def quantize_onnx(fp32: Path, dest: Path, calib_dir: str, limit: int, imgsz: int) -> Path:
+    from onnxruntime.quantization import (
+        CalibrationDataReader, QuantFormat, QuantType, quantize_static,
+    )
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+    import onnxruntime as ort
+
+    input_name = ort.InferenceSession(str(fp32), providers=["CPUExecutionProvider"]).get_inputs()[0].name
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self._it = ({input_name: x} for x in calibration_images(calib_dir, limit, imgsz))
+
+        def get_next(self):
+            return next(self._it, None)
+
+    prep = dest.with_name(dest.stem + "_prep.onnx")
+    quant_pre_process(str(fp32), str(prep), skip_symbolic_shape=True)   # กราฟ dynamic → symbolic shape ไม่ครบ
+    try:
+        quantize_static(
+            str(prep), str(dest), Reader(),
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            nodes_to_exclude=_onnx_head_nodes(prep),
+        )
+    finally:
+        prep.unlink(missing_ok=True)
+    return dest
+
+
+def quantize_openvino(fp32_dir: Path, dest: Path, calib_dir: str, limit: int, imgsz: int) -> Path:
+    try:
+        import nncf
+    except ImportError:
+        raise SystemExit("OpenVINO INT8 ต้องติดตั้ง nncf (pip install nncf)")
+    import openvino as ov
+
+    xml = next(iter(sorted(fp32_dir.glob("*.xml"))))
+    model = ov.Core().read_model(str(xml))
+    dataset = nncf.Dataset(list(calibration_images(calib_dir, limit, imgsz)))
+    q = nncf.quantize(
+        model, dataset,
+        preset=nncf.QuantizationPreset.MIXED,
+        # ส่วนท้าย (decode box / concat) ไวต่อ quantization → คง FP32 ไว้ (แนวเดียวกับ ultralytics)
+        ignored_scope=nncf.IgnoredScope(types=["Multiply", "Subtract", "Sigmoid"]),
+    )
+    dest.mkdir(parents=True, exist_ok=True)
+    ov.save_model(q, str(dest / xml.name), compress_to_fp16=False)
+    meta = fp32_dir / "metadata.yaml"
+    if meta.exists():
+        shutil.copy2(meta, dest / "metadata.yaml")
+    return dest
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m backend.export", description=__doc__.split("\n\n")[0])
+    ap.add_argument("--format", choices=("onnx", "openvino"), required=True)
+    ap.add_argument("--weights", default=MODEL_PATH)
+    ap.add_argument("--imgsz", type=int, default=MODEL_IMGSZ)
+    ap.add_argument("--int8", action="store_true", help="post-training INT8 quantization (ต้องใช้ --calib)")
+    ap.add_argument("--calib", help="โฟลเดอร์ภาพ calibration")
+    ap.add_argument("--calib-size", type=int, default=300, help="จำนวนภาพ calibration สูงสุด")
+    args = ap.parse_args(argv)
+    if args.int8 and not args.calib:
+        ap.error("--int8 requires --calib DIR")
+
+    fp32 = export_fp32(args.weights, args.format, args.imgsz)
+    expected = artifact_path(args.format, args.weights)
+    if fp32.resolve() != expected.resolve():
+        # ultralytics เขียนไว้ข้าง weights เสมอ — กันไว้เผื่อเวอร์ชันอื่นเปลี่ยน path
+        shutil.move(str(fp32), expected)
+        fp32 = expected
+    print(f"FP32 {args.format}: {fp32}")
+    if not args.int8:
+        return 0
+
+    dest = artifact_path(args.format, args.weights, int8=True)
+    if args.format == "onnx":
+        out = quantize_onnx(fp32, dest, args.calib, args.calib_size, args.imgsz)
+    else:
+        out = quantize_openvino(fp32, dest, args.calib, args.calib_size, args.imgsz)
+    print(f"INT8 {args.format}: {out}  (ใช้ด้วย MODEL_BACKEND={args.format} MODEL_INT8=1)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+# backend/gate.py
+"""
+Frame-change gate ต่อ card_id: ถ้าภาพใหม่แทบไม่ต่างจากภาพล่าสุดที่ infer จริง
+(ต่างกันแค่ noise ของเซนเซอร์) ก็ใช้ผล detect เดิม ไม่ต้องเรียก model.predict
+
+- fingerprint = ภาพ grayscale ย่อ (decode แบบ IMREAD_REDUCED_GRAYSCALE_8 ถูกมาก) + blur กัน noise
+- เทียบกับภาพของรอบที่ infer เต็มล่าสุด (ไม่ใช่ภาพที่ถูก gate) → drift สะสมไม่หลุด
+- บังคับ infer ใหม่ทุก max_age วินาที กันผลค้าง
+- จำ state แบบ LRU จำกัดจำนวน card; เก็บแค่ผล detect (scores/status/กรอบ) ไม่เก็บภาพในแรม
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+
+@dataclass
+class _GateState:
+    thumb: np.ndarray
+    result: dict        # scores / status / boxes / width / height ของรอบที่ infer จริง
+    inferred_at: float
+
+
+def fingerprint(image_buf: np.ndarray, size: int) -> np.ndarray | None:
+    """ภาพ grayscale ขนาด size×size (float32) สำหรับเทียบความต่าง; decode ไม่ได้คืน None"""
+    gray = cv2.imdecode(image_buf, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if gray is None:
+        return None
+    thumb = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA)
+    thumb = cv2.GaussianBlur(thumb, (3, 3), 0)
+    return thumb.astype(np.float32)
+
+
+class FrameGate:
+    def __init__(self, threshold: float, max_age: float, max_cards: int, thumb_size: int):
+        self.threshold = threshold
+        self.max_age = max_age
+        self.max_cards = max_cards
+        self.thumb_size = thumb_size
+        self._states: "OrderedDict[str, _GateState]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.reused = 0
+        self.passed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0 and self.max_cards > 0
+
+    def check(self, card_id: str, thumb: np.ndarray) -> _GateState | None:
+        """คืน state เดิมถ้าใช้ผลซ้ำได้ ไม่งั้น None (ต้อง infer เต็ม)"""
+        with self._lock:
+            st = self._states.get(card_id)
+            if st is not None:
+                self._states.move_to_end(card_id)
+        # เทียบภาพนอก lock (แพงกว่า) — lock อีกรอบแค่นับสถิติ (เรียกจากหลาย inference thread)
+        reuse = (
+            st is not None
+            and time.monotonic() - st.inferred_at <= self.max_age
+            and st.thumb.shape == thumb.shape
+            and float(np.mean(np.abs(thumb - st.thumb))) < self.threshold
+        )
+        with self._lock:
+            if reuse:
+                self.reused += 1
+            else:
+                self.passed += 1
+        return st if reuse else None
+
+    def update(self, card_id: str, thumb: np.ndarray, result: dict) -> None:
+        st = _GateState(thumb, result, time.monotonic())
+        with self._lock:
+            self._states[card_id] = st
+            self._states.move_to_end(card_id)
+            while len(self._states) > self.max_cards:
+                self._states.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"cards": len(self._states), "reused": self.reused, "passed": self.passed}
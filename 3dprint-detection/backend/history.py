@@ -0,0 +1,204 @@
+# backend/history.py
+"""
+ประวัติผล detect ต่อ card (GET /cards/{card_id}/history) — ตาราง cards เก็บแค่ผลล่าสุด
+
+- record() ถูกเรียกหลังบันทึก card (cards.py) → แค่ต่อท้าย buffer ในแรม ไม่แตะ DB บน path ของ upload
+- flusher เขียนทั้ง buffer ทุก HISTORY_FLUSH_INTERVAL (หรือทันทีเมื่อถึง HISTORY_FLUSH_ROWS) ใน transaction เดียว:
+  แถวรายภาพ + rollup รายนาที/ชั่วโมงที่รวมไว้แล้วใน Python (upsert 1 ครั้งต่อช่วง ไม่ใช่ต่อภาพ)
+- คะแนนเก็บเป็นคอลัมน์ตัวเลข (slot ต่อ label ดู database.history_slots) ไม่ใช่ JSON; status เป็นรหัสตัวเลข
+- retention: รายภาพ HISTORY_RAW_RETENTION, รายนาที HISTORY_MINUTE_RETENTION, รายชั่วโมง HISTORY_HOUR_RETENTION
+- process ตายกะทันหัน → เสียได้แค่ buffer ที่ยังไม่ flush (≤ HISTORY_FLUSH_INTERVAL)
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from backend.config import (
+    HISTORY_ENABLED,
+    HISTORY_FLUSH_INTERVAL,
+    HISTORY_FLUSH_ROWS,
+    HISTORY_MAX_BUFFER,
+    HISTORY_RAW_RETENTION,
+    HISTORY_MINUTE_RETENTION,
+    HISTORY_HOUR_RETENTION,
+    HISTORY_PURGE_INTERVAL,
+    HISTORY_PURGE_BATCH,
+)
+from . import database as db
+
+log = logging.getLogger(__name__)
+
+STATUS_CODES = {"NORMAL": 0, "FAIL": 1, "NOT_3DPRINT_PART": 2}
+STATUS_OTHER = 3
+RESOLUTIONS = ("auto", "raw", "minute", "hour")
+AUTO_MINUTE_SPAN = 6 * 3600     # auto: ช่วงไม่เกินนี้ใช้ rollup รายนาที ไม่งั้นรายชั่วโมง
+
+_buffer: deque = deque(maxlen=HISTORY_MAX_BUFFER)
+_wakeup: asyncio.Event | None = None
+_task: asyncio.Task | None = None
+_slots: dict[str, int] = {}      # cache ของ history_labels (label → slot)
+_counters = {"recorded": 0, "written": 0, "dropped": 0, "flushes": 0}
+
+
+def record(card: dict) -> None:
+    """ผล detect หนึ่งครั้ง (Card payload) → buffer (เรียกจาก event loop)"""
+    if not HISTORY_ENABLED:
+        return
+    if len(_buffer) == _buffer.maxlen:
+        _counters["dropped"] += 1     # deque ทิ้งแถวเก่าสุดเอง
+    _buffer.append((card["card_id"], int(time.time() * 1000), card.get("status"), dict(card.get("scores") or {})))
+    _counters["recorded"] += 1
+    if _wakeup is not None and len(_buffer) >= HISTORY_FLUSH_ROWS:
+        _wakeup.set()
+
+
+def _write(rows: list[tuple]) -> int:
+    """แปลงเป็นคอลัมน์ตัวเลข + รวม rollup แล้วเขียนใน transaction เดียว (รันใน db executor)"""
+    global _slots
+    labels = {label for *_, scores in rows for label in scores}
+    if labels - _slots.keys():
+        _slots = db.history_slots(labels)
+        lost = labels - _slots.keys()
+        if lost and len(_slots) >= db.HISTORY_SLOTS:
+            log.warning("history slots full (%d) — not recording %s", db.HISTORY_SLOTS, sorted(lost))
+
+    raw = []
+    aggs: dict[str, dict[tuple, list]] = {res: {} for res in db.HISTORY_ROLLUPS}
+    for card_id, ts, status, scores in rows:
+        vec = [0.0] * db.HISTORY_SLOTS
+        for label, v in scores.items():
+            slot = _slots.get(label)
+            if slot is not None:
+                vec[slot] = float(v)
+        code = STATUS_CODES.get(status, STATUS_OTHER)
+        raw.append((card_id, ts, code, *vec))
+        for res, (_, width) in db.HISTORY_ROLLUPS.items():
+            key = (card_id, ts // 1000 // width * width)
+            agg = aggs[res].get(key)
+            if agg is None:
+                agg = aggs[res][key] = [0, 0, 0, 0, [0.0] * db.HISTORY_SLOTS, [0.0] * db.HISTORY_SLOTS]
+            agg[0] += 1
+            agg[1] += code == 1
+            agg[2] += code == 0
+            agg[3] += code == 2
+            for i, v in enumerate(vec):
+                agg[4][i] += v
+                agg[5][i] = max(agg[5][i], v)
+
+    rollups = {
+        res: [(*key, n, n_fail, n_normal, n_not3d, *sums, *maxs)
+              for key, (n, n_fail, n_normal, n_not3d, sums, maxs) in per_bucket.items()]
+        for res, per_bucket in aggs.items()
+    }
+    db.write_history(raw, rollups)
+    return len(raw)
+
+
+async def flush() -> None:
+    """เขียนทุกอย่างที่ค้างใน buffer (เขียนไม่ได้ → ทิ้ง + log; ไม่กระทบ upload)"""
+    if not _buffer:
+        return
+    rows = list(_buffer)
+    _buffer.clear()
+    try:
+        _counters["written"] += await db.run(_write, rows)
+        _counters["flushes"] += 1
+    except Exception as e:
+        _counters["dropped"] += len(rows)
+        log.warning("flush failed, dropped %d rows: %s", len(rows), e)
+
+
+def _retention_cutoffs() -> dict[str, float]:
+    now = time.time()
+    return {
+        "raw": now - HISTORY_RAW_RETENTION,
+        "minute": now - HISTORY_MINUTE_RETENTION,
+        "hour": now - HISTORY_HOUR_RETENTION,
+    }
+
+
+async def _flusher() -> None:
+    last_purge = 0.0
+    while True:
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=HISTORY_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+        await flush()
+
+        if time.monotonic() - last_purge >= HISTORY_PURGE_INTERVAL:
+            last_purge = time.monotonic()
+            try:
+                n = await db.run(db.purge_history, _retention_cutoffs(), HISTORY_PURGE_BATCH)
+                if n:
+                    log.info("purged %d history rows", n)
+            except Exception as e:
+                log.warning("purge failed: %s", e)
+
+
+def start() -> None:
+    """เริ่ม flusher (เรียกจาก lifespan ของ app)"""
+    global _wakeup, _task
+    if not HISTORY_ENABLED:
+        return
+    _wakeup = asyncio.Event()
+    _task = asyncio.create_task(_flusher())
+
+
+async def stop() -> None:
+    """หยุด flusher แล้วเขียนที่ค้างให้หมด (ก่อน db.close_pool)"""
+    global _task
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
+    await flush()
+
+
+def stats() -> dict:
+    return {**_counters, "buffered": len(_buffer), "labels": dict(_slots)}
+
+
+# ---------- อ่าน (GET /cards/{card_id}/history) ----------
+def to_epoch(dt: datetime) -> float:
+    """datetime ที่ไม่มี timezone ถือเป็น UTC (แบบเดียวกับ updated_at ของ card)"""
+    return (dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)).timestamp()
+
+
+def _iso(epoch: float) -> str:
+    return datetime.utcfromtimestamp(epoch).isoformat()
+
+
+def pick_resolution(resolution: str, start: float, end: float) -> str:
+    if resolution != "auto":
+        return resolution
+    return "minute" if end - start <= AUTO_MINUTE_SPAN else "hour"
+
+
+def query(card_id: str, resolution: str, start: float, end: float, limit: int) -> list[dict]:
+    """จุดของกราฟในช่วง [start, end) — raw: ผลรายภาพ, minute/hour: avg/max ของคะแนน + นับตาม status"""
+    names = {slot: label for label, slot in db.history_slots().items()}
+    rows = db.read_history(card_id, resolution, start, end, limit)
+    statuses = {code: name for name, code in STATUS_CODES.items()}
+    points = []
+    if resolution == "raw":
+        for r in rows:
+            points.append({
+                "t": _iso(r["ts"] / 1000),
+                "status": statuses.get(r["status"], "OTHER"),
+                "scores": {label: r[f"s{slot}"] for slot, label in names.items()},
+            })
+        return points
+    for r in rows:
+        n = r["n"]
+        points.append({
+            "t": _iso(r["bucket"]),
+            "n": n,
+            "status": {"FAIL": r["n_fail"], "NORMAL": r["n_normal"], "NOT_3DPRINT_PART": r["n_not3d"]},
+            "avg": {label: round(r[f"sum{slot}"] / n, 4) for slot, label in names.items()},
+            "max": {label: r[f"max{slot}"] for slot, label in names.items()},
+        })
+    return points
@@ -0,0 +1,231 @@
+# backend/infer_client.py
+"""
+ฝั่ง API worker ของ inference server (MODEL_BACKEND=remote, ดู backend/infer_server.py)
+
+- RemoteEngine ต่อทุก inference process (INFER_SERVER_PROCS ตัว) ผ่าน Unix socket
+- เฟรมเขียนลง FrameRing (shared memory ของ worker นี้) → ส่งแค่ (slot, shape, dtype)
+  เฟรมใหญ่เกิน INFER_SLOT_BYTES ส่งแบบ pickle แทน (นับไว้ใน stats "inline")
+- หลาย thread เรียก predict() พร้อมกันได้: ส่งผ่าน lock เดียว, thread อ่านผลแยก → จับคู่ด้วย req_id
+- server ล่ม/ต่อไม่ได้ → InferenceUnavailable (503 + Retry-After) แล้วต่อใหม่ครั้งถัดไป
+"""
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from multiprocessing.connection import Client
+
+from backend.config import (
+    INFER_SERVER_ADDRESS, INFER_SERVER_PROCS, INFER_SERVER_AUTHKEY,
+    INFER_SERVER_TIMEOUT, INFER_SERVER_CONNECT_TIMEOUT, INFER_RING_SLOTS, INFER_SLOT_BYTES,
+)
+from backend.engines import Detection, Engine
+from backend.executor import QueueFull
+from backend.infer_server import addresses
+from backend.shm_ring import FrameRing, RingFull
+
+log = logging.getLogger(__name__)
+
+
+class InferenceUnavailable(QueueFull):
+    """inference server ไม่ตอบ/ยังไม่ขึ้น — ให้ client ถอยแล้วลองใหม่เหมือนคิวเต็ม"""
+
+    def __init__(self, reason: str):
+        super().__init__()
+        self.args = (f"Inference server unavailable ({reason}), retry later",)
+
+
+class _ServerConn:
+    """connection ไปยัง inference process หนึ่งตัว"""
+
+    def __init__(self, address: str, ring: FrameRing):
+        self.address = address
+        self.ring = ring
+        self.info: dict = {}
+        self.outstanding = 0
+        self._conn = None
+        self._pending: dict[int, Future] = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    @property
+    def connected(self) -> bool:
+        return self._conn is not None
+
+    def connect(self) -> dict:
+        conn = Client(self.address, family="AF_UNIX", authkey=INFER_SERVER_AUTHKEY.encode())
+        conn.send(("hello", self.ring.name, self.ring.slot_bytes))
+        kind, info = conn.recv()
+        self.info = info
+        self._conn = conn
+        threading.Thread(target=self._reader, args=(conn,), name="infer-client", daemon=True).start()
+        return info
+
+    def _reader(self, conn) -> None:
+        while True:
+            try:
+                kind, req_id, payload = conn.recv()
+            except (EOFError, OSError, ValueError):
+                break
+            fut = self._pending.pop(req_id, None)
+            if fut is None:
+                continue
+            if kind == "ok":
+                fut.set_result(payload)
+            else:
+                fut.set_exception(RuntimeError(f"inference server: {payload}"))
+        self._drop(conn, "connection lost")
+
+    def _drop(self, conn, reason: str) -> None:
+        with self._lock:
+            if self._conn is conn:
+                self._conn = None
+            pending, self._pending = self._pending, {}
+        for fut in pending.values():
+            if not fut.done():
+                fut.set_exception(InferenceUnavailable(reason))
+        try:
+            conn.close()
+        except OSError:
+            pass
+
+    def call(self, conf: float, frames: list, timeout: float) -> list:
+        fut: Future = Future()
+        with self._lock:
+            conn = self._conn
+            if conn is None:
+                raise InferenceUnavailable("not connected")
+            req_id = next(self._ids)
+            self._pending[req_id] = fut
+            self.outstanding += 1
+            try:
+                conn.send(("predict", req_id, conf, frames))
+            except (OSError, ValueError) as e:
+                self._pending.pop(req_id, None)
+                self.outstanding -= 1
+                raise InferenceUnavailable(f"send failed: {e}")
+        try:
+            return fut.result(timeout=timeout)
+        except FutureTimeout:
+            # server ค้าง — ตัด connection (งานค้างทั้งหมดได้ InferenceUnavailable) แล้วต่อใหม่รอบหน้า
+            self._drop(conn, "timeout")
+            raise InferenceUnavailable(f"no reply in {timeout}s")
+        finally:
+            with self._lock:
+                self.outstanding -= 1
+
+    def close(self) -> None:
+        conn = self._conn
+        if conn is not None:
+            self._drop(conn, "closed")
+
+
+class RemoteEngine(Engine):
+    name = "remote"
+    client_batching = False   # server รวม batch ข้าม worker ให้แล้ว
+
+    def __init__(self, address: str = INFER_SERVER_ADDRESS, procs: int = INFER_SERVER_PROCS,
+                 slots: int = INFER_RING_SLOTS, slot_bytes: int = INFER_SLOT_BYTES,
+                 timeout: float = INFER_SERVER_TIMEOUT, connect_timeout: float = INFER_SERVER_CONNECT_TIMEOUT):
+        if not address:
+            raise ValueError("MODEL_BACKEND=remote requires INFER_SERVER_ADDRESS")
+        super().__init__(address)
+        self.timeout = timeout
+        self.ring = FrameRing(slots, slot_bytes)
+        self._servers = [_ServerConn(a, self.ring) for a in addresses(address, procs)]
+        self._reconnect_lock = threading.Lock()
+        self.inline = 0
+        try:
+            self._connect_all(connect_timeout)
+        except BaseException:
+            self.close()
+            raise
+        info = self._servers[0].info
+        self.names = {int(k): v for k, v in info["names"].items()}
+        self._identity = info["identity"]
+        self._version = info["version"]
+
+    def _connect_all(self, timeout: float) -> None:
+        """รอ server ทุกตัวพร้อม (server เปิด socket หลัง warmup เสร็จ) ภายใน timeout"""
+        deadline = time.monotonic() + timeout
+        for s in self._servers:
+            while True:
+                try:
+                    s.connect()
+                    break
+                except (FileNotFoundError, ConnectionRefusedError) as e:
+                    if time.monotonic() > deadline:
+                        raise InferenceUnavailable(f"{s.address}: {e}")
+                    time.sleep(0.2)
+        versions = {s.info["version"] for s in self._servers}
+        if len(versions) > 1:
+            raise RuntimeError(f"inference processes serve different models: {sorted(versions)}")
+
+    def _pick(self) -> _ServerConn:
+        live = [s for s in self._servers if s.connected]
+        if len(live) < len(self._servers):
+            self._reconnect()
+            live = [s for s in self._servers if s.connected]
+        if not live:
+            raise InferenceUnavailable("no inference process reachable")
+        return min(live, key=lambda s: s.outstanding)
+
+    def _reconnect(self) -> None:
+        # ไม่รอ — server ที่ restart อยู่จะถูกลองใหม่ใน request ถัดไป
+        if not self._reconnect_lock.acquire(blocking=False):
+            return
+        try:
+            for s in self._servers:
+                if not s.connected:
+                    try:
+                        info = s.connect()
+                    except (OSError, EOFError):
+                        continue
+                    if info["version"] != self._version:
+                        # server ถูก restart ด้วยโมเดลอื่น — ผลจะไม่ตรงกับ version ที่ registry บันทึก
+                        log.warning("%s serves %s, expected %s", s.address, info["version"], self._version)
+                        s.close()
+        finally:
+            self._reconnect_lock.release()
+
+    def predict(self, imgs: list, conf: float, imgsz: int | None = None) -> list[list[Detection]]:
+        # imgsz ถูกข้าม: ขนาด input ตั้งที่ฝั่ง server (variable_imgsz = False)
+        server = self._pick()
+        frames, slots = [], []
+        try:
+            for img in imgs:
+                if self.ring.fits(img):
+                    slot, shape, dtype = self.ring.put(img, timeout=self.timeout)
+                    slots.append(slot)
+                    frames.append(("shm", slot, shape, dtype))
+                else:
+                    self.inline += 1
+                    frames.append(("inline", img))
+            out = server.call(conf, frames, self.timeout)
+        except RingFull as e:
+            raise InferenceUnavailable(str(e))
+        finally:
+            # คืน slot เสมอ แม้ timeout: ถ้า server ยังอ่านอยู่ เสียแค่ผลของงานที่ทิ้งไปแล้ว
+            for slot in slots:
+                self.ring.release(slot)
+        return [[Detection(tuple(float(v) for v in d[:4]), float(d[4]), int(d[5])) for d in dets] for dets in out]
+
+    def identity(self) -> str:
+        return f"{self.name}:{self._identity}"
+
+    def version(self) -> str:
+        return self._version
+
+    def stats(self) -> dict:
+        return {
+            "servers": [{"address": s.address, "pid": s.info.get("pid"), "connected": s.connected,
+                         "outstanding": s.outstanding} for s in self._servers],
+            "ring": {"slots": self.ring.slots, "slot_bytes": self.ring.slot_bytes,
+                     "free": self.ring.free_slots()},
+            "inline": self.inline,
+        }
+
+    def close(self) -> None:
+        for s in self._servers:
+            s.close()
+        self.ring.close()
@@ -0,0 +1,242 @@
+# backend/infer_server.py
+"""
+Inference server แยก process — API worker (uvicorn) ไม่ต้องโหลดโมเดล/torch เอง
+
+    python -m backend.infer_server --procs 2 --backend onnx
+    INFER_SERVER_ADDRESS=/tmp/3dprint_infer.sock MODEL_BACKEND=remote uvicorn backend.main:app --workers 4
+
+- --procs N → N process แต่ละตัวมีโมเดลของตัวเอง ฟังที่ <address>.0 … <address>.N-1 (Unix socket)
+- API worker ต่อทุก process แล้วส่งงานให้ตัวที่มีงานค้างน้อยสุด (backend/infer_client.py)
+- เฟรมส่งผ่าน shared-memory ring ของ worker (backend/shm_ring.py) — บน socket มีแค่ slot/shape
+- ภายใน process รวม batch ข้าม worker ทุกตัวด้วย MicroBatcher → HTTP worker กับ inference process
+  ปรับจำนวนแยกกันได้ (เช่น 8 HTTP worker : 2 inference process × 4 threads)
+- เริ่มฟัง socket หลังโหลด + warmup เสร็จ → client ที่ต่อติดคือพร้อมใช้งานแล้ว
+"""
+import argparse
+import logging
+import multiprocessing as mp
+import os
+import signal
+import sys
+import threading
+import time
+from multiprocessing.connection import Listener
+
+import numpy as np
+
+from backend.batcher import MicroBatcher
+from backend.config import (
+    MODEL_PATH, MODEL_INT8, MODEL_WARMUP_SIZE,
+    INFER_SERVER_ADDRESS, INFER_SERVER_PROCS, INFER_SERVER_BACKEND, INFER_SERVER_AUTHKEY,
+    INFER_SERVER_BATCH, INFER_SERVER_BATCH_WAIT_MS,
+)
+from backend.engines import configure_threads, load_engine
+from backend.logs import setup as setup_logging
+from backend.shm_ring import AttachedRing
+
+_CPU_COUNT = os.cpu_count() or 1
+
+log = logging.getLogger(__name__)
+
+
+def address_for(base: str, index: int) -> str:
+    return f"{base}.{index}"
+
+
+def addresses(base: str = INFER_SERVER_ADDRESS, procs: int = INFER_SERVER_PROCS) -> list[str]:
+    return [address_for(base, i) for i in range(max(1, procs))]
+
+
+def _encode(dets) -> list:
+    # Detection → tuple ล้วน (pickle เล็ก/เร็วกว่า dataclass)
+    return [(*d.xyxy, d.conf, d.cls) for d in dets]
+
+
+class _Session:
+    """connection ของ API worker หนึ่งตัว (thread อ่าน request + ส่งผลกลับจาก batcher thread)"""
+
+    def __init__(self, server: "InferenceServer", conn):
+        self.server = server
+        self.conn = conn
+        self.ring: AttachedRing | None = None
+        self._send_lock = threading.Lock()
+
+    def send(self, msg) -> None:
+        with self._send_lock:
+            try:
+                self.conn.send(msg)
+            except (OSError, EOFError):
+                pass  # client หายไปแล้ว
+
+    def serve(self) -> None:
+        try:
+            while True:
+                try:
+                    msg = self.conn.recv()
+                except (EOFError, OSError):
+                    return
+                kind = msg[0]
+                if kind == "hello":
+                    _, shm_name, slot_bytes = msg
+                    self.ring = AttachedRing(shm_name, slot_bytes)
+                    self.send(("hello", self.server.info()))
+                elif kind == "predict":
+                    self._predict(*msg[1:])
+                elif kind == "ping":
+                    self.send(("pong", self.server.stats()))
+        finally:
+            if self.ring is not None:
+                self.ring.close()
+            self.conn.close()
+
+    def _predict(self, req_id: int, conf: float, frames: list) -> None:
+        try:
+            imgs = [self.ring.view(*f[1:]) if f[0] == "shm" else f[1] for f in frames]
+            futs = [self.server.batcher(conf).submit(img) for img in imgs]
+        except Exception as e:
+            self.send(("err", req_id, f"{type(e).__name__}: {e}"))
+            return
+        self.server.requests += 1
+        remaining = [len(futs)]
+        lock = threading.Lock()
+
+        def done(_f):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            errors = [f.exception() for f in futs if f.exception() is not None]
+            if errors:
+                self.send(("err", req_id, f"{type(errors[0]).__name__}: {errors[0]}"))
+            else:
+                self.send(("ok", req_id, [_encode(f.result()) for f in futs]))
+
+        for f in futs:
+            f.add_done_callback(done)
+
+
+class InferenceServer:
+    def __init__(self, address: str, backend: str, weights: str | None, int8: bool,
+                 threads: int, max_batch: int, max_wait_ms: float):
+        self.address = address
+        t0 = time.perf_counter()
+        self.engine = load_engine(backend, weights, int8, threads=threads)
+        self.load_s = round(time.perf_counter() - t0, 3)
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self._batchers: dict[float, MicroBatcher] = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.sessions = 0
+
+    def batcher(self, conf: float) -> MicroBatcher:
+        # conf ปกติมีค่าเดียว (CONF_THRESHOLD) → batcher เดียว
+        b = self._batchers.get(conf)
+        if b is None:
+            with self._lock:
+                b = self._batchers.get(conf)
+                if b is None:
+                    b = self._batchers[conf] = MicroBatcher(
+                        lambda imgs, conf=conf: self.engine.predict(imgs, conf),
+                        max_batch=self.max_batch, max_wait_ms=self.max_wait_ms)
+        return b
+
+    def info(self) -> dict:
+        return {
+            "address": self.address,
+            "pid": os.getpid(),
+            "backend": self.engine.name,
+            "identity": self.engine.identity(),
+            "version": self.engine.version(),
+            "names": self.engine.names,
+        }
+
+    def stats(self) -> dict:
+        return {
+            **self.info(),
+            "sessions": self.sessions,
+            "requests": self.requests,
+            "load_s": self.load_s,
+            "batching": {str(c): b.stats() for c, b in self._batchers.items()},
+        }
+
+    def warmup(self, conf: float, size: int = MODEL_WARMUP_SIZE) -> None:
+        img = np.random.default_rng(0).integers(0, 256, (size * 3 // 4, size, 3), dtype=np.uint8)
+        self.batcher(conf).predict(img)
+
+    def serve_forever(self, authkey: bytes) -> None:
+        if os.path.exists(self.address):
+            os.unlink(self.address)   # socket ค้างจากรอบก่อน
+        with Listener(self.address, family="AF_UNIX", authkey=authkey) as listener:
+            log.info("%s listening on %s (pid %d)", self.engine.version(), self.address, os.getpid())
+            while True:
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError) as e:
+                    # authkey ผิด / client ตัดระหว่าง handshake
+                    log.warning("rejected connection: %s", e)
+                    continue
+                self.sessions += 1
+                threading.Thread(target=_Session(self, conn).serve, name="infer-session", daemon=True).start()
+
+
+def run(index: int, base: str, backend: str, weights: str | None, int8: bool, threads: int,
+        max_batch: int, max_wait_ms: float, conf: float, authkey: bytes) -> None:
+    """entry ของแต่ละ inference process"""
+    setup_logging()
+    configure_threads(threads, (backend,))
+    server = InferenceServer(address_for(base, index), backend, weights, int8, threads, max_batch, max_wait_ms)
+    server.warmup(conf)
+    server.serve_forever(authkey)
+
+
+def main(argv=None) -> int:
+    from backend.config import CONF_THRESHOLD
+
+    ap = argparse.ArgumentParser(prog="python -m backend.infer_server", description=__doc__.split("\n\n")[0])
+    ap.add_argument("--address", default=INFER_SERVER_ADDRESS, help="path ฐานของ Unix socket")
+    ap.add_argument("--procs", type=int, default=INFER_SERVER_PROCS)
+    ap.add_argument("--backend", default=INFER_SERVER_BACKEND, choices=("ultralytics", "onnx", "openvino"))
+    ap.add_argument("--weights", default=None, help="ไฟล์โมเดล (ไม่ระบุ = ตาม MODEL_PATH/MODEL_ARTIFACT)")
+    ap.add_argument("--int8", action="store_true", default=MODEL_INT8)
+    ap.add_argument("--threads", type=int, default=None, help="intra-op threads ต่อ process (default = cpu / procs)")
+    ap.add_argument("--batch", type=int, default=INFER_SERVER_BATCH)
+    ap.add_argument("--batch-wait-ms", type=float, default=INFER_SERVER_BATCH_WAIT_MS)
+    args = ap.parse_args(argv)
+    if not args.address:
+        ap.error("--address (หรือ INFER_SERVER_ADDRESS) is required")
+
+    setup_logging()
+    threads = args.threads or max(1, _CPU_COUNT // max(1, args.procs))
+    authkey = INFER_SERVER_AUTHKEY.encode()
+    ctx = mp.get_context("spawn")   # แต่ละ process โหลด torch/onnxruntime ของตัวเอง (ไม่ fork state)
+    procs = [
+        ctx.Process(target=run, name=f"infer-{i}", daemon=True,
+                    args=(i, args.address, args.backend, args.weights, args.int8, threads,
+                          args.batch, args.batch_wait_ms, CONF_THRESHOLD, authkey))
+        for i in range(max(1, args.procs))
+    ]
+    for p in procs:
+        p.start()
+    log.info("%d process(es) × %d threads, model %s (%s)", len(procs), threads, args.weights or MODEL_PATH, args.backend)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    # process ลูกตายเอง (เช่น OOM) → จบทั้งชุด ให้ supervisor (docker/systemd) restart
+    while not stop.wait(1.0):
+        if any(not p.is_alive() for p in procs):
+            log.error("an inference process exited, shutting down")
+            break
+    for p in procs:
+        p.terminate()
+    for p in procs:
+        p.join(timeout=10)
+    for a in addresses(args.address, len(procs)):
+        if os.path.exists(a):
+            os.unlink(a)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,299 @@
+# backend/ingest.py
+"""
+Streaming upload ingestion: อ่าน multipart body ทีละ chunk แทน UploadFile + image.read()
+
+- ตัดทิ้งทันทีเมื่อไฟล์เกิน MAX_FILE_SIZE (หรือ Content-Length เกินตั้งแต่ header) ไม่ต้อง buffer ทั้งก้อน
+- เขียนลงโฟลเดอร์ปลายทางโดยตรง (incoming ของ blob store) พร้อมคำนวณ content hash ไประหว่างทาง
+- ไฟล์ที่ได้ส่งต่อให้ detect() ทาง path (memory-map) → RAM ต่อ request ไม่โตตามขนาดไฟล์
+- parse + เขียนไฟล์รันใน worker thread (asyncio.to_thread) ไม่บล็อก event loop
+- zip (POST /cards/batch): spool ทั้งก้อนลงดิสก์ก่อน แล้วแตกทีละ entry (จำกัดขนาดจริงระหว่างแตก กัน zip bomb)
+"""
+import asyncio
+import secrets
+import zipfile
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator
+
+from fastapi import HTTPException, Request
+
+try:
+    import python_multipart as multipart
+    from python_multipart.multipart import parse_options_header
+except ModuleNotFoundError:
+    import multipart
+    from multipart.multipart import parse_options_header
+
+from backend.cache import new_hasher
+from backend.config import ALLOWED_MIME, MAX_FILE_SIZE, INGEST_CHUNK_SIZE, INGEST_BODY_SLACK
+
+_SUFFIX = {"image/jpeg": ".jpg", "image/png": ".png"}
+# zip ไม่มี Content-Type ต่อไฟล์ → ดูจาก magic bytes แทน (multipart ก็เช็กซ้ำ: Content-Type เป็นแค่สิ่งที่ client บอก)
+_MAGIC = ((b"\xff\xd8\xff", "image/jpeg"), (b"\x89PNG\r\n\x1a\n", "image/png"))
+_MAGIC_LEN = max(len(m) for m, _ in _MAGIC)
+
+# ใช้กับ openapi_extra ของ endpoint ที่อ่าน body เอง (Swagger ยังมีช่องอัปโหลดไฟล์)
+UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["image"],
+                    "properties": {"image": {"type": "string", "format": "binary"}},
+                }
+            }
+        },
+    }
+}
+
+
+@dataclass
+class UploadedFile:
+    field: str
+    filename: str
+    content_type: str
+    path: Path
+    size: int
+    digest: str     # blake2b (ตรงกับ cache.content_hash)
+
+
+class _Spooler:
+    """callback ของ MultipartParser — ถูกเรียกใน worker thread"""
+
+    def __init__(self, dest_dir: Path, max_file_size: int):
+        self.dest_dir = dest_dir
+        self.max_file_size = max_file_size
+        self.done: list[UploadedFile] = []
+        self._fh = None
+        self._cur: UploadedFile | None = None
+        self._hasher = None
+        self._head = b""        # ไบต์แรกของไฟล์ (ตรวจ magic ตอนจบ part)
+        self._headers: dict[bytes, bytes] = {}
+        self._hfield = b""
+        self._hvalue = b""
+
+    def on_part_begin(self) -> None:
+        self._headers = {}
+        self._hfield = self._hvalue = b""
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._hfield += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._hvalue += data[start:end]
+
+    def on_header_end(self) -> None:
+        self._headers[self._hfield.lower()] = self._hvalue
+        self._hfield = self._hvalue = b""
+
+    def on_headers_finished(self) -> None:
+        _, opts = parse_options_header(self._headers.get(b"content-disposition", b""))
+        filename = opts.get(b"filename")
+        if filename is None:
+            return  # ช่องข้อความธรรมดา — ไม่สนใจ
+        content_type = self._headers.get(b"content-type", b"").decode("latin-1").strip()
+        if content_type not in ALLOWED_MIME:
+            raise HTTPException(400, "Only JPEG/PNG allowed")
+
+        # ไม่ใช้ชื่อไฟล์จาก client เป็น path (กันชนกัน/กัน path แปลก ๆ)
+        path = self.dest_dir / f"up_{secrets.token_hex(8)}{_SUFFIX.get(content_type, '')}"
+        self._cur = UploadedFile(
+            field=opts.get(b"name", b"").decode("utf-8", "replace"),
+            filename=filename.decode("utf-8", "replace"),
+            content_type=content_type,
+            path=path,
+            size=0,
+            digest="",
+        )
+        self._hasher = new_hasher()
+        self._head = b""
+        self._fh = open(path, "wb")
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._fh is None:
+            return
+        self._cur.size += end - start
+        if self._cur.size > self.max_file_size:
+            raise HTTPException(400, f"File too large (max {self.max_file_size // (1024 * 1024)}MB)")
+        chunk = data[start:end]
+        if len(self._head) < _MAGIC_LEN:
+            self._head += chunk[:_MAGIC_LEN - len(self._head)]
+        self._fh.write(chunk)
+        self._hasher.update(chunk)
+
+    def on_part_end(self) -> None:
+        if self._fh is None:
+            return
+        self._fh.close()
+        self._fh = None
+        # เนื้อไฟล์ไม่ใช่ JPEG/PNG จริง → ปฏิเสธตั้งแต่ตอนรับ (ไม่เข้าคิว inference/job)
+        if not any(self._head.startswith(m) for m, _ in _MAGIC):
+            raise HTTPException(400, "Only JPEG/PNG allowed")
+        self._cur.digest = self._hasher.hexdigest()
+        self.done.append(self._cur)
+        self._cur = None
+
+    def abort(self) -> None:
+        """ลบไฟล์ที่เขียนค้างครึ่งทาง"""
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        if self._cur is not None:
+            self._cur.path.unlink(missing_ok=True)
+            self._cur = None
+
+
+async def iter_uploads(
+    request: Request,
+    dest_dir: Path,
+    max_file_size: int = MAX_FILE_SIZE,
+    max_body_size: int | None = None,
+) -> AsyncIterator[UploadedFile]:
+    """
+    stream multipart body แล้ว yield ไฟล์แต่ละไฟล์ทันทีที่เขียนเสร็จ
+    ไฟล์ที่ yield ออกไปแล้วเป็นความรับผิดชอบของผู้เรียก (ตั้งเวลาลบ/ใช้งานต่อ)
+    """
+    if max_body_size is None:
+        max_body_size = max_file_size + INGEST_BODY_SLACK
+
+    ctype, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if ctype != b"multipart/form-data" or not boundary:
+        raise HTTPException(400, "Expected multipart/form-data")
+
+    # ตัดตั้งแต่ header ถ้าบอกขนาดมาแล้วเกิน
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_body_size:
+        raise HTTPException(400, f"File too large (max {max_file_size // (1024 * 1024)}MB)")
+
+    spooler = _Spooler(dest_dir, max_file_size)
+    parser = multipart.MultipartParser(boundary, {
+        "on_part_begin": spooler.on_part_begin,
+        "on_part_data": spooler.on_part_data,
+        "on_part_end": spooler.on_part_end,
+        "on_header_field": spooler.on_header_field,
+        "on_header_value": spooler.on_header_value,
+        "on_header_end": spooler.on_header_end,
+        "on_headers_finished": spooler.on_headers_finished,
+    })
+
+    received = 0
+    buf = bytearray()
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > max_body_size:
+                raise HTTPException(400, f"File too large (max {max_file_size // (1024 * 1024)}MB)")
+            buf += chunk
+            if len(buf) < INGEST_CHUNK_SIZE:
+                continue
+            data, buf = bytes(buf), bytearray()
+            await asyncio.to_thread(parser.write, data)
+            while spooler.done:
+                yield spooler.done.pop(0)
+
+        if buf:
+            await asyncio.to_thread(parser.write, bytes(buf))
+        parser.finalize()
+        while spooler.done:
+            yield spooler.done.pop(0)
+    except multipart.exceptions.MultipartParseError:
+        raise HTTPException(400, "Malformed multipart body")
+    finally:
+        spooler.abort()
+        for leftover in spooler.done:
+            leftover.path.unlink(missing_ok=True)
+
+
+async def ingest_image(request: Request, dest_dir: Path, field: str = "image") -> UploadedFile:
+    """รับไฟล์เดียวจากช่อง `field` (ไฟล์อื่นที่แนบมาจะถูกทิ้ง)"""
+    found: UploadedFile | None = None
+    async for up in iter_uploads(request, dest_dir):
+        if found is None and up.field == field:
+            found = up
+        else:
+            up.path.unlink(missing_ok=True)
+    if found is None:
+        raise HTTPException(422, f"Missing '{field}' file")
+    return found
+
+
+def _extract_zip(archive: Path, dest_dir: Path, max_files: int, max_file_size: int) -> list[UploadedFile]:
+    """แตกภาพทุกไฟล์ใน zip ลง dest_dir (รันใน worker thread) — field = ชื่อไฟล์ไม่รวมโฟลเดอร์/นามสกุล"""
+    out: list[UploadedFile] = []
+    too_large = HTTPException(400, f"File too large (max {max_file_size // (1024 * 1024)}MB)")
+    try:
+        with zipfile.ZipFile(archive) as zf:
+            infos = [i for i in zf.infolist() if not i.is_dir()]
+            if len(infos) > max_files:
+                raise HTTPException(400, f"Too many files (max {max_files})")
+            for info in infos:
+                if info.file_size > max_file_size:
+                    raise too_large
+                path = dest_dir / f"up_{secrets.token_hex(8)}"
+                up = UploadedFile(field=Path(info.filename).stem, filename=info.filename,
+                                  content_type="", path=path, size=0, digest="")
+                out.append(up)
+                hasher = new_hasher()
+                with zf.open(info) as src, open(path, "wb") as fh:
+                    while chunk := src.read(INGEST_CHUNK_SIZE):
+                        if not up.size:
+                            up.content_type = next((t for m, t in _MAGIC if chunk.startswith(m)), "")
+                            if up.content_type not in ALLOWED_MIME:
+                                raise HTTPException(400, "Only JPEG/PNG allowed")
+                        up.size += len(chunk)
+                        if up.size > max_file_size:
+                            raise too_large
+                        fh.write(chunk)
+                        hasher.update(chunk)
+                if not up.size:
+                    raise HTTPException(400, f"Empty file in zip: {info.filename}")
+                up.digest = hasher.hexdigest()
+                up.path = path.rename(path.with_suffix(_SUFFIX[up.content_type]))
+    except BaseException as e:
+        for up in out:
+            up.path.unlink(missing_ok=True)
+        # RuntimeError = entry ที่เข้ารหัสไว้, NotImplementedError = วิธีบีบอัดที่ไม่รองรับ
+        if isinstance(e, (zipfile.BadZipFile, zipfile.LargeZipFile, zlib.error, EOFError,
+                          RuntimeError, NotImplementedError)):
+            raise HTTPException(400, "Malformed zip archive") from None
+        raise
+    return out
+
+
+async def ingest_zip(
+    request: Request,
+    dest_dir: Path,
+    max_files: int,
+    max_body_size: int,
+    max_file_size: int = MAX_FILE_SIZE,
+) -> list[UploadedFile]:
+    """
+    รับ body แบบ application/zip: stream ลงดิสก์ (ตัดทันทีถ้าเกิน max_body_size) แล้วแตกภาพทุกไฟล์
+    ไฟล์ที่คืนไปเป็นความรับผิดชอบของผู้เรียกเหมือน iter_uploads
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_body_size:
+        raise HTTPException(400, f"Body too large (max {max_body_size // (1024 * 1024)}MB)")
+
+    archive = dest_dir / f"zip_{secrets.token_hex(8)}.zip"
+    try:
+        received = 0
+        buf = bytearray()
+        with open(archive, "wb") as fh:
+            async for chunk in request.stream():
+                received += len(chunk)
+                if received > max_body_size:
+                    raise HTTPException(400, f"Body too large (max {max_body_size // (1024 * 1024)}MB)")
+                buf += chunk
+                if len(buf) >= INGEST_CHUNK_SIZE:
+                    await asyncio.to_thread(fh.write, bytes(buf))
+                    buf = bytearray()
+            if buf:
+                await asyncio.to_thread(fh.write, bytes(buf))
+        return await asyncio.to_thread(_extract_zip, archive, dest_dir, max_files, max_file_size)
+    finally:
+        archive.unlink(missing_ok=True)
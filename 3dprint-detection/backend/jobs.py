@@ -0,0 +1,108 @@
+# backend/jobs.py
+"""
+Async job mode: อัปโหลดแล้วตอบ 202 ทันที งานจริง (decode/infer/annotate/save) รันเบื้องหลัง
+
+- คิวเก็บในตาราง jobs ของ SQLite (backend/database.py) → รอด restart / ใช้ร่วมหลาย process ได้
+- worker เป็น coroutine บน event loop; งานหนักส่งต่อให้ inference pool (backend/executor.py)
+- handler ที่ประมวลผลงานจริงลงทะเบียนผ่าน start(handler) (อยู่ใน cards.py)
+- GET /jobs/{job_id} คืนสถานะ + Card payload เมื่อเสร็จ
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+
+from fastapi import APIRouter, HTTPException
+
+from backend.config import (
+    JOB_WORKERS,
+    JOB_POLL_INTERVAL,
+    JOB_LEASE_SECONDS,
+    JOB_MAX_ATTEMPTS,
+    JOB_RETENTION,
+)
+from backend.schemas import Job
+from backend import executor
+from . import database as db
+
+log = logging.getLogger(__name__)
+
+router = APIRouter()
+
+_handler: Callable[[dict], Awaitable[dict]] | None = None
+_wakeup: asyncio.Event | None = None
+_tasks: list[asyncio.Task] = []
+
+
+def notify() -> None:
+    """ปลุก worker หลังมีงานใหม่เข้าคิว"""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def _worker() -> None:
+    last_purge = 0.0
+    while True:
+        _wakeup.clear()
+        try:
+            job = await db.run(db.claim_next_job, JOB_LEASE_SECONDS)
+        except Exception as e:
+            # เช่น database is locked — ถอยแล้วลองรอบหน้า
+            log.warning("claim failed: %s", e)
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+            continue
+        if job is None:
+            # ล้างงานเก่าเป็นครั้งคราวตอนว่าง
+            if time.time() - last_purge > 3600:
+                await db.run(db.purge_jobs, time.time() - JOB_RETENTION)
+                last_purge = time.time()
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        job_id = job["job_id"]
+        try:
+            result = await _handler(job)
+        except executor.QueueFull as e:
+            # inference pool เต็ม → คืนงานเข้าคิวแล้วถอย (ไม่นับเป็น attempt)
+            await db.run(db.requeue_job, job_id)
+            await asyncio.sleep(e.retry_after)
+        except asyncio.CancelledError:
+            db.requeue_job(job_id)
+            raise
+        except Exception as e:
+            detail = getattr(e, "detail", None) or str(e) or type(e).__name__
+            # 4xx (เช่นภาพเสีย) ลองใหม่ก็ได้ผลเดิม → fail ทันที
+            client_error = isinstance(e, HTTPException) and e.status_code < 500
+            await db.run(db.fail_job, job_id, str(detail),
+                         retry=job["attempts"] < JOB_MAX_ATTEMPTS and not client_error)
+            log.warning("%s failed (attempt %d): %s", job_id, job["attempts"], detail)
+        else:
+            await db.run(db.finish_job, job_id, result)
+
+
+def start(handler: Callable[[dict], Awaitable[dict]]) -> None:
+    """เริ่ม worker (เรียกจาก lifespan ของ app)"""
+    global _handler, _wakeup
+    _handler = handler
+    _wakeup = asyncio.Event()
+    for _ in range(max(1, JOB_WORKERS)):
+        _tasks.append(asyncio.create_task(_worker()))
+
+
+async def stop() -> None:
+    for t in _tasks:
+        t.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+
+
+# ---------- endpoints ----------
+@router.get("/jobs/{job_id}", response_model=Job)
+async def get_job(job_id: str):
+    job = await db.run(db.get_job, job_id)
+    if not job:
+        raise HTTPException(404, "Job not found")
+    return job
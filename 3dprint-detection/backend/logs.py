@@ -0,0 +1,30 @@
+# backend/logs.py
+"""
+Logging ของ backend (แทน print บน hot path)
+
+- logger ชื่อ backend.* → handler เดียว (stderr) ระดับตาม LOG_LEVEL; ไม่ส่งต่อให้ root (log ไม่ซ้ำกับ uvicorn)
+- ผลราย detect อยู่ที่ DEBUG และสุ่มเก็บแค่ LOG_DETECT_SAMPLE ของทั้งหมด
+  → เปิดดูได้ตอน debug โดยไม่ต้องเขียน stdout ทุก request
+"""
+import logging
+import random
+
+from backend.config import LOG_LEVEL, LOG_DETECT_SAMPLE
+
+_FORMAT = "%(asctime)s %(levelname)s [%(name)s] %(message)s"
+
+
+def setup(level: str = LOG_LEVEL) -> logging.Logger:
+    root = logging.getLogger("backend")
+    root.setLevel(level)
+    if not root.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(_FORMAT))
+        root.addHandler(handler)
+        root.propagate = False
+    return root
+
+
+def sampled(rate: float = LOG_DETECT_SAMPLE) -> bool:
+    """True ด้วยความน่าจะเป็น rate (>= 1 = ทุกครั้ง, <= 0 = ไม่เลย)"""
+    return rate >= 1 or (rate > 0 and random.random() < rate)
@@ -1,23 +1,121 @@
+import time
+_T_IMPORT = time.perf_counter()
+
 from fastapi.responses import FileResponse
 from fastapi import HTTPException
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import Request, Response
+from contextlib import asynccontextmanager
+import asyncio
 from pathlib import Path
 from backend.temp_store import TMP_ROOT
 from backend import temp_store  
 
 from . import cards
+from . import jobs
+from . import webhooks
+from . import history
+from backend.events import broker
+from . import executor
+from . import model
+from . import engines
+from backend.registry import registry
+from backend import registry as models
+from . import render
+from backend.config import RENDER_THUMB_SIZES
 from backend.database import init_db
+from backend import database as db
+from backend import metrics
+from backend.logs import setup as setup_logging
 import mimetypes
+import re
+import shutil
 from urllib.parse import unquote
+setup_logging()
+
 # -----------------------------
 # Init app & DB
 # -----------------------------
-app = FastAPI()
+# เวลา startup (วินาที) — ดูได้ที่ /readyz และ /stats
+startup = {"import_s": None, "lifespan_s": None, "ready_s": None}
+
+
+async def _load_model(t0: float) -> None:
+    # โหลด + warmup โมเดลเบื้องหลัง → worker รับ /healthz ได้ทันที, /readyz = 200 เมื่อพร้อม infer
+    # threads ของ torch ตั้งครั้งเดียวทั้ง process ก่อนโหลด engine ตัวแรก (MODEL_THREADS)
+    await asyncio.to_thread(engines.configure_threads)
+    await model.start()
+    if model.ready.is_set():
+        startup["ready_s"] = round(time.perf_counter() - t0, 3)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    t0 = time.perf_counter()
+    model_load = asyncio.create_task(_load_model(t0))
+    # worker ของโหมด async (คิวงานใน SQLite)
+    jobs.start(cards.run_job)
+    # ส่ง webhook จาก outbox (pool connection + retry)
+    webhooks.start()
+    # ประวัติผล detect ต่อ card (เขียนเป็นรอบ + rollup + retention)
+    history.start()
+    # blob store + ตัวลบไฟล์ temp หมดอายุ (สแกนดิสก์ใหม่ทุกครั้งที่ start)
+    await temp_store.start()
+    # ล้าง API key หมดอายุเป็นระยะ (ทีละ batch)
+    key_purge = asyncio.create_task(db.purge_apikeys_forever())
+    startup["lifespan_s"] = round(time.perf_counter() - t0, 3)
+    yield
+    model_load.cancel()
+    key_purge.cancel()
+    broker.close()
+    await temp_store.stop()
+    await jobs.stop()
+    await webhooks.stop()
+    await history.stop()
+    db.close_pool()
+    # ปิด inference pool ตอน shutdown (ยกเลิกงานที่ยังไม่เริ่ม) แล้วปลดทุกเวอร์ชันของโมเดล (รองานที่รันอยู่จบ)
+    executor.shutdown(wait=False)
+    await asyncio.to_thread(registry.close)
+
+
+app = FastAPI(lifespan=lifespan)
 init_db()
 
+
+# -----------------------------
+# Health / readiness (สำหรับ load balancer)
+# -----------------------------
+@app.get("/healthz")
+async def healthz():
+    # liveness: process + event loop ยังตอบได้ (ไม่ขึ้นกับโมเดล)
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    # readiness: โมเดลโหลด + warmup เสร็จแล้ว → ส่ง traffic มาได้
+    st = model.state
+    body = {
+        "status": st["status"],
+        "model": registry.active.version if registry.active is not None else None,
+        "error": st["error"],
+        "startup": {**startup, "load_s": st["load_s"], "warmup_s": st["warmup_s"]},
+    }
+    return JSONResponse(status_code=200 if model.ready.is_set() else 503, content=body)
+
+
+# คิว inference เต็ม → 503 + Retry-After (backpressure ให้ client ถอย)
+@app.exception_handler(executor.QueueFull)
+async def queue_full_handler(request: Request, exc: executor.QueueFull):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 # -----------------------------
 # CORS middleware
 # -----------------------------
@@ -34,38 +132,133 @@ app.add_middleware(
 # Include API router
 # -----------------------------
 app.include_router(cards.router)
+app.include_router(jobs.router)
+app.include_router(models.router)
 # -----------------------------
 # Serve temp results
 # -----------------------------
+# ชื่อที่ใช้เป็น key ของ hot cache ได้ตรง ๆ (ไม่มี / หรือ .. → ไม่ต้อง resolve())
+_SAFE_SEGMENT = re.compile(r"[\w\-]+(\.[\w\-]+)*")
+# URL ที่มีเวอร์ชัน (?v= จาก backend หรือ ?_= จากหน้าเว็บ) → เนื้อหาไม่เปลี่ยนตลอดอายุ URL
+_VERSION_PARAMS = ("v", "_")
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "no-cache"   # เก็บได้ แต่ต้องถามด้วย If-None-Match ทุกครั้ง (ได้ 304 ถ้าไม่เปลี่ยน)
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    inm = request.headers.get("if-none-match")
+    if not inm:
+        return False
+    return inm.strip() == "*" or etag in (t.strip().removeprefix("W/") for t in inm.split(","))
+
+
 @app.get("/temp/results/{sid}/{filename}")
-def serve_result(sid: str, filename: str):
-    # decode ชื่อไฟล์และกัน path traversal
-    safe_name = Path(unquote(filename)).name
-    p = (TMP_ROOT / sid / safe_name).resolve()
+def serve_result(request: Request, sid: str, filename: str, size: int | None = None, fmt: str = "jpeg"):
+    if size is not None and size not in RENDER_THUMB_SIZES:
+        raise HTTPException(status_code=400, detail=f"size must be one of {list(RENDER_THUMB_SIZES)}")
+    if fmt not in render.FORMATS:
+        raise HTTPException(status_code=400, detail=f"fmt must be one of {list(render.FORMATS)}")
+
+    versioned = any(k in request.query_params for k in _VERSION_PARAMS)
+    cache_control = IMMUTABLE_CACHE if versioned else REVALIDATE_CACHE
+
+    # hot path: ผลที่เพิ่งเขียน → meta อยู่ในแรมแล้ว ไม่ต้อง resolve/exists/อ่านไฟล์
+    name = unquote(filename)
+    entry = None
+    if _SAFE_SEGMENT.fullmatch(sid) and _SAFE_SEGMENT.fullmatch(name):
+        p = TMP_ROOT / sid / name
+        entry = render.load_meta(render.meta_path_for(p), hot_only=True)
 
-    if TMP_ROOT not in p.parents and p != TMP_ROOT:
-        raise HTTPException(status_code=400, detail="invalid path")
+    if entry is None:
+        # decode ชื่อไฟล์และกัน path traversal
+        safe_name = Path(name).name
+        p = (TMP_ROOT / sid / safe_name).resolve()
+        if TMP_ROOT not in p.parents and p != TMP_ROOT:
+            raise HTTPException(status_code=400, detail="invalid path")
+        p = TMP_ROOT / sid / safe_name
+        entry = render.load_meta(render.meta_path_for(p))
 
-    if not p.exists():
+    # ผลจาก detect() เป็น sidecar → ETag จากเนื้อหา sidecar; ภาพวาดตอนถูกขอ (ครั้งแรก) แล้ว cache ในแรม
+    if entry is not None:
+        etag = render.etag_for(entry[1], size, fmt)
+        headers = {"ETag": etag, "Cache-Control": cache_control}
+        if _not_modified(request, etag):
+            return Response(status_code=304, headers=headers)
+        try:
+            data, media_type = render.render_meta(*entry, size=size, fmt=fmt)
+        except (FileNotFoundError, ValueError):
+            raise HTTPException(status_code=404, detail="result not found or expired")
+        return Response(content=data, media_type=media_type, headers=headers)
+
+    try:
+        st = p.stat()
+    except OSError:
+        raise HTTPException(status_code=404, detail="result not found or expired")
+    if not p.is_file():
         raise HTTPException(status_code=404, detail="result not found or expired")
 
     mime, _ = mimetypes.guess_type(str(p))
     if not mime:
         mime = "application/octet-stream"
 
-    print("[serve_result]", p, "=>", mime)  # log debug ดูว่าชี้ path ถูกไหม
+    etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(str(p), media_type=mime, headers=headers)
 
-    return FileResponse(
-        str(p),
-        media_type=mime,
-        headers={
-            "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
-            "Pragma": "no-cache",
-            "Expires": "0",
-        },
-    )
 
 
+# -----------------------------
+# Prometheus metrics (histogram ของแต่ละขั้นอยู่ใน backend/metrics.py; ที่นี่คือ gauge ที่อ่านตอน scrape)
+# -----------------------------
+def _batch_queues() -> dict:
+    vers = [v for v in (registry.active, registry.candidate) if v is not None and v.batcher is not None]
+    return {v.version: v.batcher.stats()["queued"] for v in vers}
+
+
+metrics.GaugeFunc("model_ready", "1 = โมเดลโหลด + warmup เสร็จแล้ว", lambda: int(model.ready.is_set()))
+metrics.GaugeFunc("inference_pending", "งานใน inference executor (รวมที่กำลังรัน)", executor.pending)
+metrics.GaugeFunc("batch_queue_depth", "ภาพที่รอใน micro-batcher ต่อเวอร์ชันโมเดล", _batch_queues, ("version",))
+metrics.GaugeFunc("jobs_queued", "งาน async ที่รอในคิว (SQLite)", lambda: db.count_jobs("queued"))
+metrics.GaugeFunc("webhooks_pending", "webhook ที่รอส่ง (outbox)", lambda: db.count_webhooks("pending"))
+metrics.GaugeFunc("history_buffered_rows", "ผล detect ที่รอเขียนลง history", lambda: history.stats()["buffered"])
+metrics.GaugeFunc("webhooks_inflight", "webhook ที่กำลังส่ง", lambda: webhooks.stats()["inflight"])
+metrics.GaugeFunc("temp_tracked_paths", "ไฟล์/โฟลเดอร์ temp ที่รอหมดอายุ", lambda: temp_store.sweeper.stats()["tracked"])
+metrics.GaugeFunc("temp_bytes_freed", "ไบต์ที่ sweeper ลบไปแล้ว (นับตั้งแต่ start)", lambda: temp_store.sweeper.stats()["bytes_freed"])
+metrics.GaugeFunc("blob_store_bytes", "ขนาดรวมของไฟล์อัปโหลดใน blob store", lambda: temp_store.blobs.stats()["bytes"])
+metrics.GaugeFunc("blob_store_quota_bytes", "BLOB_QUOTA_BYTES", lambda: temp_store.blobs.quota_bytes)
+metrics.GaugeFunc("temp_fs_free_bytes", "พื้นที่ว่างของดิสก์ที่ TMP_ROOT / BLOB_ROOT อยู่",
+                  lambda: {"tmp": shutil.disk_usage(TMP_ROOT).free, "blobs": shutil.disk_usage(temp_store.blobs.root).free},
+                  ("path",))
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# -----------------------------
+# Runtime stats (คิว inference / ขนาด batch ที่ทำได้จริง)
+# -----------------------------
+@app.get("/stats")
+def stats():
+    return {
+        "model": {**model.state, "startup": startup},
+        "models": registry.stats(),   # active/candidate/retired + batching ต่อเวอร์ชัน
+        "inference_pending": executor.pending(),
+        "jobs_queued": db.count_jobs("queued"),
+        "detect_cache": model.detect_cache.stats(),
+        "frame_gate": model.frame_gate.stats(),
+        "render_cache": render.render_cache.stats(),
+        "temp_files": temp_store.sweeper.stats(),
+        "blob_store": temp_store.blobs.stats(),
+        "apikey_cache": db.key_cache.stats(),
+        "card_stream": broker.stats(),
+        "history": history.stats(),
+        "webhooks": {**webhooks.stats(), "pending": db.count_webhooks("pending"), "failed_total": db.count_webhooks("failed")},
+    }
+
 
 # สำหรับไฟล์ frontend static (CSS/JS)
 frontend_static = Path(__file__).resolve().parent.parent / "frontend" / "static"
@@ -79,3 +272,6 @@ frontend_index = Path(__file__).resolve().parent.parent / "frontend" / "index.ht
 @app.get("/", response_class=HTMLResponse)
 def read_index():
     return frontend_index.read_text(encoding="utf-8")
+
+
+startup["import_s"] = round(time.perf_counter() - _T_IMPORT, 3)
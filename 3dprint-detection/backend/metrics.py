@@ -0,0 +1,199 @@
+# backend/metrics.py
+"""
+Metrics แบบ Prometheus (text format 0.0.4) — เสิร์ฟที่ GET /metrics (backend/main.py)
+
+- Counter / Histogram เก็บในแรมของ process (lock สั้น ๆ ต่อ metric, ไม่มี I/O บน hot path)
+- gauge แบบ callback: คำนวณตอนถูก scrape เท่านั้น (ขนาดคิว, ดิสก์ของ temp store)
+- ไม่ต้องติดตั้ง prometheus_client; หลาย uvicorn worker → แต่ละ worker มีค่าของตัวเอง
+  (scrape ทีละ worker/port หรือรัน 1 worker ต่อ container; worker_info{pid} บอกว่าได้ของตัวไหน)
+
+    DECODE = STAGE_SECONDS.labels("decode")
+    with DECODE.time():
+        ...
+"""
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+from backend.config import METRICS_NAMESPACE
+
+# latency ของงานใน process (decode/inference/DB): 0.5 ms … 10 s
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# งานผ่าน network (webhook)
+NETWORK_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_metrics: list = []
+
+
+def _fmt(v: float) -> str:
+    v = float(v)
+    if v == float("inf"):
+        return "+Inf"
+    return str(int(v)) if v.is_integer() and abs(v) < 1e15 else repr(v)
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = f"{METRICS_NAMESPACE}_{name}" if METRICS_NAMESPACE else name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def labels(self, *values):
+        """child ที่ผูก label ไว้แล้ว (cache ไว้ — เรียกซ้ำได้ถูก)"""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in list(self._children.items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def _render_child(self, key, child):
+        return [f"{self.name}_total{_labels(self.labelnames, key)} {_fmt(child.value)}"]
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # ช่องสุดท้าย = +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def _render_child(self, key, child):
+        with child._lock:
+            counts, total = list(child.counts), child.sum
+        lines, acc = [], 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            acc += n
+            le = 'le="%s"' % _fmt(bound)
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {acc}")
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_fmt(total)}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {acc}")
+        return lines
+
+
+class GaugeFunc(_Metric):
+    """gauge ที่อ่านค่าตอน scrape: fn() → ตัวเลข หรือ {label value(s): ตัวเลข}"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable, labelnames: tuple = ()):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            value = self.fn()
+        except Exception:
+            return []   # แหล่งข้อมูลยังไม่พร้อม (เช่น DB ปิดอยู่) — ข้ามรอบนี้
+        if value is None:
+            return []
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for key, v in items:
+            if v is None:
+                continue
+            key = key if isinstance(key, tuple) else (key,)
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_fmt(v)}")
+        return lines
+
+
+def render() -> str:
+    """ทุก metric เป็น Prometheus text exposition"""
+    lines = []
+    for m in _metrics:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------- metrics ของ app (ประกาศรวมไว้ที่เดียว ชื่อจะได้ไม่ชนกัน) ----------
+STAGE_SECONDS = Histogram("detect_stage_seconds", "เวลาแต่ละขั้นของ detect()/render", ("stage",))
+DETECT_RESULTS = Counter("detect_results", "ผล detect ตาม status และที่มา (infer/cache/gate)", ("status", "source"))
+CASCADE_DECISIONS = Counter("cascade_decisions", "ภาพที่ผ่าน cascade ตามรอบที่ตัดสินผล (fast/full)", ("stage",))
+DB_SECONDS = Histogram("db_op_seconds", "เวลา helper ของ database.py", ("op",))
+APIKEY_SECONDS = Histogram("apikey_check_seconds", "เวลาหา API key (cache / db / unknown = ไม่มี key นี้)", ("source",))
+WEBHOOK_SECONDS = Histogram("webhook_delivery_seconds", "เวลาส่ง webhook หนึ่งครั้ง", ("result",), NETWORK_BUCKETS)
+GaugeFunc("worker_info", "uvicorn worker ที่ตอบ scrape นี้", lambda: {str(os.getpid()): 1}, ("pid",))
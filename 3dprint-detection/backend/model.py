@@ -1,93 +1,315 @@
-import os, datetime
-import cv2
-import numpy as np
+import datetime
+import json
+import logging
+import threading
+from contextlib import ExitStack
+from dataclasses import dataclass
 from pathlib import Path
-import torch
-from ultralytics import YOLO
-from backend.config import MODEL_PATH, CONF_THRESHOLD, RESULT_DIR
-
-torch.serialization.add_safe_globals([
-    torch.nn.modules.container.Sequential,
-    torch.nn.Module,
-    YOLO.__class__,
-])
-
-MODEL_PATH = "backend/best.pt"
-model = YOLO(MODEL_PATH)
-
-def detect(image_bytes: bytes, card_id: str, out_dir: Path):
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-
-    results = model.predict(img, conf=CONF_THRESHOLD)[0]
-    scores = {}
-
-    has_non_3dprint = False
-    has_detection = len(results.boxes) > 0
-    print("Number of detections:", len(results.boxes))
-
-    for i, box in enumerate(results.boxes):
-        xyxy = box.xyxy[0].cpu().numpy().astype(int)
-        conf = float(box.conf[0].cpu().numpy())
-        cls_id = int(box.cls[0].cpu().numpy())
-        label = model.names.get(cls_id, f"class_{cls_id}")
-
-        if cls_id not in [0, 1]:
-            has_non_3dprint = True
-
-        scores[label] = max(scores.get(label, 0.0), conf)
-        print(f"Box {i}: Class={label}, Conf={conf:.2f}, XYXY={xyxy}")
-
-        # --- กำหนดสีกรอบตามคลาส ---
-        if cls_id == 0:
-            color = (0, 255, 0)     # Green = normal
-        elif cls_id == 1:
-            color = (0, 0, 255)     # Red = spaghetti
-        else:
-            color = (255, 0, 0)     # Blue = not 3d part
-
-        # --- วาดกรอบ detection ---
-        cv2.rectangle(img, (xyxy[0], xyxy[1]), (xyxy[2], xyxy[3]), color, 2)
-
-        # --- เตรียมข้อความและพื้นหลัง ---
-        label_text = f"{label} {conf:.2f}"
-        font = cv2.FONT_HERSHEY_SIMPLEX
-        font_scale = 2
-        font_thickness = 2
-
-        # คำนวณขนาดกล่องพื้นหลังให้พอดีกับข้อความ
-        (text_w, text_h), _ = cv2.getTextSize(label_text, font, font_scale, font_thickness)
-        text_x, text_y = xyxy[0], max(20, xyxy[1] - 10)  # ตำแหน่งข้อความเหนือกรอบ
-
-        # พื้นหลังสีเดียวกับกรอบแต่โปร่งเล็กน้อย
-        bg_color = tuple(int(c * 0.5) for c in color)
-        cv2.rectangle(img, (text_x - 2, text_y - text_h - 2),
-                      (text_x + text_w + 2, text_y + 4),
-                      bg_color, -1)
-        # วาดข้อความทับบนพื้นหลัง
-        cv2.putText(img, label_text, (text_x, text_y),
-                    font, font_scale, (255, 255, 255), font_thickness, cv2.LINE_AA)
+from fastapi import HTTPException
+from backend.config import (
+    CONF_THRESHOLD, INFER_RETRY_AFTER,
+    MODEL_CANARY_PATH, MODEL_CANARY_PERCENT,
+    DETECT_CACHE_SIZE, DETECT_CACHE_MAX_BYTES, DETECT_CACHE_TTL,
+    GATE_DIFF_THRESHOLD, GATE_MAX_AGE, GATE_MAX_CARDS, GATE_THUMB_SIZE,
+    DECODE_POLICY, DECODE_TARGET_SIZE,
+    CASCADE_BAND_HIGH,
+)
+from backend.cache import DetectionCache, content_hash
+from backend.gate import FrameGate, fingerprint
+from backend.decode import decode_for_inference, load_buffer
+from backend.engines import summarize
+from backend.registry import ModelVersion, registry
+from backend.render import write_meta
+from backend.logs import sampled
+from backend.metrics import STAGE_SECONDS, DETECT_RESULTS, CASCADE_DECISIONS
+from . import executor
 
-    # --- ตัดสินผลรวม ---
-    if not has_detection:
-        status = "NOT_3DPRINT_PART"
-    elif has_non_3dprint:
-        status = "NOT_3DPRINT_PART"
-    elif scores.get("spaghetti", 0.0) >= CONF_THRESHOLD:
-        status = "FAIL"
-    else:
-        status = "NORMAL"
-
-    # --- บันทึกไฟล์ผลลัพธ์ ---
+log = logging.getLogger(__name__)
+
+_T_GATE = STAGE_SECONDS.labels("gate")
+_T_DECODE = STAGE_SECONDS.labels("decode")
+_T_INFER = STAGE_SECONDS.labels("inference")
+_T_WRITE = STAGE_SECONDS.labels("write_meta")
+_T_INFER_BATCH = STAGE_SECONDS.labels("inference_batch")   # ต่อ 1 predict ของ detect_batch (หลายภาพ)
+_T_INFER_FAST = STAGE_SECONDS.labels("inference_fast")     # รอบถูกของ cascade (ต่อ 1 predict)
+_DECIDED_FAST = CASCADE_DECISIONS.labels("fast")
+_DECIDED_FULL = CASCADE_DECISIONS.labels("full")
+
+# โมเดลอยู่ใน registry (backend/registry.py) — โหลดใน lifespan (start()) ไม่ใช่ตอน import
+# → import app เร็ว, route ที่ไม่ infer ไม่ต้องมี torch, สลับเวอร์ชันได้ตอนรัน
+ready = threading.Event()
+state = {"status": "pending", "error": None, "load_s": None, "warmup_s": None}
+
+
+class ModelNotReady(executor.QueueFull):
+    """โมเดลยังโหลด/warmup ไม่เสร็จ — ตอบ 503 + Retry-After เหมือนคิวเต็ม (jobs คืนคิวโดยไม่นับ attempt)"""
+
+    def __init__(self, retry_after: int = INFER_RETRY_AFTER):
+        Exception.__init__(self, f"Model is {state['status']}, retry later")
+        self.retry_after = retry_after
+
+# cache ผล detect (scores/status/กรอบ) ตาม hash ของ bytes ที่อัปโหลด (ภาพซ้ำ → ไม่ต้อง infer ใหม่)
+detect_cache = DetectionCache(DETECT_CACHE_SIZE, DETECT_CACHE_MAX_BYTES, DETECT_CACHE_TTL)
+
+# gate ต่อ card: ภาพแทบไม่เปลี่ยน (noise) → ใช้ผลรอบก่อน
+frame_gate = FrameGate(GATE_DIFF_THRESHOLD, GATE_MAX_AGE, GATE_MAX_CARDS, GATE_THUMB_SIZE)
+
+
+async def start() -> None:
+    """โหลด + warmup เบื้องหลัง (lifespan) — ระหว่างนี้ /readyz ตอบ 503, detect() raise ModelNotReady"""
+    state["status"] = "loading"
+    try:
+        ver = await registry.deploy()
+    except Exception as e:
+        state["status"], state["error"] = "failed", f"{type(e).__name__}: {e}"
+        log.error("load failed: %s", state["error"])
+        return
+    state["load_s"], state["warmup_s"] = ver.load_s, ver.warmup_s
+    state["status"] = "ready"
+    ready.set()
+
+    # canary ตั้งแต่ start (ทุก worker ได้ชุดเดียวกัน) — โหลดไม่ขึ้นไม่กระทบตัวหลัก
+    if MODEL_CANARY_PATH:
+        try:
+            await registry.deploy(MODEL_CANARY_PATH, canary_percent=MODEL_CANARY_PERCENT)
+        except Exception as e:
+            log.error("canary %s failed: %s: %s", MODEL_CANARY_PATH, type(e).__name__, e)
+
+
+def _source_path(image: bytes | Path, image_buf, out_dir: Path, card_id: str) -> Path:
+    """ไฟล์ต้นฉบับที่ render จะใช้วาดภาพผลลัพธ์ทีหลัง (ถ้าได้ bytes มาต้องเขียนลงดิสก์ก่อน)"""
+    if isinstance(image, (str, Path)):
+        return Path(image).resolve()   # link ใน session → blob จริง
+    src = out_dir / f"{card_id}_latest.src"
+    src.write_bytes(image_buf)
+    return src
+
+
+def _response(result_name: str, result: dict, reused: bool) -> dict:
+    return {
+        "result_name": result_name,
+        "model": result.get("model"),
+        "scores": dict(result["scores"]),
+        "status": result["status"],
+        "boxes": result["boxes"],
+        "updated_at": datetime.datetime.utcnow().isoformat(),
+        "reused": reused,
+        "stage": result.get("stage"),
+    }
+
+
+def detect(image: bytes | Path, card_id: str, out_dir: Path, digest: str | None = None):
+    """
+    image  = bytes ของไฟล์ หรือ path ของไฟล์ที่ spool ไว้แล้ว (จะถูก mmap)
+    digest = content hash ที่คำนวณไว้แล้วตอน ingest (ไม่ต้อง hash ซ้ำ)
+
+    ไม่วาด/ไม่ encode ภาพ — เก็บแค่กรอบดิบเป็น sidecar ({card_id}_latest.json)
+    ภาพ annotate ถูก render ตอนมีคนขอ /temp/results/... (ดู backend/render.py)
+
+    เวอร์ชันโมเดลเลือกโดย registry ตาม card_id (canary) และถูกยืมไว้จนจบงาน
+    CASCADE_MODE เปิดอยู่ → รอบถูกก่อน รอบเต็มเฉพาะภาพที่ก้ำกึ่ง (ผลบอกใน "stage" ดู _infer)
+    """
+    with registry.acquire(card_id) as ver:
+        if ver is None:
+            raise ModelNotReady()
+        return _detect(ver, image, card_id, out_dir, digest)
+
+
+@dataclass
+class _Pending:
+    """ภาพที่ผ่าน cache/gate มาแล้วและ decode แล้ว — รอผล predict"""
+    card_id: str
+    result_name: str
+    result_path: Path
+    source: Path
+    cache_key: str
+    thumb: object
+    img: object = None
+    scale: float = 1.0
+    done: dict | None = None     # ได้ผลจาก cache/gate แล้ว (ไม่ต้อง predict)
+
+
+def _prepare(ver: ModelVersion, image: bytes | Path, card_id: str, out_dir: Path, digest: str | None) -> _Pending:
+    image_buf = load_buffer(image)
     out_dir.mkdir(parents=True, exist_ok=True)
     result_name = f"{card_id}_latest.jpg"
     result_path = out_dir / result_name
-    cv2.imwrite(str(result_path), img)
-    print("Saved temp result:", result_path)
+    source = _source_path(image, image_buf, out_dir, card_id)
 
-    return {
-        "result_name": result_name,
+    # --- cache hit: ใช้ scores/status/กรอบเดิม (ข้าม decode/predict) ---
+    cache_key = DetectionCache.make_key(digest or content_hash(image_buf), ver.id, CONF_THRESHOLD)
+    job = _Pending(card_id, result_name, result_path, source, cache_key, None)
+    hit = detect_cache.get(cache_key)
+    if hit is not None:
+        write_meta(result_path, {**hit, "source": str(source)})
+        DETECT_RESULTS.labels(hit["status"], "cache").inc()
+        job.done = _response(result_name, hit, reused=True)
+        return job
+
+    # --- frame gate: ภาพต่างจากรอบที่ infer ล่าสุดน้อยกว่า threshold → ใช้ผลเดิม (วาดบนภาพใหม่) ---
+    if frame_gate.enabled:
+        with _T_GATE.time():
+            job.thumb = fingerprint(image_buf, GATE_THUMB_SIZE)
+    if job.thumb is not None:
+        prev = frame_gate.check(card_id, job.thumb)
+        if prev is not None and prev.result.get("model") == ver.version:
+            write_meta(result_path, {**prev.result, "source": str(source)})
+            DETECT_RESULTS.labels(prev.result["status"], "gate").inc()
+            job.done = _response(result_name, prev.result, reused=True)
+            return job
+
+    # decode แบบย่อ (ตาม DECODE_POLICY) — scale = ต้นฉบับ / ภาพที่ decode
+    with _T_DECODE.time():
+        job.img, job.scale = decode_for_inference(image_buf, DECODE_TARGET_SIZE, DECODE_POLICY)
+    if job.img is None:
+        # header ถูกแต่เนื้อไฟล์เสีย — ตอบ 400 ก่อนส่งเข้า predict/batcher (detect_batch: error เฉพาะภาพนี้)
+        raise HTTPException(400, "Cannot decode image")
+    return job
+
+
+def _decisive(dets) -> list | None:
+    """
+    ผลรอบถูก (conf >= CASCADE_BAND_LOW) ตัดสินแทนรอบเต็มได้ไหม
+    ได้เมื่อทุก class ที่เจอมีคะแนนสูงสุด >= CASCADE_BAND_HIGH (ชัดว่ามี) และที่เหลือต่ำกว่า LOW (ชัดว่าไม่มี)
+    → คืนกรอบที่ผ่าน CONF_THRESHOLD ให้ summarize ตัดสินกติกาเดิม; ก้ำกึ่ง/ไม่เจออะไรเลย → None (ส่งรอบเต็ม)
+    """
+    if not dets:
+        return None
+    best: dict[int, float] = {}
+    for d in dets:
+        best[d.cls] = max(best.get(d.cls, 0.0), d.conf)
+    if min(best.values()) < CASCADE_BAND_HIGH:
+        return None
+    return [d for d in dets if d.conf >= CONF_THRESHOLD]
+
+
+def _infer(ver: ModelVersion, imgs: list, timer) -> list[tuple[list, str]]:
+    """
+    predict ตาม cascade ของเวอร์ชัน → [(dets, stage), ...] เรียงตาม imgs
+    stage = "fast" (รอบถูกตัดสินเอง) | "full" (โมเดลเต็ม — timer จับเวลารอบนี้)
+    """
+    if ver.cascade == "off":
+        with timer.time():
+            dets = ver.predict_many(imgs)
+        return [(d, "full") for d in dets]
+
+    with _T_INFER_FAST.time():
+        fast = ver.predict_fast(imgs)
+    out: list = [None] * len(imgs)
+    todo = []
+    for i, d in enumerate(fast):
+        d = _decisive(d)
+        if d is None:
+            todo.append(i)
+        else:
+            out[i] = (d, "fast")
+    if todo:
+        with timer.time():
+            full = ver.predict_many([imgs[i] for i in todo])
+        for i, d in zip(todo, full):
+            out[i] = (d, "full")
+    _DECIDED_FAST.inc(len(imgs) - len(todo))
+    _DECIDED_FULL.inc(len(todo))
+    return out
+
+
+def _finish(ver: ModelVersion, job: _Pending, dets, stage: str) -> dict:
+    scale = job.scale
+    boxes = []
+    for d in dets:
+        # เก็บพิกัดในระบบของภาพต้นฉบับ (render จะ map ไปขนาดที่วาดเอง)
+        xyxy = [round(v * scale, 1) for v in d.xyxy]
+        label = ver.names.get(d.cls, f"class_{d.cls}")
+        boxes.append({"cls": d.cls, "label": label, "conf": round(d.conf, 4), "xyxy": xyxy})
+
+    # --- ตัดสินผลรวม ---
+    scores, status = summarize(dets, ver.names, CONF_THRESHOLD)
+
+    # --- บันทึกผลดิบ (sidecar) แทนภาพ annotate ---
+    h, w = job.img.shape[:2]
+    job.img = None
+    result = {
         "scores": scores,
         "status": status,
-        "updated_at": datetime.datetime.utcnow().isoformat()
+        "boxes": boxes,
+        "width": round(w * scale),
+        "height": round(h * scale),
+        "model": ver.version,
+        "stage": stage,
     }
+    with _T_WRITE.time():
+        write_meta(job.result_path, {**result, "source": str(job.source)})
+    DETECT_RESULTS.labels(status, "infer").inc()
+    if log.isEnabledFor(logging.DEBUG) and sampled():
+        log.debug("%s %s via %s (%s): %d boxes %s", job.card_id, status, ver.version, stage, len(boxes), boxes)
+
+    detect_cache.put(job.cache_key, result, size=len(json.dumps(result)))
+    if job.thumb is not None:
+        frame_gate.update(job.card_id, job.thumb, result)
+
+    return _response(job.result_name, result, reused=False)
+
+
+def _detect(ver: ModelVersion, image: bytes | Path, card_id: str, out_dir: Path, digest: str | None):
+    job = _prepare(ver, image, card_id, out_dir, digest)
+    if job.done is not None:
+        return job.done
+    (dets, stage), = _infer(ver, [job.img], _T_INFER)
+    return _finish(ver, job, dets, stage)
+
+
+def detect_batch(items: list[tuple[bytes | Path, str, str | None]], out_dir: Path) -> list[dict | Exception]:
+    """
+    หลายภาพในงานเดียว (POST /cards/batch) — items = [(image, card_id, digest), ...]
+
+    cache/gate/decode ทีละภาพเหมือน detect() แล้ว predict ภาพที่เหลือครั้งเดียวต่อเวอร์ชันโมเดล
+    (ผ่าน batcher ถ้าเปิดไว้ → รวม batch กับ request อื่นได้ด้วย)
+    ผลเรียงตาม items; ภาพที่พังได้ exception ของตัวเองแทนผล — ไม่ล้มทั้งก้อน
+    """
+    out: list = [None] * len(items)
+    with ExitStack() as stack:
+        groups: dict[int, tuple[ModelVersion, list[int]]] = {}
+        pending: dict[int, _Pending] = {}
+        for i, (image, card_id, digest) in enumerate(items):
+            ver = stack.enter_context(registry.acquire(card_id))
+            if ver is None:
+                raise ModelNotReady()
+            try:
+                job = _prepare(ver, image, card_id, out_dir, digest)
+            except Exception as e:
+                out[i] = e
+                continue
+            if job.done is not None:
+                out[i] = job.done
+            else:
+                pending[i] = job
+                groups.setdefault(id(ver), (ver, []))[1].append(i)
+
+        for ver, idx in groups.values():
+            try:
+                dets = _infer(ver, [pending[i].img for i in idx], _T_INFER_BATCH)
+            except executor.QueueFull as e:
+                # โมเดล/inference server ไม่พร้อม — แยกทีละภาพก็ได้ผลเดิม
+                for i in idx:
+                    out[i] = e
+                continue
+            except Exception as e:
+                if len(idx) == 1:
+                    out[idx[0]] = e
+                    continue
+                # ล้มทั้งก้อน → รันใหม่ทีละภาพ: ภาพที่ทำพังได้ error ของตัวเอง ภาพอื่นยังได้ผล
+                dets = []
+                for i in idx:
+                    try:
+                        dets.append(_infer(ver, [pending[i].img], _T_INFER)[0])
+                    except Exception as e1:
+                        dets.append(e1)
+            for i, res in zip(idx, dets):
+                if isinstance(res, Exception):
+                    out[i] = res
+                    continue
+                try:
+                    out[i] = _finish(ver, pending[i], *res)
+                except Exception as e:
+                    out[i] = e
+    return out
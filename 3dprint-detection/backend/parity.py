@@ -0,0 +1,129 @@
+# backend/parity.py
+"""
+เทียบผล detect ของ backend ที่ export แล้ว กับ .pt (ultralytics) บนชุดภาพเดียวกัน
+
+    python -m backend.parity --backend onnx --images path/to/frames/
+    python -m backend.parity --backend openvino --int8 --images path/to/frames/ --conf-tol 0.1
+
+- decode ภาพแบบเดียวกับ production (DECODE_POLICY / DECODE_TARGET_SIZE)
+- จับคู่กรอบ class เดียวกันด้วย IoU (greedy ตาม conf) → นับกรอบที่หาย/เกิน, conf ต่างกันสูงสุด
+- status (NORMAL / FAIL / NOT_3DPRINT_PART) ต้องตรงกัน
+- พิมพ์สรุปเป็น JSON; เกิน tolerance → exit code 1 (ใช้ใน CI / ก่อน deploy)
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+from backend.config import CONF_THRESHOLD, MODEL_PATH, DECODE_POLICY, DECODE_TARGET_SIZE
+from backend.decode import decode_for_inference, load_buffer
+from backend.engines import BACKENDS, Detection, artifact_path, load_engine, summarize
+from backend.export import IMAGE_EXTS
+
+
+def iou(a, b) -> float:
+    ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def match(ref: list[Detection], cand: list[Detection], min_iou: float):
+    """คืน (คู่ที่จับได้ [(ref, cand, iou)], ref ที่ไม่มีคู่, cand ที่ไม่มีคู่)"""
+    pairs, used = [], set()
+    for r in sorted(ref, key=lambda d: d.conf, reverse=True):
+        best, best_iou = None, min_iou
+        for j, c in enumerate(cand):
+            if j in used or c.cls != r.cls:
+                continue
+            v = iou(r.xyxy, c.xyxy)
+            if v >= best_iou:
+                best, best_iou = j, v
+        if best is None:
+            continue
+        used.add(best)
+        pairs.append((r, cand[best], best_iou))
+    matched_ref = {id(p[0]) for p in pairs}
+    return (pairs,
+            [r for r in ref if id(r) not in matched_ref],
+            [c for j, c in enumerate(cand) if j not in used])
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m backend.parity", description=__doc__.split("\n\n")[0])
+    ap.add_argument("--backend", choices=[b for b in BACKENDS if b != "ultralytics"], required=True)
+    ap.add_argument("--images", required=True, help="โฟลเดอร์ภาพทดสอบ")
+    ap.add_argument("--weights", default=MODEL_PATH)
+    ap.add_argument("--artifact", help="path ของไฟล์ที่ export (ไม่ระบุ = path มาตรฐานข้าง weights)")
+    ap.add_argument("--int8", action="store_true")
+    ap.add_argument("--conf", type=float, default=CONF_THRESHOLD)
+    ap.add_argument("--limit", type=int, default=200)
+    ap.add_argument("--min-iou", type=float, default=0.5, help="IoU ขั้นต่ำที่ถือว่าเป็นกรอบเดียวกัน")
+    ap.add_argument("--conf-tol", type=float, default=0.05, help="conf ต่างกันได้สูงสุด (INT8 ควรหลวมกว่านี้)")
+    ap.add_argument("--box-tol", type=float, default=0.02, help="สัดส่วนกรอบที่หาย/เกินได้สูงสุด")
+    ap.add_argument("--status-tol", type=float, default=0.0, help="สัดส่วนภาพที่ status ไม่ตรงได้สูงสุด")
+    args = ap.parse_args(argv)
+
+    files = sorted(p for p in Path(args.images).rglob("*") if p.suffix.lower() in IMAGE_EXTS)[: args.limit]
+    if not files:
+        print(f"no images found in {args.images}", file=sys.stderr)
+        return 2
+
+    ref_engine = load_engine("ultralytics", args.weights)
+    cand_path = args.artifact or artifact_path(args.backend, args.weights, args.int8)
+    cand_engine = load_engine(args.backend, cand_path, args.int8)
+    names = ref_engine.names
+
+    ref_boxes = cand_boxes = missing = extra = status_diff = 0
+    max_conf_diff, ious = 0.0, []
+    t_ref = t_cand = 0.0
+    mismatches = []
+    for f in files:
+        img, _ = decode_for_inference(load_buffer(f), DECODE_TARGET_SIZE, DECODE_POLICY)
+        t0 = time.perf_counter()
+        ref = ref_engine.predict([img], args.conf)[0]
+        t1 = time.perf_counter()
+        cand = cand_engine.predict([img], args.conf)[0]
+        t_ref += t1 - t0
+        t_cand += time.perf_counter() - t1
+
+        pairs, miss, ext = match(ref, cand, args.min_iou)
+        ref_boxes += len(ref)
+        cand_boxes += len(cand)
+        missing += len(miss)
+        extra += len(ext)
+        for r, c, v in pairs:
+            max_conf_diff = max(max_conf_diff, abs(r.conf - c.conf))
+            ious.append(v)
+        s_ref = summarize(ref, names, args.conf)[1]
+        s_cand = summarize(cand, names, args.conf)[1]
+        if s_ref != s_cand:
+            status_diff += 1
+        if s_ref != s_cand or miss or ext:
+            mismatches.append({"image": str(f), "status": [s_ref, s_cand], "missing": len(miss), "extra": len(ext)})
+
+    n = len(files)
+    box_err = (missing + extra) / max(1, ref_boxes)
+    report = {
+        "backend": cand_engine.identity(),
+        "reference": ref_engine.identity(),
+        "images": n,
+        "boxes": {"reference": ref_boxes, "candidate": cand_boxes, "missing": missing, "extra": extra,
+                  "error_rate": round(box_err, 4)},
+        "max_conf_diff": round(max_conf_diff, 4),
+        "min_iou": round(min(ious), 4) if ious else None,
+        "mean_iou": round(sum(ious) / len(ious), 4) if ious else None,
+        "status_mismatch": status_diff,
+        "latency_ms": {"reference": round(t_ref / n * 1000, 2), "candidate": round(t_cand / n * 1000, 2)},
+        "mismatches": mismatches[:20],
+    }
+    ok = (max_conf_diff <= args.conf_tol and box_err <= args.box_tol and status_diff / n <= args.status_tol)
+    report["ok"] = ok
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
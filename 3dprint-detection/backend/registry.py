@@ -0,0 +1,424 @@
+# backend/registry.py
+"""
+Model registry: หลายเวอร์ชันของโมเดลใน process เดียว สลับได้ตอนรัน (ไม่ต้อง restart worker)
+
+- active    = เวอร์ชันหลัก, candidate = เวอร์ชันทดลอง (canary) ที่ได้ traffic canary_percent %
+  เลือกตาม hash ของ card_id → card เดิมอยู่กับเวอร์ชันเดิมเสมอ (ผลต่อเนื่อง)
+- detect() ยืมเวอร์ชันผ่าน acquire() ตลอดงาน → สลับ active กลางทาง งานที่รันอยู่ใช้ตัวเดิมจนจบ
+- deploy: โหลด + warmup เบื้องหลังก่อน แล้วค่อยสลับ pointer (atomic ใต้ lock) → ไม่มี request ไหนเจอโมเดลครึ่ง ๆ
+- retire: ถอดออกจาก routing → รอ in-flight เป็น 0 → หยุด batcher + close engine + gc
+  (หน่วยความจำคืนทันที ไม่ต้องรอ GC เอง)
+- เฉพาะ process นี้ — หลาย uvicorn worker ต้อง deploy ทุกตัว (หรือใช้ MODEL_CANARY_* ตอน start)
+- CASCADE_MODE: แต่ละเวอร์ชันมีรอบถูกของตัวเอง (predict_fast) — input เล็กของโมเดลเดิม หรือโมเดลเล็กที่โหลดคู่กัน
+"""
+import asyncio
+import ctypes
+import gc
+import logging
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+from fastapi import APIRouter, Header, HTTPException
+from pydantic import BaseModel, Field
+
+from backend.batcher import MicroBatcher
+from backend.config import (
+    CONF_THRESHOLD, MODEL_PATH, MODEL_BACKEND, MODEL_INT8,
+    BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS,
+    MODEL_WARMUP_RUNS, MODEL_WARMUP_SIZE, MODEL_ADMIN_TOKEN,
+    CASCADE_MODE, CASCADE_IMGSZ, CASCADE_MODEL_PATH, CASCADE_BACKEND,
+    CASCADE_BAND_LOW, CASCADE_BAND_HIGH,
+)
+from backend.engines import Engine, artifact_path, load_engine
+from . import executor
+
+log = logging.getLogger(__name__)
+
+CASCADE_MODES = ("off", "lowres", "model")
+
+
+def _check_cascade() -> None:
+    if CASCADE_MODE not in CASCADE_MODES:
+        raise ValueError(f"CASCADE_MODE must be one of {CASCADE_MODES}, got {CASCADE_MODE!r}")
+    if CASCADE_MODE != "off" and not CASCADE_BAND_LOW <= CONF_THRESHOLD < CASCADE_BAND_HIGH:
+        raise ValueError(f"cascade band [{CASCADE_BAND_LOW}, {CASCADE_BAND_HIGH}) must contain "
+                         f"CONF_THRESHOLD={CONF_THRESHOLD}")
+    if CASCADE_MODE == "model" and not CASCADE_MODEL_PATH:
+        raise ValueError("CASCADE_MODE=model needs CASCADE_MODEL_PATH")
+
+
+class ModelVersion:
+    def __init__(self, version: str, engine: Engine, source: str, fast_engine: Engine | None = None):
+        self.version = version          # ชื่อที่บันทึกลง card ("best.pt@1a2b3c4d")
+        self.engine = engine
+        self.source = source
+        self.id = engine.identity()     # ใช้เป็นส่วนหนึ่งของ key ใน detect cache
+        self.names = engine.names
+        self.state = "loaded"           # loaded → active/candidate → retiring → retired
+        self.inflight = 0
+        self.served = 0
+        self.loaded_at = time.time()
+        self.load_s: float | None = None
+        self.warmup_s: float | None = None
+        # micro-batching ต่อเวอร์ชัน (batch เดียวกันต้องใช้โมเดลเดียวกัน)
+        self.batcher: MicroBatcher | None = None
+        if BATCH_MAX_SIZE > 1 and engine.client_batching:
+            self.batcher = MicroBatcher(
+                lambda imgs: engine.predict(imgs, CONF_THRESHOLD),
+                max_batch=BATCH_MAX_SIZE,
+                max_wait_ms=BATCH_MAX_WAIT_MS,
+            )
+
+        # cascade: รอบถูกก่อน → รอบเต็มเฉพาะภาพที่ก้ำกึ่ง (ตัดสินใน model._infer)
+        self.fast_engine = fast_engine
+        self.cascade = "off"
+        if fast_engine is not None:
+            self.cascade = "model"
+        elif CASCADE_MODE == "lowres":
+            if engine.variable_imgsz:
+                self.cascade = "lowres"
+            else:
+                log.warning("CASCADE_MODE=lowres needs .pt or a dynamic-shape export (%s) — cascade off", engine.name)
+        self.fast_batcher: MicroBatcher | None = None
+        if self.cascade != "off":
+            fast = fast_engine.identity() if fast_engine is not None else CASCADE_IMGSZ
+            self.id += f"|cascade:{fast}:{CASCADE_BAND_LOW}-{CASCADE_BAND_HIGH}"
+            if BATCH_MAX_SIZE > 1 and (fast_engine or engine).client_batching:
+                self.fast_batcher = MicroBatcher(
+                    self._predict_fast,
+                    max_batch=BATCH_MAX_SIZE,
+                    max_wait_ms=BATCH_MAX_WAIT_MS,
+                )
+
+    def predict(self, img):
+        """predict ภาพเดียว — ผ่าน batcher ถ้าเปิดไว้ ไม่งั้นรันบน worker thread เอง"""
+        if self.batcher is not None:
+            return self.batcher.predict(img)
+        return self.engine.predict([img], CONF_THRESHOLD)[0]
+
+    def predict_many(self, imgs: list) -> list:
+        """หลายภาพพร้อมกัน — ผ่าน batcher ก็ส่งเข้าคิวทีเดียวทั้งชุด (batcher ตัดเป็น batch ตาม BATCH_MAX_SIZE เอง)"""
+        if self.batcher is not None:
+            futs = [self.batcher.submit(img) for img in imgs]
+            return [f.result() for f in futs]
+        return self.engine.predict(imgs, CONF_THRESHOLD)
+
+    def _predict_fast(self, imgs: list) -> list:
+        # conf = ขอบล่างของช่วงก้ำกึ่ง → เห็นกรอบที่เกือบถึง CONF_THRESHOLD ด้วย
+        if self.fast_engine is not None:
+            return self.fast_engine.predict(imgs, CASCADE_BAND_LOW)
+        return self.engine.predict(imgs, CASCADE_BAND_LOW, imgsz=CASCADE_IMGSZ)
+
+    def predict_fast(self, imgs: list) -> list:
+        """รอบถูกของ cascade (ต้อง cascade != "off") — detections ที่ conf >= CASCADE_BAND_LOW ต่อภาพ"""
+        if self.fast_batcher is not None:
+            futs = [self.fast_batcher.submit(img) for img in imgs]
+            return [f.result() for f in futs]
+        return self._predict_fast(imgs)
+
+    def warmup(self, runs: int = MODEL_WARMUP_RUNS, size: int = MODEL_WARMUP_SIZE) -> None:
+        """
+        predict ภาพสังเคราะห์ (4:3, ด้านยาว = size) ผ่านทางเดียวกับ request จริง
+        → จ่ายค่า first-inference (allocate/JIT/โหลดโมเดลของ thread) ก่อนรับ traffic
+        """
+        img = np.random.default_rng(0).integers(0, 256, (size * 3 // 4, size, 3), dtype=np.uint8)
+        t0 = time.perf_counter()
+        for _ in range(runs):
+            self.predict(img)
+            if self.cascade != "off":
+                self.predict_fast([img])
+        self.warmup_s = round(time.perf_counter() - t0, 3)
+
+    def close(self) -> None:
+        for b in (self.batcher, self.fast_batcher):
+            if b is not None:
+                b.stop()
+        self.batcher = self.fast_batcher = None
+        self.engine.close()
+        self.engine = None
+        if self.fast_engine is not None:
+            self.fast_engine.close()
+            self.fast_engine = None
+
+    def cascade_info(self) -> dict | None:
+        if self.cascade == "off":
+            return None
+        return {
+            "mode": self.cascade,
+            "imgsz": CASCADE_IMGSZ if self.cascade == "lowres" else None,
+            "model": str(self.fast_engine.path) if self.fast_engine is not None else None,
+            "band": [CASCADE_BAND_LOW, CASCADE_BAND_HIGH],
+            "batching": self.fast_batcher.stats() if self.fast_batcher is not None else None,
+        }
+
+    def info(self) -> dict:
+        return {
+            "version": self.version,
+            "id": self.id,
+            "source": self.source,
+            "state": self.state,
+            "inflight": self.inflight,
+            "served": self.served,
+            "loaded_at": self.loaded_at,
+            "load_s": self.load_s,
+            "warmup_s": self.warmup_s,
+            "batching": self.batcher.stats() if self.batcher is not None else None,
+            "cascade": self.cascade_info(),
+            "remote": self.engine.stats() if self.engine is not None and self.engine.name == "remote" else None,
+        }
+
+
+def _malloc_trim() -> None:
+    # glibc เก็บ heap ที่ free แล้วไว้กับ process → คืนให้ OS (RSS ลดจริง); ไม่ใช่ glibc ก็ข้าม
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def canary_bucket(card_id: str) -> int:
+    """0-99 คงที่ต่อ card_id"""
+    return zlib.crc32(card_id.encode()) % 100
+
+
+class ModelRegistry:
+    def __init__(self):
+        self.active: ModelVersion | None = None
+        self.candidate: ModelVersion | None = None
+        self.canary_percent = 0
+        self.retired: list[dict] = []      # ประวัติเวอร์ชันที่ปลดแล้ว (ล่าสุด 10 ตัว)
+        self._cond = threading.Condition()
+        self._deploy_lock: asyncio.Lock | None = None
+
+    # ---------- routing ----------
+    def pick(self, card_id: str | None) -> ModelVersion | None:
+        cand, active = self.candidate, self.active
+        if cand is not None and card_id is not None and canary_bucket(card_id) < self.canary_percent:
+            return cand
+        return active
+
+    @contextmanager
+    def acquire(self, card_id: str | None = None):
+        """ยืมเวอร์ชันที่ card นี้ควรใช้ ตลอดช่วง with (กันถูก retire ระหว่างใช้) — ยังไม่มีโมเดล → None"""
+        with self._cond:
+            ver = self.pick(card_id)
+            if ver is not None:
+                ver.inflight += 1
+        try:
+            yield ver
+        finally:
+            if ver is not None:
+                with self._cond:
+                    ver.inflight -= 1
+                    ver.served += 1
+                    if ver.inflight == 0:
+                        self._cond.notify_all()
+
+    # ---------- load / switch ----------
+    def load(self, path: str | Path | None = None, backend: str = MODEL_BACKEND,
+             int8: bool = MODEL_INT8, version: str | None = None) -> ModelVersion:
+        """โหลด engine (blocking) — ยังไม่รับ traffic จนกว่าจะ activate()/set_candidate()"""
+        _check_cascade()
+        t0 = time.perf_counter()
+        engine = load_engine(backend, path, int8)
+        fast = None
+        if CASCADE_MODE == "model":
+            try:
+                fast = load_engine(CASCADE_BACKEND, CASCADE_MODEL_PATH, False)
+            except BaseException:
+                engine.close()
+                raise
+            if fast.names != engine.names:
+                engine.close()
+                fast.close()
+                raise ValueError(f"cascade model {CASCADE_MODEL_PATH} classes {fast.names} != {engine.names}")
+        ver = ModelVersion(version or engine.version(), engine, str(engine.path), fast)
+        ver.load_s = round(time.perf_counter() - t0, 3)
+        return ver
+
+    def activate(self, ver: ModelVersion) -> None:
+        """ให้ ver เป็นเวอร์ชันหลัก (candidate เดิมคงไว้ ยกเว้นเป็นตัวเดียวกัน)"""
+        with self._cond:
+            old, self.active = self.active, ver
+            ver.state = "active"
+            if self.candidate is ver:
+                self.candidate, self.canary_percent = None, 0
+        if old is not None and old is not ver:
+            self.retire(old)
+
+    def set_candidate(self, ver: ModelVersion, percent: int) -> None:
+        with self._cond:
+            old, self.candidate = self.candidate, ver
+            self.canary_percent = max(0, min(100, percent))
+            ver.state = "candidate"
+        if old is not None and old is not ver:
+            self.retire(old)
+
+    def set_canary_percent(self, percent: int) -> None:
+        with self._cond:
+            self.canary_percent = max(0, min(100, percent))
+
+    def promote(self) -> ModelVersion:
+        """candidate → active (active เดิมถูก retire)"""
+        ver = self.candidate
+        if ver is None:
+            raise LookupError("no candidate model")
+        self.activate(ver)
+        return ver
+
+    def drop_candidate(self) -> ModelVersion:
+        """ยกเลิก canary (rollback) — traffic ทั้งหมดกลับไป active"""
+        with self._cond:
+            ver, self.candidate, self.canary_percent = self.candidate, None, 0
+        if ver is None:
+            raise LookupError("no candidate model")
+        self.retire(ver)
+        return ver
+
+    # ---------- retire ----------
+    def retire(self, ver: ModelVersion, wait: bool = False) -> None:
+        """
+        ถอด ver ออก (ต้องไม่อยู่ใน routing แล้ว) แล้วปล่อยหน่วยความจำเมื่อ in-flight เป็น 0
+        wait=False → รอ/ปล่อยบน thread แยก (ไม่บล็อก event loop)
+        """
+        ver.state = "retiring"
+        if wait:
+            self._drain_and_close(ver)
+        else:
+            threading.Thread(target=self._drain_and_close, args=(ver,),
+                             name=f"retire-{ver.version}", daemon=True).start()
+
+    def _drain_and_close(self, ver: ModelVersion) -> None:
+        with self._cond:
+            self._cond.wait_for(lambda: ver.inflight == 0)
+        ver.close()
+        ver.state = "retired"
+        gc.collect()   # โมเดล torch มี reference cycle → เก็บทันที ไม่รอรอบ GC
+        _malloc_trim()
+        info = ver.info()
+        info["retired_at"] = time.time()
+        with self._cond:
+            self.retired = (self.retired + [info])[-10:]
+        log.info("retired %s (served %d)", ver.version, ver.served)
+
+    def close(self) -> None:
+        """ตอน shutdown — ปลดทุกเวอร์ชัน"""
+        with self._cond:
+            vers = [v for v in (self.active, self.candidate) if v is not None]
+            self.active = self.candidate = None
+        for v in vers:
+            self.retire(v, wait=True)
+
+    # ---------- deploy (async) ----------
+    async def deploy(self, path=None, backend: str = MODEL_BACKEND, int8: bool = MODEL_INT8,
+                     version: str | None = None, canary_percent: int | None = None,
+                     warmup_runs: int = MODEL_WARMUP_RUNS) -> ModelVersion:
+        """
+        โหลด + warmup เบื้องหลัง แล้วสลับเข้า routing
+        canary_percent=None → เป็น active ทันที, ไม่งั้นเป็น candidate ที่ได้ traffic ตาม %
+        """
+        if self._deploy_lock is None:
+            self._deploy_lock = asyncio.Lock()
+        async with self._deploy_lock:
+            ver = await asyncio.to_thread(self.load, path, backend, int8, version)
+            try:
+                if warmup_runs > 0:
+                    # รันบน inference worker (หรือ batcher ของเวอร์ชันนี้) → warm thread ที่จะใช้จริง
+                    await executor.run(ver.warmup, warmup_runs)
+            except BaseException:
+                await asyncio.to_thread(self.retire, ver, True)
+                raise
+            if canary_percent is None:
+                self.activate(ver)
+            else:
+                self.set_candidate(ver, canary_percent)
+            log.info("%s %s (load %ss, warmup %ss)", ver.version, ver.state, ver.load_s, ver.warmup_s)
+            return ver
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active.info() if self.active is not None else None,
+            "candidate": self.candidate.info() if self.candidate is not None else None,
+            "canary_percent": self.canary_percent,
+            "retired": list(self.retired),
+        }
+
+
+registry = ModelRegistry()
+
+
+# ---------- admin API ----------
+router = APIRouter(prefix="/models")
+
+
+def _check_admin(token: str | None) -> None:
+    # ไม่ได้ตั้ง MODEL_ADMIN_TOKEN → ปิด endpoint ที่เปลี่ยนโมเดล
+    if not MODEL_ADMIN_TOKEN:
+        raise HTTPException(403, "Model admin API disabled (set MODEL_ADMIN_TOKEN)")
+    if token != MODEL_ADMIN_TOKEN:
+        raise HTTPException(401, "Invalid admin token")
+
+
+class DeployRequest(BaseModel):
+    path: str | None = None                 # ไฟล์ .pt / .onnx / โฟลเดอร์ openvino (ไม่ระบุ = ตาม config)
+    backend: str = MODEL_BACKEND
+    int8: bool = MODEL_INT8
+    version: str | None = None              # ชื่อที่บันทึกลง card (ไม่ระบุ = <ไฟล์>@<sha256 8 ตัว>)
+    canary_percent: int | None = Field(default=None, ge=0, le=100)
+
+
+class CanaryRequest(BaseModel):
+    percent: int = Field(ge=0, le=100)
+
+
+@router.get("")
+async def list_models():
+    return registry.stats()
+
+
+@router.post("/deploy")
+async def deploy_model(req: DeployRequest, x_admin_token: str | None = Header(default=None)):
+    _check_admin(x_admin_token)
+    path = req.path
+    if path is not None and not Path(path).exists():
+        raise HTTPException(400, f"{path} not found")
+    if path is None and req.backend != "ultralytics":
+        path = str(artifact_path(req.backend, MODEL_PATH, req.int8))
+    try:
+        ver = await registry.deploy(path, req.backend, req.int8, req.version, req.canary_percent)
+    except (ValueError, FileNotFoundError, RuntimeError) as e:
+        raise HTTPException(400, f"{type(e).__name__}: {e}")
+    return ver.info()
+
+
+@router.post("/canary")
+async def set_canary(req: CanaryRequest, x_admin_token: str | None = Header(default=None)):
+    _check_admin(x_admin_token)
+    if registry.candidate is None:
+        raise HTTPException(404, "No candidate model")
+    registry.set_canary_percent(req.percent)
+    return registry.stats()
+
+
+@router.post("/promote")
+async def promote_model(x_admin_token: str | None = Header(default=None)):
+    _check_admin(x_admin_token)
+    try:
+        ver = registry.promote()
+    except LookupError:
+        raise HTTPException(404, "No candidate model")
+    return ver.info()
+
+
+@router.delete("/candidate")
+async def rollback_candidate(x_admin_token: str | None = Header(default=None)):
+    _check_admin(x_admin_token)
+    try:
+        ver = registry.drop_candidate()
+    except LookupError:
+        raise HTTPException(404, "No candidate model")
+    return ver.info()
@@ -0,0 +1,170 @@
+# backend/render.py
+"""
+Lazy rendering ของภาพผลลัพธ์
+- detect() เก็บแค่ผลดิบ (class/conf/xyxy ในพิกัดภาพต้นฉบับ) เป็น sidecar JSON + path ของไฟล์อัปโหลด
+- ภาพ annotate ถูกวาด + encode ตอนมีคนขอ /temp/results/... ครั้งแรกเท่านั้น
+  แล้ว cache ในแรม (LRU จำกัดขนาด) → request ที่อ่านแค่ status/scores ไม่ต้องจ่ายค่าวาด/encode
+- รองรับ ?size= (thumbnail ด้านยาว) และ ?fmt=jpeg|webp
+- sidecar ที่เพิ่งเขียนถูกถือไว้ใน hot cache (ไม่ต้อง stat/อ่านไฟล์) + hash ของเนื้อหาใช้ทำ ETag
+"""
+import json
+import os
+import threading
+from pathlib import Path
+
+import cv2
+
+from backend.cache import LRUCache, content_hash
+from backend.config import (
+    DECODE_POLICY, DECODE_TARGET_SIZE, ANNOTATE_FULL_RES,
+    RENDER_CACHE_SIZE, RENDER_CACHE_MAX_BYTES, RENDER_CACHE_TTL,
+    RENDER_JPEG_QUALITY, RENDER_WEBP_QUALITY,
+    RESULT_HOT_SIZE, RESULT_HOT_TTL,
+)
+from backend.decode import load_buffer, decode_for_inference
+from backend.metrics import STAGE_SECONDS
+from backend.temp_store import blobs, sweeper
+
+META_SUFFIX = ".json"
+FORMATS = {
+    "jpeg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY, RENDER_JPEG_QUALITY),
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY, RENDER_WEBP_QUALITY),
+}
+
+render_cache = LRUCache(RENDER_CACHE_SIZE, RENDER_CACHE_MAX_BYTES, RENDER_CACHE_TTL)
+
+_T_DECODE = STAGE_SECONDS.labels("render_decode")
+_T_ANNOTATE = STAGE_SECONDS.labels("annotate")
+_T_ENCODE = STAGE_SECONDS.labels("encode")
+
+# sidecar ล่าสุด: str(path ของ .json) → (meta, content hash)
+hot_meta = LRUCache(RESULT_HOT_SIZE, RESULT_HOT_SIZE * 64 * 1024, RESULT_HOT_TTL)
+# sidecar หมดอายุ/ถูกลบโดย sweeper → ต้องไม่เสิร์ฟจากแรมต่อ
+sweeper.on_evict.append(lambda path: hot_meta.pop(str(path)))
+
+
+def meta_path_for(result_path: Path) -> Path:
+    """{card_id}_latest.jpg → {card_id}_latest.json"""
+    return result_path.with_suffix(META_SUFFIX)
+
+
+def write_meta(result_path: Path, meta: dict) -> Path:
+    """เขียน sidecar แบบ atomic (กัน reader เห็นไฟล์ครึ่ง ๆ)"""
+    p = meta_path_for(result_path)
+    raw = json.dumps(meta).encode()
+    tmp = p.with_name(f"{p.name}.{threading.get_ident()}.tmp")
+    tmp.write_bytes(raw)
+    os.replace(tmp, p)
+    hot_meta.put(str(p), (meta, content_hash(raw)), size=len(raw))
+    return p
+
+
+def load_meta(meta_path: Path, hot_only: bool = False) -> tuple[dict, str] | None:
+    """
+    (meta, content hash) ของ sidecar — จาก hot cache ก่อน ไม่มีค่อยอ่านไฟล์
+    hot_only=True → ไม่แตะ filesystem เลย (miss = None); ไฟล์ไม่มี = None
+    """
+    hit = hot_meta.get(str(meta_path))
+    if hit is not None or hot_only:
+        return hit
+    try:
+        raw = meta_path.read_bytes()
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    entry = (json.loads(raw), content_hash(raw))
+    hot_meta.put(str(meta_path), entry, size=len(raw))
+    return entry
+
+
+def etag_for(digest: str, size: int | None, fmt: str) -> str:
+    """ETag ของภาพที่ render จาก sidecar นี้ (sidecar เดิม + size/fmt เดิม = bytes เดิม)"""
+    return f'"{digest}-{size or 0}-{fmt}"'
+
+
+def draw_boxes(img, boxes: list[dict], rel: float) -> None:
+    """
+    วาดกรอบ + label ลงบน img (in-place)
+    rel = ขนาดภาพที่วาด / ขนาดภาพต้นฉบับ (ใช้ map พิกัด + ปรับขนาดตัวอักษร/เส้น)
+    """
+    for b in boxes:
+        xyxy = [int(v * rel) for v in b["xyxy"]]
+        cls_id = b["cls"]
+        conf = b["conf"]
+        label = b["label"]
+
+        # --- กำหนดสีกรอบตามคลาส ---
+        if cls_id == 0:
+            color = (0, 255, 0)     # Green = normal
+        elif cls_id == 1:
+            color = (0, 0, 255)     # Red = spaghetti
+        else:
+            color = (255, 0, 0)     # Blue = not 3d part
+
+        # --- วาดกรอบ detection ---
+        cv2.rectangle(img, (xyxy[0], xyxy[1]), (xyxy[2], xyxy[3]), color, max(1, round(2 * rel)))
+
+        # --- เตรียมข้อความและพื้นหลัง ---
+        label_text = f"{label} {conf:.2f}"
+        font = cv2.FONT_HERSHEY_SIMPLEX
+        font_scale = max(0.5, 2 * rel)
+        font_thickness = max(1, round(2 * rel))
+
+        # คำนวณขนาดกล่องพื้นหลังให้พอดีกับข้อความ
+        (text_w, text_h), _ = cv2.getTextSize(label_text, font, font_scale, font_thickness)
+        text_x, text_y = xyxy[0], max(20, xyxy[1] - 10)  # ตำแหน่งข้อความเหนือกรอบ
+
+        # พื้นหลังสีเดียวกับกรอบแต่โปร่งเล็กน้อย
+        bg_color = tuple(int(c * 0.5) for c in color)
+        cv2.rectangle(img, (text_x - 2, text_y - text_h - 2),
+                      (text_x + text_w + 2, text_y + 4),
+                      bg_color, -1)
+        # วาดข้อความทับบนพื้นหลัง
+        cv2.putText(img, label_text, (text_x, text_y),
+                    font, font_scale, (255, 255, 255), font_thickness, cv2.LINE_AA)
+
+
+def render(meta_path: Path, size: int | None = None, fmt: str = "jpeg") -> tuple[bytes, str]:
+    """
+    วาดภาพผลลัพธ์จาก sidecar → (bytes, media_type)
+    ไฟล์ต้นฉบับหมดอายุแล้ว → FileNotFoundError
+    """
+    entry = load_meta(meta_path)
+    if entry is None:
+        raise FileNotFoundError(meta_path)
+    return render_meta(*entry, size=size, fmt=fmt)
+
+
+def render_meta(meta: dict, digest: str, size: int | None = None, fmt: str = "jpeg") -> tuple[bytes, str]:
+    ext, media_type, quality_flag, quality = FORMATS[fmt]
+    key = f"{digest}:{size}:{fmt}"
+    hit = render_cache.get(key)
+    if hit is not None:
+        return hit
+
+    source = Path(meta["source"])
+    buf = load_buffer(source)
+    blobs.touch(source)   # LRU ของ blob store
+    with _T_DECODE.time():
+        if size:
+            img, _ = decode_for_inference(buf, size, "auto")
+            if img is not None and max(img.shape[:2]) > size:
+                h, w = img.shape[:2]
+                r = size / max(h, w)
+                img = cv2.resize(img, (max(1, round(w * r)), max(1, round(h * r))), interpolation=cv2.INTER_AREA)
+        elif ANNOTATE_FULL_RES:
+            img = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+        else:
+            img, _ = decode_for_inference(buf, DECODE_TARGET_SIZE, DECODE_POLICY)
+    del buf
+    if img is None:
+        raise ValueError("cannot decode source image")
+
+    with _T_ANNOTATE.time():
+        draw_boxes(img, meta["boxes"], img.shape[1] / meta["width"])
+    with _T_ENCODE.time():
+        ok, out = cv2.imencode(ext, img, [quality_flag, quality])
+    if not ok:
+        raise RuntimeError(f"{fmt} encode failed")
+    data = out.tobytes()
+    render_cache.put(key, (data, media_type), size=len(data))
+    return data, media_type
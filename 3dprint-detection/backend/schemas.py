@@ -8,3 +8,22 @@ class Card(BaseModel):
     scores: Dict[str, float] | None = None
     updated_at: str
     model: str
+    reused: bool = False    # True = ใช้ผลเดิม (cache/frame gate) ไม่ได้ infer ใหม่
+    stage: str | None = None    # รอบที่ตัดสินผล: fast = รอบถูกของ cascade, full = โมเดลเต็ม
+
+class JobAccepted(BaseModel):
+    job_id: str
+    card_id: str
+    status: str
+    status_url: str
+
+class Job(BaseModel):
+    job_id: str
+    card_id: str
+    kind: str
+    status: str
+    attempts: int = 0
+    result: Card | None = None
+    error: str | None = None
+    created_at: float
+    updated_at: float
@@ -0,0 +1,82 @@
+# backend/shm_ring.py
+"""
+Ring buffer ของเฟรมใน multiprocessing.shared_memory (ใช้ระหว่าง API worker ↔ inference server)
+
+- ฝั่ง API worker เป็นเจ้าของ (สร้าง/ลบ) — แบ่งเป็น slots ช่องเท่า ๆ กัน ช่องละ slot_bytes
+- เขียนภาพที่ decode แล้วลงช่องว่าง แล้วส่งแค่ (slot, shape, dtype) ทาง socket — ไม่ pickle pixel
+- server attach ชื่อเดียวกันแล้วอ่านเป็น numpy view (ไม่ copy)
+- ช่องถูกคืนเมื่อได้ผลกลับมา (server อ่านเสร็จแน่นอนแล้ว)
+"""
+import queue
+import secrets
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+
+class RingFull(Exception):
+    """ไม่มีช่องว่างภายในเวลาที่รอ"""
+
+
+class FrameRing:
+    def __init__(self, slots: int, slot_bytes: int):
+        self.slots = max(1, slots)
+        self.slot_bytes = slot_bytes
+        self.shm = shared_memory.SharedMemory(
+            name=f"3dp_{secrets.token_hex(6)}", create=True, size=self.slots * slot_bytes)
+        self._free: "queue.Queue[int]" = queue.Queue()
+        for i in range(self.slots):
+            self._free.put(i)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def fits(self, img: np.ndarray) -> bool:
+        return img.nbytes <= self.slot_bytes
+
+    def put(self, img: np.ndarray, timeout: float | None = None) -> tuple[int, tuple, str]:
+        """copy ภาพลงช่องว่าง คืน (slot, shape, dtype) สำหรับส่งให้ server"""
+        try:
+            slot = self._free.get(timeout=timeout)
+        except queue.Empty:
+            raise RingFull(f"no free frame slot in {timeout}s")
+        view = np.ndarray(img.shape, dtype=img.dtype, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+        view[...] = img
+        return slot, img.shape, img.dtype.str
+
+    def release(self, slot: int) -> None:
+        self._free.put(slot)
+
+    def free_slots(self) -> int:
+        return self._free.qsize()
+
+    def close(self) -> None:
+        try:
+            self.shm.close()
+            self.shm.unlink()
+        except (FileNotFoundError, BufferError):
+            pass
+
+
+class AttachedRing:
+    """ฝั่ง server: attach ring ของ client (อ่านอย่างเดียว ไม่ลบ)"""
+
+    def __init__(self, name: str, slot_bytes: int):
+        self.shm = shared_memory.SharedMemory(name=name)
+        # Python < 3.13 ลงทะเบียน segment ที่ attach ไว้กับ resource_tracker ด้วย
+        # → server exit แล้วจะลบ ring ของ client ทิ้ง; เจ้าของคือ client เท่านั้น
+        try:
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        except Exception:
+            pass
+        self.slot_bytes = slot_bytes
+
+    def view(self, slot: int, shape, dtype: str) -> np.ndarray:
+        return np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=self.shm.buf, offset=slot * self.slot_bytes)
+
+    def close(self) -> None:
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # ยังมี view ค้าง (งานที่กำลังรัน) — ปล่อยให้ GC ปิดเอง
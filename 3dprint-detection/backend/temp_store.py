@@ -1,12 +1,22 @@
 # backend/temp_store.py
+import heapq
+import json
+import logging
+import os
 import secrets
 import shutil
 import tempfile
+import threading
 from pathlib import Path
 from typing import Tuple
 import asyncio
 import time
 
+from backend.blobstore import BlobStore
+from backend.config import TEMP_SWEEP_INTERVAL, TEMP_SWEEP_BATCH, BLOB_ROOT, BLOB_QUOTA_BYTES
+
+log = logging.getLogger(__name__)
+
 # โฟลเดอร์ temp กลางของระบบ
 TMP_ROOT = Path(tempfile.gettempdir()) / "3dprint_tmp"
 TMP_ROOT.mkdir(parents=True, exist_ok=True)
@@ -14,55 +24,285 @@ TMP_ROOT.mkdir(parents=True, exist_ok=True)
 # อายุไฟล์/โฟลเดอร์ (วินาที) — ปรับได้ตามต้องการ
 TTL_SECONDS = 60 * 60 * 24  # 1 วัน (แนะนำ: 1 ชม.=3600, 7 วัน=604800)
 
-def session_dir(session_id: str) -> Path:
-    d = TMP_ROOT / session_id
-    d.mkdir(parents=True, exist_ok=True)
-    return d
+SESSION_MARKER = ".last_access"
+
 
-def save_upload(session_id: str, filename: str, data: bytes) -> Path:
+class ExpirySweeper:
     """
-    เซฟไฟล์อัปโหลดไว้ที่โฟลเดอร์ของ session และตั้งเวลาลบระดับ "ทั้งโฟลเดอร์"
-    (ทำให้ภายใน session เดียวกัน ต่ออายุง่าย)
+    ตัวลบไฟล์/โฟลเดอร์หมดอายุตัวเดียวของทั้ง process (แทน asyncio.sleep task ต่อไฟล์)
+
+    - deadline ต่อ path เก็บใน dict (dedupe: schedule ซ้ำ = เลื่อน deadline = sliding TTL)
+    - heap ของ (deadline, path) ไว้หาตัวที่หมดอายุก่อน — entry ที่ deadline ไม่ตรง dict ถือว่าเก่า ข้ามไป
+    - schedule() เป็นฟังก์ชันธรรมดา thread-safe เรียกได้ทั้งใน/นอก event loop
+    - ตอน start สแกน TMP_ROOT สร้าง deadline จาก mtime ใหม่ (ไฟล์ที่ค้างจากรอบก่อน restart ไม่รั่ว)
     """
-    d = session_dir(session_id)
-    p = d / filename
-    p.write_bytes(data)
-    # ตั้งเวลาลบระดับโฟลเดอร์ (ซ้ำได้ ไม่เป็นไร) — เหมาะกับ sliding TTL
-    asyncio.create_task(schedule_cleanup(d, delay=TTL_SECONDS))
-    return p
-
-def list_session_files(session_id: str):
+
+    def __init__(self, root: Path, ttl: float, max_interval: float, batch: int):
+        self.root = root
+        self.ttl = ttl
+        self.max_interval = max_interval
+        self.batch = batch
+        self._deadlines: dict[Path, float] = {}
+        self._heap: list[tuple[float, Path]] = []
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wake: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._evicted_files = 0
+        self._evicted_dirs = 0
+        self._bytes_freed = 0
+        self._rebuilt = 0
+        self._last_sweep: float | None = None
+        self.on_evict: list = []   # callback(path) ต่อไฟล์ที่ถูกลบ (เช่น ปล่อย link ของ blob)
+
+    # ---------- scheduling ----------
+    def schedule(self, path: Path, delay: float | None = None) -> float:
+        """ตั้ง/เลื่อนเวลาลบ path (ไฟล์หรือโฟลเดอร์) → คืน deadline (epoch seconds)"""
+        deadline = time.time() + (self.ttl if delay is None else delay)
+        return self._set(Path(path), deadline)
+
+    def _set(self, path: Path, deadline: float, keep_existing: bool = False) -> float:
+        with self._lock:
+            if keep_existing and path in self._deadlines:
+                return self._deadlines[path]
+            self._deadlines[path] = deadline
+            heapq.heappush(self._heap, (deadline, path))
+            # entry เก่าสะสมเยอะ (sliding TTL ถี่ ๆ) → สร้าง heap ใหม่จาก dict
+            if len(self._heap) > 2 * len(self._deadlines) + 1024:
+                self._heap = [(d, p) for p, d in self._deadlines.items()]
+                heapq.heapify(self._heap)
+            earliest = self._heap[0][0] == deadline
+        if earliest:
+            self._notify()
+        return deadline
+
+    def cancel(self, path: Path) -> None:
+        with self._lock:
+            self._deadlines.pop(Path(path), None)
+
+    def _notify(self) -> None:
+        # deadline ใหม่มาก่อนตัวที่ sweeper กำลังรอ → ปลุกให้คำนวณเวลารอใหม่
+        loop, wake = self._loop, self._wake
+        if loop is None or wake is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(wake.set)
+        except RuntimeError:
+            pass
+
+    def _pop_due(self, now: float) -> list[Path]:
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now and len(due) < self.batch:
+                deadline, path = heapq.heappop(self._heap)
+                if self._deadlines.get(path) == deadline:
+                    del self._deadlines[path]
+                    due.append(path)
+        return due
+
+    def _next_deadline(self) -> float | None:
+        with self._lock:
+            while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+
+    # ---------- eviction ----------
+    def _evict(self, paths: list[Path]) -> tuple[int, int, int, list[Path]]:
+        files = dirs = freed = 0
+        removed: list[Path] = []
+        for p in paths:
+            try:
+                # symlink (link ไป blob) ลบแค่ตัว link — ใช้ lstat ไม่ตามไปที่ blob
+                if p.is_symlink() or p.is_file():
+                    freed += p.lstat().st_size
+                    p.unlink(missing_ok=True)
+                    removed.append(p)
+                    files += 1
+                elif p.is_dir():
+                    for f in p.rglob("*"):
+                        if f.is_symlink() or f.is_file():
+                            freed += f.lstat().st_size
+                            removed.append(f)
+                            files += 1
+                    shutil.rmtree(p, ignore_errors=True)
+                    dirs += 1
+                    continue
+                else:
+                    continue
+                # ไฟล์สุดท้ายของ session หายไป → ลบโฟลเดอร์ว่างทิ้งด้วย
+                parent = p.parent
+                if parent != self.root and self.root in parent.parents:
+                    try:
+                        parent.rmdir()
+                        dirs += 1
+                    except OSError:
+                        pass
+            except Exception:
+                # เงียบไว้เพื่อไม่ให้ sweeper ตาย
+                pass
+        return files, dirs, freed, removed
+
+    def sweep(self, now: float | None = None) -> int:
+        """ลบทุก path ที่หมดอายุแล้ว (sync) → คืนจำนวนไฟล์ที่ลบ"""
+        now = time.time() if now is None else now
+        total = 0
+        while True:
+            due = self._pop_due(now)
+            if not due:
+                break
+            files, dirs, freed, removed = self._evict(due)
+            for hook in self.on_evict:
+                for path in removed:
+                    hook(path)
+            with self._lock:
+                self._evicted_files += files
+                self._evicted_dirs += dirs
+                self._bytes_freed += freed
+            total += files
+        self._last_sweep = now
+        return total
+
+    # ---------- rebuild ----------
+    def rebuild(self) -> int:
+        """
+        สแกน TMP_ROOT แล้วตั้ง deadline = mtime + ttl ให้ทุกไฟล์ที่มีอยู่
+        โฟลเดอร์ที่มี marker (.last_access) ใช้ mtime ของ marker เป็นเวลาเข้าถึงล่าสุดทั้งโฟลเดอร์
+        path ที่ถูก schedule แล้วระหว่างนี้ไม่ถูกทับ
+        """
+        count = 0
+        try:
+            sessions = list(os.scandir(self.root))
+        except FileNotFoundError:
+            return 0
+        for entry in sessions:
+            try:
+                if entry.is_file() or entry.is_symlink():
+                    self._set(Path(entry.path), entry.stat(follow_symlinks=False).st_mtime + self.ttl, keep_existing=True)
+                    count += 1
+                    continue
+                if not entry.is_dir():
+                    continue
+                d = Path(entry.path)
+                marker = d / SESSION_MARKER
+                if marker.exists():
+                    self._set(d, marker.stat().st_mtime + self.ttl, keep_existing=True)
+                    count += 1
+                for f in os.scandir(d):
+                    if (f.is_file() or f.is_symlink()) and f.name != SESSION_MARKER:
+                        self._set(Path(f.path), f.stat(follow_symlinks=False).st_mtime + self.ttl, keep_existing=True)
+                        count += 1
+            except OSError:
+                continue
+        self._rebuilt = count
+        return count
+
+    # ---------- background task ----------
+    def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        self._loop = None
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self) -> None:
+        n = await asyncio.to_thread(self.rebuild)
+        log.info("tracking %d existing paths under %s", n, self.root)
+        while True:
+            evicted = await asyncio.to_thread(self.sweep)
+            if evicted:
+                log.debug("evicted %d expired files", evicted)
+            nxt = self._next_deadline()
+            wait = self.max_interval if nxt is None else min(self.max_interval, max(0.0, nxt - time.time()))
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "tracked": len(self._deadlines),
+                "heap": len(self._heap),
+                "evicted_files": self._evicted_files,
+                "evicted_dirs": self._evicted_dirs,
+                "bytes_freed": self._bytes_freed,
+                "rebuilt": self._rebuilt,
+                "last_sweep": self._last_sweep,
+            }
+
+
+sweeper = ExpirySweeper(TMP_ROOT, TTL_SECONDS, TEMP_SWEEP_INTERVAL, TEMP_SWEEP_BATCH)
+
+# ไฟล์อัปโหลดจริงอยู่ใน blob store (ตาม content hash, มี quota)
+# โฟลเดอร์ session เก็บแค่ link: symlink ของไฟล์อัปโหลด + sidecar ของผลลัพธ์ (source → blob)
+# refcount อยู่บนดิสก์ (hard link ใน <blob root>/refs) → หลาย worker ใช้ BLOB_ROOT เดียวกันได้
+blobs = BlobStore(Path(BLOB_ROOT) if BLOB_ROOT else Path(tempfile.gettempdir()) / "3dprint_blobs", BLOB_QUOTA_BYTES)
+# link หมดอายุ/ถูกลบโดย sweeper → ลด refcount ของ blob
+sweeper.on_evict.append(lambda path: blobs.unlink(str(path)))
+
+
+def _scan_links() -> dict[str, Path]:
+    """link ที่ยังอยู่ในโฟลเดอร์ session: symlink → blob, sidecar (.json) → source"""
+    links: dict[str, Path] = {}
+    for d in TMP_ROOT.iterdir():
+        if not d.is_dir():
+            continue
+        for f in d.iterdir():
+            try:
+                if f.is_symlink():
+                    links[str(f)] = Path(os.readlink(f))
+                elif f.suffix == ".json":
+                    links[str(f)] = Path(json.loads(f.read_text())["source"])
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+    return links
+
+
+async def start() -> None:
+    """สร้าง index ของ blob store ใหม่จากดิสก์ แล้วเริ่ม sweeper"""
+    n = await asyncio.to_thread(lambda: blobs.rebuild(_scan_links()))
+    log.info("%d blobs in %s", n, blobs.root)
+    sweeper.start()
+
+
+async def stop() -> None:
+    await sweeper.stop()
+
+
+def session_dir(session_id: str) -> Path:
     d = TMP_ROOT / session_id
-    if not d.exists():
-        return []
-    return [p.name for p in d.iterdir()]
+    d.mkdir(parents=True, exist_ok=True)
+    return d
 
-async def schedule_cleanup(path_or_session: Path, delay: int = TTL_SECONDS):
+def store_upload(session_id: str, src: Path, digest: str) -> Path:
     """
-    ตั้งเวลาลบไฟล์/โฟลเดอร์หลัง delay วินาที
-    เรียกซ้ำได้ (ไม่ต้องยกเลิกงานเก่า) เพราะลบแบบ ignore_errors
+    ย้ายไฟล์ที่ spool แล้วเข้า blob store (ภาพซ้ำ = ไฟล์เดียว)
+    แล้วสร้าง link ในโฟลเดอร์ session ชื่อเดียวกับไฟล์ spool → คืน path ของ link (หมดอายุตาม TTL)
     """
-    await asyncio.sleep(delay)
+    link = session_dir(session_id) / src.name
+    # put + ref ของ link ใน lock เดียวกัน → process อื่นลบ blob ระหว่างนี้ไม่ได้
+    blob = blobs.put(src, digest, src.suffix, link=str(link))
     try:
-        if path_or_session.is_file():
-            path_or_session.unlink(missing_ok=True)
-        elif path_or_session.is_dir():
-            shutil.rmtree(path_or_session, ignore_errors=True)
-    except Exception:
-        # เงียบไว้เพื่อไม่ให้ crash background task
-        pass
-
-def bump_session_ttl(session_id: str, delay: int = TTL_SECONDS) -> None:
-    """
-    ต่ออายุโฟลเดอร์ของ session (sliding TTL)
-    เรียกทุกครั้งที่มีการเข้าถึงไฟล์ใน session นั้น ๆ
-    """
-    d = session_dir(session_id)  # ensure exists
-    # อาจ "touch" ไฟล์ marker เพื่อบอกมีการใช้งาน (optional)
-    marker = d / ".last_access"
-    try:
-        marker.write_text(str(time.time()))
-    except Exception:
-        pass
-    # ตั้งเวลาลบใหม่ (ซ้ำได้ ไม่เป็นไร)
-    asyncio.create_task(schedule_cleanup(d, delay=delay))
+        os.symlink(blob, link)
+    except OSError:
+        os.link(blob, link)   # ระบบที่สร้าง symlink ไม่ได้ (เช่น Windows ไม่มีสิทธิ์)
+    sweeper.schedule(link, delay=TTL_SECONDS)
+    return link
+
+def link_result(meta_path: Path, source: Path | None) -> None:
+    """sidecar ของผลลัพธ์อ้างถึง blob ต้นฉบับ (refcount) + ตั้งเวลาหมดอายุ"""
+    if source is not None:
+        blobs.link(str(meta_path), Path(source).resolve())
+    sweeper.schedule(meta_path, delay=TTL_SECONDS)
@@ -0,0 +1,200 @@
+# backend/webhooks.py
+"""
+Webhook delivery (x-callback-url)
+
+- งานส่งเก็บในตาราง webhook_outbox ของ SQLite → รอด restart, ส่งไม่สำเร็จไม่หาย
+- 1 แถวต่อ (card_id, url): อัปเดตซ้ำระหว่างรอส่ง → ส่งแค่ payload ล่าสุด (coalesce)
+- httpx.AsyncClient ตัวเดียวทั้ง process (connection pool / keep-alive)
+- จำกัดจำนวนส่งพร้อมกันทั้งหมด และต่อ host (ปลายทางช้าไม่กินทุก connection)
+- ล้มเหลวชั่วคราว (network / 408 / 429 / 5xx) → ลองใหม่แบบ exponential backoff
+  4xx อื่น ๆ หรือครบ WEBHOOK_MAX_ATTEMPTS → failed
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import httpx
+
+from backend.config import (
+    WEBHOOK_TIMEOUT,
+    WEBHOOK_CONCURRENCY,
+    WEBHOOK_PER_HOST,
+    WEBHOOK_MAX_ATTEMPTS,
+    WEBHOOK_BACKOFF_BASE,
+    WEBHOOK_BACKOFF_MAX,
+    WEBHOOK_POLL_INTERVAL,
+    WEBHOOK_LEASE_SECONDS,
+    WEBHOOK_RETENTION,
+)
+from backend.metrics import WEBHOOK_SECONDS
+from . import database as db
+
+log = logging.getLogger(__name__)
+
+_RETRY_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+_client: httpx.AsyncClient | None = None
+_wakeup: asyncio.Event | None = None
+_task: asyncio.Task | None = None
+_inflight: set[asyncio.Task] = set()
+_host_inflight: dict[str, int] = {}
+
+# metrics (ตั้งแต่ process เริ่ม)
+_latencies: deque = deque(maxlen=1000)   # วินาที ของการส่งที่สำเร็จล่าสุด
+_counters = {"enqueued": 0, "coalesced": 0, "delivered": 0, "retried": 0, "failed": 0, "superseded": 0}
+_last_error: str | None = None
+
+
+def _host(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+
+def backoff(attempts: int) -> float:
+    """หน่วงก่อนลองครั้งถัดไป: base * 2^(attempts-1) (+jitter) ไม่เกิน WEBHOOK_BACKOFF_MAX"""
+    delay = min(WEBHOOK_BACKOFF_MAX, WEBHOOK_BACKOFF_BASE * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+async def enqueue(card_id: str, url: str, payload: dict) -> None:
+    """บันทึกลง outbox แล้วปลุก dispatcher (แทน create_task(notify_callback(...)))"""
+    coalesced = await db.run(db.enqueue_webhook, card_id, url, _host(url), payload)
+    _counters["enqueued"] += 1
+    if coalesced:
+        _counters["coalesced"] += 1
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def _deliver(item: dict) -> None:
+    global _last_error
+    card_id, url, seq, attempts = item["card_id"], item["url"], item["seq"], item["attempts"]
+    error, retry_after, permanent = None, None, False
+    t0 = time.perf_counter()
+    try:
+        r = await _client.post(url, content=item["payload_json"],
+                               headers={"Content-Type": "application/json"})
+        if r.is_success:
+            _latencies.append(time.perf_counter() - t0)
+        else:
+            error = f"HTTP {r.status_code}"
+            if r.status_code in _RETRY_STATUS:
+                ra = r.headers.get("retry-after", "")
+                retry_after = float(ra) if ra.isdigit() else None
+            else:
+                permanent = True   # 4xx อื่น ๆ ลองใหม่ก็ไม่ผ่าน
+    except httpx.HTTPError as e:
+        error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+    elapsed = time.perf_counter() - t0
+
+    if error is None:
+        current = await db.run(db.finish_webhook, card_id, url, seq)
+        result = "delivered"
+    elif not permanent and attempts < WEBHOOK_MAX_ATTEMPTS:
+        retry_at = time.time() + max(retry_after or 0.0, backoff(attempts))
+        current = await db.run(db.finish_webhook, card_id, url, seq, error=error, retry_at=retry_at)
+        result = "retried"
+    else:
+        current = await db.run(db.finish_webhook, card_id, url, seq, status="failed", error=error)
+        result = "failed"
+        log.warning("POST %s failed (attempt %d, giving up): %s", url, attempts, error)
+    _counters[result] += 1
+    WEBHOOK_SECONDS.labels(result).observe(elapsed)
+    if error is not None:
+        _last_error = f"{url}: {error}"
+    if not current:
+        # มี payload ใหม่ของ card นี้เข้ามาระหว่างส่ง → ส่งอันใหม่ต่อทันที
+        _counters["superseded"] += 1
+        _wakeup.set()
+
+
+def _done(task: asyncio.Task, host: str) -> None:
+    _inflight.discard(task)
+    _host_inflight[host] -= 1
+    if not _host_inflight[host]:
+        del _host_inflight[host]
+    if not task.cancelled() and task.exception() is not None:
+        log.error("delivery error: %s", task.exception())
+    _wakeup.set()   # มีช่องว่างแล้ว
+
+
+async def _dispatcher() -> None:
+    last_purge = 0.0
+    while True:
+        _wakeup.clear()
+        free = WEBHOOK_CONCURRENCY - len(_inflight)
+        items = []
+        if free > 0:
+            saturated = [h for h, n in _host_inflight.items() if n >= WEBHOOK_PER_HOST]
+            try:
+                items = await db.run(db.claim_webhooks, free, WEBHOOK_LEASE_SECONDS, saturated)
+            except Exception as e:
+                log.warning("claim failed: %s", e)
+        for item in items:
+            host = item["host"]
+            if _host_inflight.get(host, 0) >= WEBHOOK_PER_HOST:
+                # host เดียวกันถูกหยิบมาเกินโควตาในรอบเดียว → คืนคิว
+                await db.run(db.release_webhook, item["card_id"], item["url"])
+                continue
+            _host_inflight[host] = _host_inflight.get(host, 0) + 1
+            t = asyncio.create_task(_deliver(item))
+            _inflight.add(t)
+            t.add_done_callback(lambda t, host=host: _done(t, host))
+
+        if time.time() - last_purge > 3600:
+            await db.run(db.purge_webhooks, time.time() - WEBHOOK_RETENTION)
+            last_purge = time.time()
+
+        # รอจนถึงรายการถัดไปที่ถึงเวลา (backoff) หรือมีงานใหม่/มีช่องว่าง
+        timeout = WEBHOOK_POLL_INTERVAL
+        if not items:
+            due = await db.run(db.next_webhook_due)
+            if due is not None:
+                timeout = min(max(0.05, due - time.time()), WEBHOOK_POLL_INTERVAL * 30)
+        # ไม่ใช้ wait_for: บน 3.11 ถ้า _wakeup ถูก set พร้อมกับ cancel มันกลืน CancelledError → stop() ค้างตลอด
+        waiter = asyncio.ensure_future(_wakeup.wait())
+        try:
+            await asyncio.wait((waiter,), timeout=timeout)
+        finally:
+            waiter.cancel()
+
+
+def start() -> None:
+    """เริ่ม dispatcher (เรียกจาก lifespan ของ app)"""
+    global _client, _wakeup, _task
+    _client = httpx.AsyncClient(
+        timeout=WEBHOOK_TIMEOUT,
+        limits=httpx.Limits(max_connections=WEBHOOK_CONCURRENCY,
+                            max_keepalive_connections=WEBHOOK_CONCURRENCY),
+    )
+    _wakeup = asyncio.Event()
+    _task = asyncio.create_task(_dispatcher())
+
+
+async def stop() -> None:
+    """หยุดรับงานใหม่ ยกเลิกที่กำลังส่ง (lease หมดแล้วจะถูกส่งใหม่รอบหน้า)"""
+    global _client, _task
+    if _task is not None:
+        _task.cancel()
+    tasks = [_task, *_inflight] if _task is not None else list(_inflight)
+    for t in _inflight:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    _task = None
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def stats() -> dict:
+    lat = sorted(_latencies)
+    pct = lambda q: round(lat[min(len(lat) - 1, int(q * len(lat)))] * 1000, 1) if lat else None
+    return {
+        **_counters,
+        "inflight": len(_inflight),
+        "inflight_by_host": dict(_host_inflight),
+        "latency_ms": {"p50": pct(0.5), "p95": pct(0.95), "max": pct(1.0)},
+        "last_error": _last_error,
+    }
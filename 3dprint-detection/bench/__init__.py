@@ -0,0 +1,13 @@
+# bench/
+"""
+Benchmarks ของ API (รันจากโฟลเดอร์ 3dprint-detection)
+
+    python -m bench.startup            # เวลา import app / live (/healthz) / ready (/readyz)
+    python -m bench.load --stub        # load test POST /cards, /cards/replace, GET /cards (asgi หรือ uvicorn)
+    python -m bench.micro --stub       # แต่ละขั้นของ detect() (decode/predict/annotate/encode/imwrite) + DB CRUD
+    python -m bench.compare a.json b.json   # เทียบผลสองรอบ แย่ลงเกิน threshold → exit 1
+
+--stub = โมเดลปลอม (bench/stub.py) ไม่ต้องมี best.pt/torch; ไม่ใส่ = โหลดโมเดลจริงตาม MODEL_* ใน backend/config.py
+
+ทุกสคริปต์รัน server ในโฟลเดอร์ชั่วคราว (DB / ไฟล์ temp แยกจากของจริง) และพิมพ์ผลเป็น JSON
+"""
@@ -0,0 +1,105 @@
+# bench/common.py
+"""ของที่ทุก benchmark ใช้ร่วมกัน: workdir/env ของ server, percentiles, peak RSS, เขียนผล JSON"""
+import datetime
+import json
+import os
+import platform
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent.parent
+
+
+def app_env(workdir: Path) -> dict:
+    """env ของ server ที่รันใน workdir (DB / blob ใหม่) → ชี้ MODEL_PATH กลับมาที่ repo"""
+    env = dict(os.environ)
+    env.setdefault("MODEL_PATH", str(APP_DIR / "backend" / "best.pt"))
+    env.setdefault("BLOB_ROOT", str(workdir / "blobs"))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(APP_DIR), env.get("PYTHONPATH")]))
+    (workdir / "backend").mkdir(exist_ok=True)
+    return env
+
+
+def use_workdir(workdir: Path) -> None:
+    """แบบ in-process: DB_PATH ของ backend เป็น path สัมพัทธ์ → chdir ก่อน import backend.*"""
+    env = app_env(workdir)
+    os.environ.update({k: env[k] for k in ("MODEL_PATH", "BLOB_ROOT")})
+    if str(APP_DIR) not in sys.path:
+        sys.path.insert(0, str(APP_DIR))
+    os.chdir(workdir)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def parse_resolutions(text: str) -> list[tuple[int, int]]:
+    """"640x480,1920x1080" → [(640, 480), (1920, 1080)]"""
+    out = []
+    for part in filter(None, (p.strip() for p in text.split(","))):
+        w, _, h = part.lower().partition("x")
+        out.append((int(w), int(h)))
+    return out
+
+
+def percentiles(samples_ms: list[float]) -> dict:
+    """p50/p95/p99 (nearest-rank) + mean/max เป็น ms"""
+    if not samples_ms:
+        return {"n": 0}
+    s = sorted(samples_ms)
+
+    def rank(p: float) -> float:
+        return s[min(len(s) - 1, max(0, round(p / 100 * len(s) + 0.5) - 1))]
+
+    return {
+        "n": len(s),
+        "p50": round(rank(50), 3),
+        "p95": round(rank(95), 3),
+        "p99": round(rank(99), 3),
+        "mean": round(statistics.fmean(s), 3),
+        "max": round(s[-1], 3),
+    }
+
+
+def peak_rss_mb(pid: int | None = None) -> float | None:
+    """RSS สูงสุดของ process (VmHWM จาก /proc; ตัวเองใช้ getrusage ได้ทุก Unix)"""
+    if pid is None:
+        kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round((kb / 1024 if sys.platform != "darwin" else kb / 1024 / 1024), 1)
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmHWM:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def run_meta() -> dict:
+    """ข้อมูลเครื่อง/commit — ไว้ดูว่าผลสองไฟล์เทียบกันได้ไหม"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR,
+                                capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "model_backend": os.getenv("MODEL_BACKEND", "ultralytics"),
+    }
+
+
+def write_report(report: dict, out: str | None) -> None:
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if out:
+        Path(out).write_text(text, encoding="utf-8")
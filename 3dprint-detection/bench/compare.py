@@ -0,0 +1,71 @@
+# bench/compare.py
+"""
+เทียบผล JSON สองไฟล์ของ benchmark เดียวกัน (load / micro / startup) เพื่อจับ regression
+
+    python -m bench.compare base.json new.json --threshold 0.10
+
+- เทียบทุกค่าที่ path ตรงกัน: latency (p50/p95/p99, *_s) ยิ่งน้อยยิ่งดี, rps ยิ่งมากยิ่งดี
+- แย่ลงเกิน threshold (สัดส่วน) → พิมพ์ REGRESSION และ exit 1 (ใช้ใน CI ได้)
+"""
+import argparse
+import json
+import sys
+
+LOWER_IS_BETTER = ("p50", "p95", "p99", "mean", "import_s", "live_s", "ready_s", "peak_rss_mb")
+HIGHER_IS_BETTER = ("rps",)
+
+
+def _walk(obj, path=()):
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            if k not in ("meta", "config"):
+                yield from _walk(v, path + (k,))
+    elif isinstance(obj, (int, float)) and not isinstance(obj, bool) and path:
+        yield path, obj
+
+
+def compare(base: dict, new: dict, threshold: float) -> list[dict]:
+    new_vals = dict(_walk(new))
+    rows = []
+    for path, old in _walk(base):
+        key = path[-1]
+        if key not in LOWER_IS_BETTER + HIGHER_IS_BETTER or path not in new_vals:
+            continue
+        cur = new_vals[path]
+        if not old:
+            continue
+        change = (cur - old) / old
+        worse = change > threshold if key in LOWER_IS_BETTER else change < -threshold
+        rows.append({"metric": "/".join(path), "base": old, "new": cur,
+                     "change": round(change, 4), "regression": worse})
+    return rows
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m bench.compare", description="เทียบผล benchmark สองรอบ")
+    ap.add_argument("base")
+    ap.add_argument("new")
+    ap.add_argument("--threshold", type=float, default=0.10, help="สัดส่วนที่แย่ลงได้ก่อนถือว่า regression")
+    ap.add_argument("--all", action="store_true", help="พิมพ์ทุก metric (ไม่ใช่แค่ที่ regression)")
+    args = ap.parse_args(argv)
+
+    with open(args.base, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    if base.get("bench") != new.get("bench"):
+        print(f"different benchmarks: {base.get('bench')} vs {new.get('bench')}", file=sys.stderr)
+        return 2
+
+    rows = compare(base, new, args.threshold)
+    for r in rows:
+        if args.all or r["regression"]:
+            flag = "REGRESSION" if r["regression"] else "ok"
+            print(f"{flag:10} {r['metric']:60} {r['base']:>12} → {r['new']:<12} ({r['change']:+.1%})")
+    bad = sum(r["regression"] for r in rows)
+    print(f"{len(rows)} metrics compared, {bad} regression(s) over {args.threshold:.0%}")
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
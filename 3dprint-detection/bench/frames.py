@@ -0,0 +1,49 @@
+# bench/frames.py
+"""
+ภาพสังเคราะห์สำหรับ benchmark — ไม่ต้องมีภาพจริงจากกล้อง
+
+มีพื้นหลังไล่สี + วัตถุรูปทรง + noise เพื่อให้ขนาดไฟล์/เวลา decode ใกล้ภาพจริง
+(ภาพสีเรียบ ๆ บีบอัดได้เล็กผิดปกติ) และ seed ต่างกัน → bytes ต่างกัน (ไม่โดน detect cache)
+"""
+import cv2
+import numpy as np
+
+ENCODE = {
+    "jpeg": (".jpg", [cv2.IMWRITE_JPEG_QUALITY, 90]),
+    "png": (".png", [cv2.IMWRITE_PNG_COMPRESSION, 3]),
+}
+MEDIA_TYPES = {"jpeg": "image/jpeg", "png": "image/png"}
+
+
+def synth_frame(width: int, height: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 1, width, dtype=np.float32)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    base = rng.uniform(40, 200, 3).astype(np.float32)
+    img = np.empty((height, width, 3), dtype=np.float32)
+    for c in range(3):
+        img[..., c] = base[c] + 50 * x * (c - 1) + 40 * y
+    img = np.clip(img + rng.normal(0, 6, img.shape), 0, 255).astype(np.uint8)
+    # "ชิ้นงาน" บนฐานพิมพ์
+    for _ in range(6):
+        cx, cy = int(rng.integers(0, width)), int(rng.integers(0, height))
+        r = int(rng.integers(max(4, min(width, height) // 20), max(5, min(width, height) // 5)))
+        color = tuple(int(v) for v in rng.integers(0, 256, 3))
+        if rng.random() < 0.5:
+            cv2.circle(img, (cx, cy), r, color, -1)
+        else:
+            cv2.rectangle(img, (cx - r, cy - r), (cx + r, cy + r // 2), color, -1)
+    return img
+
+
+def encode(img: np.ndarray, fmt: str = "jpeg") -> bytes:
+    ext, params = ENCODE[fmt]
+    ok, buf = cv2.imencode(ext, img, params)
+    if not ok:
+        raise RuntimeError(f"{fmt} encode failed")
+    return buf.tobytes()
+
+
+def make_frames(width: int, height: int, fmt: str = "jpeg", count: int = 16) -> list[bytes]:
+    """count ภาพที่ bytes ไม่ซ้ำกัน (วนใช้ระหว่างยิง request)"""
+    return [encode(synth_frame(width, height, seed), fmt) for seed in range(count)]
@@ -0,0 +1,192 @@
+# bench/load.py
+"""
+Load test ของ endpoint หลัก: POST /cards, POST /cards/replace, GET /cards
+
+- target asgi    : app ใน process นี้ผ่าน httpx.ASGITransport (ไม่มี network/uvicorn — ดู overhead ของ app ล้วน)
+- target uvicorn : bench.serve ใน process แยก ยิงผ่าน TCP (ใกล้ production)
+- ยิงพร้อมกัน --concurrency ตัว รวม --requests ครั้งต่อ scenario ต่อความละเอียด
+- รายงาน p50/p95/p99 (ms), requests/s, จำนวน error ตาม status และ peak RSS ของ server
+
+    python -m bench.load --stub --target asgi --res 640x480,1920x1080 --concurrency 8 --requests 200
+    python -m bench.load --target uvicorn --scenarios replace --out load.json     # โมเดลจริงตาม MODEL_*
+
+default ปิด detect cache + frame gate (ไม่งั้นภาพที่วนซ้ำไม่ได้ infer จริง) — --keep-cache เพื่อวัดแบบ production
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from bench.common import (
+    app_env, free_port, parse_resolutions, peak_rss_mb, percentiles, run_meta, use_workdir, write_report,
+)
+from bench.frames import MEDIA_TYPES, make_frames
+
+SCENARIOS = ("create", "replace", "list")
+
+
+async def wait_ready(c: httpx.AsyncClient, timeout: float) -> None:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            r = await c.get("/readyz")
+            if r.status_code == 200:
+                return
+            if r.json().get("status") == "failed":
+                raise SystemExit(f"model failed to load: {r.json().get('error')}")
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.05)
+    raise SystemExit(f"server not ready in {timeout}s")
+
+
+async def drive(c: httpx.AsyncClient, send, requests: int, concurrency: int) -> dict:
+    """เรียก send(i) รวม requests ครั้ง พร้อมกันสูงสุด concurrency ครั้ง"""
+    counter = itertools.count()
+    latencies: list[float] = []
+    codes: dict[str, int] = {}
+
+    async def worker():
+        while (i := next(counter)) < requests:
+            t = time.perf_counter()
+            try:
+                code = (await send(i)).status_code
+            except httpx.HTTPError as e:
+                code = type(e).__name__
+            ms = (time.perf_counter() - t) * 1000
+            codes[str(code)] = codes.get(str(code), 0) + 1
+            if code in (200, 201):
+                latencies.append(ms)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+    ok = len(latencies)
+    return {
+        "requests": requests,
+        "ok": ok,
+        "status": codes,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(ok / elapsed, 2) if elapsed else None,
+        "latency_ms": percentiles(latencies),
+    }
+
+
+async def run_scenarios(c: httpx.AsyncClient, args, res: tuple[int, int]) -> dict:
+    frames = make_frames(*res, args.fmt, args.frames)
+    media = MEDIA_TYPES[args.fmt]
+
+    def upload(i: int):
+        return {"image": (f"f{i}.{args.fmt}", frames[i % len(frames)], media)}
+
+    keys = [(await c.post("/cards/genkey")).json()["api_key"] for _ in range(args.concurrency)]
+    senders = {
+        "create": lambda i: c.post("/cards", files=upload(i)),
+        "replace": lambda i: c.post("/cards/replace", files=upload(i), headers={"x-api-key": keys[i % len(keys)]}),
+        "list": lambda i: c.get("/cards", params={"limit": args.list_limit}),
+    }
+    out = {}
+    for name in args.scenarios:
+        if args.warmup:
+            await drive(c, senders[name], args.warmup, args.concurrency)
+        out[name] = await drive(c, senders[name], args.requests, args.concurrency)
+    return out
+
+
+async def bench_asgi(args) -> dict:
+    if args.stub:
+        from bench.stub import install
+
+        install(args.stub_ms)
+    from backend.main import app
+
+    results = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as c:
+            await wait_ready(c, args.timeout)
+            for res in args.res:
+                results[f"{res[0]}x{res[1]}"] = await run_scenarios(c, args, res)
+    return {"results": results, "peak_rss_mb": peak_rss_mb()}
+
+
+async def bench_uvicorn(args, workdir: Path) -> dict:
+    port = free_port()
+    cmd = [sys.executable, "-m", "bench.serve", "--port", str(port)]
+    if args.stub:
+        cmd += ["--stub", "--stub-ms", str(args.stub_ms)]
+    proc = subprocess.Popen(cmd, cwd=workdir, env=app_env(workdir),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    results = {}
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency * 2)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=args.timeout, limits=limits) as c:
+            await wait_ready(c, args.timeout)
+            for res in args.res:
+                results[f"{res[0]}x{res[1]}"] = await run_scenarios(c, args, res)
+        rss = peak_rss_mb(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return {"results": results, "peak_rss_mb": rss}
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m bench.load", description="load test ของ /cards")
+    ap.add_argument("--target", choices=("asgi", "uvicorn"), default="asgi")
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"คั่นด้วย , จาก {SCENARIOS}")
+    ap.add_argument("--res", default="640x480,1920x1080", help="ความละเอียดภาพ เช่น 640x480,4032x3024")
+    ap.add_argument("--fmt", choices=tuple(MEDIA_TYPES), default="jpeg")
+    ap.add_argument("--frames", type=int, default=16, help="จำนวนภาพไม่ซ้ำที่วนใช้")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--requests", type=int, default=200, help="ต่อ scenario ต่อความละเอียด")
+    ap.add_argument("--warmup", type=int, default=10, help="request ที่ยิงก่อนเริ่มจับเวลา (ไม่นับ)")
+    ap.add_argument("--list-limit", type=int, default=50)
+    ap.add_argument("--timeout", type=float, default=120.0)
+    ap.add_argument("--stub", action="store_true", help="ใช้โมเดลปลอม (bench/stub.py) ไม่ต้องมี best.pt")
+    ap.add_argument("--stub-ms", type=float, default=0.0, help="เวลาหน่วงต่อ predict ของ stub")
+    ap.add_argument("--keep-cache", action="store_true", help="ไม่ปิด detect cache / frame gate")
+    ap.add_argument("--out", help="เขียนผล JSON ลงไฟล์นี้ด้วย (เทียบด้วย python -m bench.compare)")
+    args = ap.parse_args(argv)
+    args.scenarios = [s for s in args.scenarios.split(",") if s]
+    if unknown := set(args.scenarios) - set(SCENARIOS):
+        ap.error(f"unknown scenarios: {sorted(unknown)}")
+    args.res = parse_resolutions(args.res)
+    if args.out:
+        args.out = str(Path(args.out).resolve())   # ก่อน chdir เข้า workdir
+    if not args.keep_cache:
+        os.environ.setdefault("DETECT_CACHE_SIZE", "0")
+        os.environ.setdefault("GATE_DIFF_THRESHOLD", "0")
+
+    with tempfile.TemporaryDirectory(prefix="bench_load_") as d:
+        workdir = Path(d)
+        if args.target == "asgi":
+            use_workdir(workdir)
+            measured = asyncio.run(bench_asgi(args))
+        else:
+            measured = asyncio.run(bench_uvicorn(args, workdir))
+
+    report = {
+        "bench": "load",
+        "meta": run_meta(),
+        "config": {
+            "target": args.target, "scenarios": args.scenarios, "fmt": args.fmt,
+            "concurrency": args.concurrency, "requests": args.requests, "frames": args.frames,
+            "stub": args.stub, "stub_ms": args.stub_ms if args.stub else None, "keep_cache": args.keep_cache,
+        },
+        **measured,
+    }
+    write_report(report, args.out)
+    failed = any(r["ok"] < r["requests"] for per_res in measured["results"].values() for r in per_res.values())
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
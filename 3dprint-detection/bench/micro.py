@@ -0,0 +1,146 @@
+# bench/micro.py
+"""
+Micro-benchmark ของแต่ละขั้นใน detect() + CRUD ของ backend/database.py
+
+stage (ต่อความละเอียด/ฟอร์แมต):
+- decode   : decode_for_inference ตาม DECODE_POLICY / DECODE_TARGET_SIZE
+- predict  : engine.predict ภาพเดียว (โมเดลจริงตาม MODEL_* หรือ --stub)
+- predict_fast : รอบถูกของ CASCADE_MODE=lowres (engine เดิม input CASCADE_IMGSZ) — เฉพาะ .pt/กราฟ dynamic
+- annotate : render.draw_boxes บนภาพที่ decode แล้ว
+- encode   : cv2.imencode JPEG ตาม RENDER_JPEG_QUALITY (สิ่งที่ /temp/results ทำตอนถูกขอ)
+- imwrite  : cv2.imwrite ภาพ annotate ลงดิสก์ (แบบเดิมก่อนมี lazy render) + write_meta (sidecar ปัจจุบัน)
+db: upsert_card (insert/update), get_card, list_cards, create_apikey, verify_apikey — บน DB ใหม่ในโฟลเดอร์ชั่วคราว
+
+    python -m bench.micro --stub --res 640x480,1920x1080,4032x3024 --iters 30 --out micro.json
+"""
+import argparse
+import datetime
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench.common import parse_resolutions, peak_rss_mb, percentiles, run_meta, use_workdir, write_report
+from bench.frames import make_frames
+
+
+def timeit(fn, iters: int, warmup: int = 1) -> dict:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iters):
+        t = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t) * 1000)
+    return percentiles(samples)
+
+
+def bench_stages(engine, res: tuple[int, int], fmt: str, iters: int, workdir: Path) -> dict:
+    import cv2
+
+    from backend.config import (
+        CONF_THRESHOLD, DECODE_POLICY, DECODE_TARGET_SIZE, RENDER_JPEG_QUALITY, CASCADE_IMGSZ, CASCADE_BAND_LOW,
+    )
+    from backend.decode import decode_for_inference, load_buffer
+    from backend.render import draw_boxes, write_meta
+
+    data = make_frames(*res, fmt, count=1)[0]
+    buf = load_buffer(data)
+    img, scale = decode_for_inference(buf, DECODE_TARGET_SIZE, DECODE_POLICY)
+    dets = engine.predict([img], CONF_THRESHOLD)[0]
+    boxes = [{"cls": d.cls, "label": engine.names.get(d.cls, f"class_{d.cls}"), "conf": round(d.conf, 4),
+              "xyxy": [round(v * scale, 1) for v in d.xyxy]} for d in dets]
+    rel = img.shape[1] / res[0]
+    annotated = img.copy()
+    draw_boxes(annotated, boxes, rel)
+    out_jpg = workdir / "stage.jpg"
+    meta = {"scores": {}, "status": "NORMAL", "boxes": boxes, "width": res[0], "height": res[1],
+            "source": str(workdir / "stage.src")}
+
+    stages = {
+        "bytes": len(data),
+        "decoded": list(img.shape[:2]),
+        "decode": timeit(lambda: decode_for_inference(buf, DECODE_TARGET_SIZE, DECODE_POLICY), iters),
+        "predict": timeit(lambda: engine.predict([img], CONF_THRESHOLD), iters),
+        "annotate": timeit(lambda: draw_boxes(img.copy(), boxes, rel), iters),
+        "encode": timeit(lambda: cv2.imencode(".jpg", annotated, [cv2.IMWRITE_JPEG_QUALITY, RENDER_JPEG_QUALITY]), iters),
+        "imwrite": timeit(lambda: cv2.imwrite(str(out_jpg), annotated), iters),
+        "write_meta": timeit(lambda: write_meta(out_jpg, meta), iters),
+    }
+    if engine.variable_imgsz:
+        stages["predict_fast"] = timeit(lambda: engine.predict([img], CASCADE_BAND_LOW, imgsz=CASCADE_IMGSZ), iters)
+    return stages
+
+
+def bench_db(iters: int) -> dict:
+    from backend import database as db
+
+    db.init_db()
+    now = lambda: datetime.datetime.utcnow().isoformat()
+    card = lambda cid: {"card_id": cid, "detected_image_url": f"/temp/results/s/{cid}_latest.jpg",
+                        "status": "NORMAL", "scores": {"normal": 0.9}, "updated_at": now(), "model": "bench"}
+    seq = iter(range(10**9))
+    ids = [f"c{i:07d}" for i in range(max(iters, 200))]
+    for cid in ids:   # ตารางไม่ว่าง → list/get ใกล้ของจริง
+        db.upsert_card(card(cid))
+    key = db.create_apikey(ids[0], 3600)["api_key"]
+    try:
+        return {
+            "rows": len(ids),
+            "upsert_insert": timeit(lambda: db.upsert_card(card(f"n{next(seq):07d}")), iters),
+            "upsert_update": timeit(lambda: db.upsert_card(card(ids[0])), iters),
+            "get_card": timeit(lambda: db.get_card(ids[len(ids) // 2]), iters),
+            "list_cards_50": timeit(lambda: db.list_cards(limit=50), iters),
+            "create_apikey": timeit(lambda: db.create_apikey(ids[1], 3600), iters),
+            "verify_apikey": timeit(lambda: db.verify_apikey(key, ids[0]), iters),
+        }
+    finally:
+        db.close_pool()
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m bench.micro", description="micro-benchmark ของ detect stages + DB")
+    ap.add_argument("--res", default="640x480,1920x1080,4032x3024")
+    ap.add_argument("--fmt", default="jpeg,png", help="ฟอร์แมตภาพ คั่นด้วย ,")
+    ap.add_argument("--iters", type=int, default=30)
+    ap.add_argument("--stub", action="store_true", help="ใช้โมเดลปลอม (bench/stub.py) ไม่ต้องมี best.pt")
+    ap.add_argument("--stub-ms", type=float, default=0.0)
+    ap.add_argument("--skip-db", action="store_true")
+    ap.add_argument("--out", help="เขียนผล JSON ลงไฟล์นี้ด้วย")
+    args = ap.parse_args(argv)
+    out = str(Path(args.out).resolve()) if args.out else None
+
+    with tempfile.TemporaryDirectory(prefix="bench_micro_") as d:
+        workdir = Path(d)
+        use_workdir(workdir)
+        if args.stub:
+            from bench.stub import StubEngine
+
+            engine = StubEngine(args.stub_ms)
+        else:
+            from backend.engines import load_engine
+
+            engine = load_engine()
+        stages = {}
+        try:
+            for res in parse_resolutions(args.res):
+                for fmt in filter(None, args.fmt.split(",")):
+                    stages[f"{res[0]}x{res[1]}/{fmt}"] = bench_stages(engine, res, fmt, args.iters, workdir)
+        finally:
+            engine.close()
+        db_results = None if args.skip_db else bench_db(args.iters)
+
+    report = {
+        "bench": "micro",
+        "meta": run_meta(),
+        "config": {"iters": args.iters, "stub": args.stub, "engine": engine.name},
+        "stages": stages,
+        "db": db_results,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    write_report(report, out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,31 @@
+# bench/serve.py
+"""
+uvicorn สำหรับ benchmark (bench.load --target uvicorn เรียกใช้ใน process แยก)
+
+    python -m bench.serve --port 8000 --stub --stub-ms 20
+"""
+import argparse
+import sys
+
+import uvicorn
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m bench.serve", description="uvicorn + โมเดลปลอม (ไม่บังคับ)")
+    ap.add_argument("--port", type=int, default=8000)
+    ap.add_argument("--stub", action="store_true", help="ใช้ StubEngine แทนโมเดลจริง")
+    ap.add_argument("--stub-ms", type=float, default=0.0, help="เวลาหน่วงต่อ predict ของ stub")
+    args = ap.parse_args(argv)
+
+    if args.stub:
+        from bench.stub import install
+
+        install(args.stub_ms)
+    from backend.main import app
+
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+# bench/startup.py
+"""
+วัดเวลา startup ของ worker
+
+- import_s : `import backend.main` ใน process ใหม่ (ไม่ควรมี torch)
+- live_s   : เริ่ม uvicorn → /healthz ตอบ 200
+- ready_s  : เริ่ม uvicorn → /readyz ตอบ 200 (โหลดโมเดล + warmup เสร็จ)
+- server   : เวลาที่ server วัดเอง (startup ใน /readyz)
+
+    python -m bench.startup --runs 5 --out startup.json
+    MODEL_BACKEND=onnx python -m bench.startup
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from bench.common import app_env, free_port, write_report
+
+
+def measure_import(workdir: Path) -> dict:
+    code = ("import sys, time; t = time.perf_counter(); import backend.main; "
+            "print(time.perf_counter() - t, 'torch' in sys.modules)")
+    out = subprocess.run([sys.executable, "-c", code], cwd=workdir, env=app_env(workdir),
+                         capture_output=True, text=True, check=True).stdout.split()
+    return {"import_s": round(float(out[-2]), 3), "torch_imported": out[-1] == "True"}
+
+
+def measure_server(workdir: Path, timeout: float) -> dict:
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=app_env(workdir), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    live = ready = None
+    body = {}
+    try:
+        with httpx.Client(timeout=1.0) as c:
+            while time.perf_counter() - t0 < timeout and proc.poll() is None:
+                try:
+                    if live is None and c.get(f"{base}/healthz").status_code == 200:
+                        live = time.perf_counter() - t0
+                    if live is not None:
+                        r = c.get(f"{base}/readyz")
+                        body = r.json()
+                        if r.status_code == 200:
+                            ready = time.perf_counter() - t0
+                            break
+                        if body.get("status") == "failed":
+                            break
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.01)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return {
+        "live_s": round(live, 3) if live is not None else None,
+        "ready_s": round(ready, 3) if ready is not None else None,
+        "model": body.get("model"),
+        "error": body.get("error"),
+        "server": body.get("startup"),
+    }
+
+
+def _median(runs: list[dict], key: str):
+    vals = [r[key] for r in runs if r.get(key) is not None]
+    return round(statistics.median(vals), 3) if vals else None
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m bench.startup", description="worker startup time")
+    ap.add_argument("--runs", type=int, default=3)
+    ap.add_argument("--timeout", type=float, default=120.0, help="รอ ready นานสุดต่อรอบ (วินาที)")
+    ap.add_argument("--out", help="เขียนผล JSON ลงไฟล์นี้ด้วย")
+    args = ap.parse_args(argv)
+
+    runs = []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory(prefix="bench_startup_") as d:
+            workdir = Path(d)
+            runs.append({**measure_import(workdir), **measure_server(workdir, args.timeout)})
+
+    report = {
+        "bench": "startup",
+        "backend": os.getenv("MODEL_BACKEND", "ultralytics"),
+        "runs": runs,
+        "median": {k: _median(runs, k) for k in ("import_s", "live_s", "ready_s")},
+    }
+    write_report(report, args.out)
+    return 0 if all(r["ready_s"] is not None for r in runs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,53 @@
+# bench/stub.py
+"""
+โมเดลปลอมสำหรับ benchmark — รันได้โดยไม่มี best.pt / torch
+
+StubEngine คืนกรอบคงที่ (สัดส่วนตามขนาดภาพ) และหน่วงเวลา latency_ms ต่อ batch
+เพื่อแยกวัด overhead ของ API (upload/decode/DB/render) ออกจากเวลาโมเดลจริง
+
+    install(latency_ms=20)   # ก่อน lifespan ของ app เริ่ม → registry โหลด stub แทนโมเดลจริง
+"""
+import time
+
+from backend.engines import Detection, Engine
+
+NAMES = {0: "normal", 1: "spaghetti", 2: "not_3dprint"}
+# (x1, y1, x2, y2) เป็นสัดส่วนของภาพ, conf, cls
+_BOXES = (
+    ((0.20, 0.25, 0.55, 0.70), 0.82, 0),
+    ((0.60, 0.30, 0.85, 0.60), 0.35, 1),
+)
+
+
+class StubEngine(Engine):
+    name = "stub"
+
+    def __init__(self, latency_ms: float = 0.0):
+        super().__init__("stub.pt")
+        self.names = dict(NAMES)
+        self.latency = max(0.0, latency_ms) / 1000.0
+
+    def predict(self, imgs: list, conf: float, imgsz: int | None = None) -> list[list[Detection]]:
+        if self.latency:
+            time.sleep(self.latency)
+        out = []
+        for img in imgs:
+            h, w = img.shape[:2]
+            out.append([
+                Detection((x1 * w, y1 * h, x2 * w, y2 * h), c, cls)
+                for (x1, y1, x2, y2), c, cls in _BOXES if c >= conf
+            ])
+        return out
+
+    def identity(self) -> str:
+        return f"stub:{self.latency}"
+
+    def version(self) -> str:
+        return "stub@00000000"
+
+
+def install(latency_ms: float = 0.0) -> None:
+    """ให้ registry โหลด StubEngine ไม่ว่า backend/path จะเป็นอะไร"""
+    from backend import registry
+
+    registry.load_engine = lambda *args, **kwargs: StubEngine(latency_ms)
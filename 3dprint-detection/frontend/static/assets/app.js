@@ -20,9 +20,11 @@ document.addEventListener("DOMContentLoaded", () => {
   let isUploading = false; // กันดับเบิลคลิก
   const hasKey = () => !!apiKeyInput.value?.trim();
 
-  // กัน cache แบบไม่ทำให้เกิด `...?v=abc?v=123`
-  function withCacheBuster(url) {
-    return url.includes("?") ? `${url}&_=${Date.now()}` : `${url}?_=${Date.now()}`;
+  // ผูก URL รูปกับเวอร์ชันของการ์ด (updated_at) — รูปเดิมไม่โหลดซ้ำ, เวอร์ชันใหม่ได้ URL ใหม่
+  // (กันไม่ให้เกิด `...?v=abc?v=123`)
+  function withVersion(url, updatedAt) {
+    const v = encodeURIComponent(updatedAt || Date.now());
+    return url.includes("?") ? `${url}&_=${v}` : `${url}?_=${v}`;
   }
 
   function setKey(apiKey, cardId) {
@@ -201,10 +203,7 @@ function buildCurlCommand(apiKey, cardId) {
         const cardId = data.card_id;
         const existing = document.querySelector(`[data-card-id="${cardId}"]`);
         if (existing) {
-          const img = existing.querySelector("img");
-          if (img) img.src = withCacheBuster(data.detected_image_url);
-          const title = existing.querySelector(".card-title");
-          if (title) title.textContent = data.status;
+          applyCardUpdate(data); // ถ้า stream อัปเดตไปแล้ว (updated_at เดียวกัน) จะไม่โหลดรูปซ้ำ
           existing.classList.add("selected");
         } else {
           console.warn("No existing card in DOM; creating a new one.");
@@ -248,10 +247,10 @@ async function ensureImageOk(url) {
     const col = document.createElement("div");
     col.className = "col-md-6 mb-4";
 
-    const imgUrl = withCacheBuster(result.detected_image_url);
+    const imgUrl = withVersion(result.detected_image_url, result.updated_at);
 
     col.innerHTML = `
-      <div class="card" data-card-id="${result.card_id}">
+      <div class="card" data-card-id="${result.card_id}" data-updated-at="${result.updated_at || ""}">
         <img src="${imgUrl}" class="card-img-top" />
         <div class="card-body">
           <div class="d-flex align-items-baseline gap-2">
@@ -262,5 +261,32 @@ async function ensureImageOk(url) {
       </div>
     `;
     cardContainer.prepend(col);
+    subscribe(); // เพิ่ม card ใหม่เข้า stream
+  }
+
+  // ------------------------
+  // live updates (GET /cards/stream) แทนการ poll
+  // ------------------------
+  // อัปเดตการ์ดใน DOM — โหลดรูปใหม่เฉพาะตอน updated_at เปลี่ยน
+  function applyCardUpdate(card) {
+    const el = document.querySelector(`[data-card-id="${card.card_id}"]`);
+    if (!el || el.dataset.updatedAt === card.updated_at) return;
+    el.dataset.updatedAt = card.updated_at || "";
+    const img = el.querySelector("img");
+    if (img) img.src = withVersion(card.detected_image_url, card.updated_at);
+    const title = el.querySelector(".card-title");
+    if (title) title.textContent = card.status;
+  }
+
+  let stream = null;
+  function subscribe() {
+    const ids = [...document.querySelectorAll("[data-card-id]")].map(el => el.dataset.cardId);
+    if (stream) { stream.close(); stream = null; }
+    if (!ids.length || !window.EventSource) return;
+    const qs = ids.map(id => `card_id=${encodeURIComponent(id)}`).join("&");
+    stream = new EventSource(`/cards/stream?${qs}`, { withCredentials: true });
+    stream.addEventListener("card", (ev) => {
+      try { applyCardUpdate(JSON.parse(ev.data)); } catch (e) { console.error("[stream]", e); }
+    });
   }
 });
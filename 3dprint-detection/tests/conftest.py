@@ -0,0 +1,5 @@
+# tests/conftest.py — รัน pytest จากที่ไหนก็ได้: import backend.* จากโฟลเดอร์ 3dprint-detection
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,54 @@
+# tests/test_blobstore.py
+import hashlib
+import os
+
+from backend.blobstore import BlobStore
+
+
+def _put(store: BlobStore, tmp_path, i: int, size: int = 1000):
+    data = bytes([i % 256]) * size
+    src = store.incoming / f"up{i}"
+    src.write_bytes(data)
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    link = tmp_path / "session" / f"{i}.jpg"
+    blob = store.put(src, digest, ".jpg", link=str(link))
+    os.symlink(blob, link)
+    return blob, link
+
+
+def _disk_bytes(store: BlobStore) -> int:
+    return sum(f.stat().st_size for f in store.root.glob("??/??/*") if f.is_file())
+
+
+def test_quota_evicts_linked_blobs_lru(tmp_path):
+    (tmp_path / "session").mkdir()
+    store = BlobStore(tmp_path / "blobs", quota_bytes=3500)
+    put = [_put(store, tmp_path, i) for i in range(10)]
+
+    # ทุก blob ยังมี link อยู่ แต่ quota ต้องคุมขนาดบนดิสก์ได้จริง
+    assert store.stats()["bytes"] <= 3500
+    assert _disk_bytes(store) <= 3500
+    assert store.stats()["evicted_quota"] == 7
+
+    # ตัวเก่าสุดถูกลบ (link ค้างเป็น dangling), ตัวล่าสุดยังอ่านได้
+    for blob, link in put[:7]:
+        assert not blob.exists() and os.path.islink(link) and not link.exists()
+    for blob, link in put[7:]:
+        assert link.read_bytes() == blob.read_bytes()
+        assert blob.stat().st_nlink == 2          # blob + ref ของ link
+
+    # ref ของ blob ที่ถูก evict ถูกลบด้วย (ไม่ค้าง hard link กินดิสก์)
+    refs = [p for p in store.refs.glob("??/*/*") if p.name != "name"]
+    assert sorted(p.name for p in refs) == sorted(b.name for b, _ in put[7:])
+
+
+def test_touch_keeps_recently_read_blob(tmp_path):
+    (tmp_path / "session").mkdir()
+    store = BlobStore(tmp_path / "blobs", quota_bytes=3500)
+    first, _ = _put(store, tmp_path, 0)
+    for i in range(1, 3):
+        _put(store, tmp_path, i)
+    store.touch(first)
+    _put(store, tmp_path, 3)
+    assert first.exists()
+    assert store.stats()["bytes"] <= 3500
@@ -0,0 +1,115 @@
+# tests/test_webhooks.py
+"""dispatcher ของ webhook ยิงจริงไปที่ http.server บน port ว่าง + outbox ใน SQLite ชั่วคราว"""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from backend import database as db
+from backend import webhooks
+
+
+class _Stub(BaseHTTPRequestHandler):
+    """
+    /ok        → 200
+    /flaky     → 500 ครั้งแรก แล้ว 200
+    /bad       → 400
+    /slow      → 200 หลังหน่วง 0.2s (นับจำนวน request ที่ค้างพร้อมกัน)
+    """
+    def do_POST(self):
+        srv = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with srv.lock:
+            srv.hits.setdefault(self.path, []).append(body)
+            n = len(srv.hits[self.path])
+            srv.active += 1
+            srv.peak = max(srv.peak, srv.active)
+        try:
+            if self.path == "/slow":
+                time.sleep(0.2)
+            code = {"/bad": 400, "/flaky": 500 if n == 1 else 200}.get(self.path, 200)
+            self.send_response(code)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        finally:
+            with srv.lock:
+                srv.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Stub)
+    srv.lock, srv.hits, srv.active, srv.peak = threading.Lock(), {}, 0, 0
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    srv.url = f"http://127.0.0.1:{srv.server_address[1]}"
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+@pytest.fixture(autouse=True)
+def outbox(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DB_PATH", tmp_path / "test.db")
+    monkeypatch.setattr(webhooks, "backoff", lambda attempts: 0.05)   # ไม่ต้องรอ backoff จริง
+    db.init_db()
+    yield
+    db.close_pool()
+
+
+def _status(card_id: str) -> str:
+    with db.get_conn() as conn:
+        return conn.execute("SELECT status FROM webhook_outbox WHERE card_id = ?", (card_id,)).fetchone()[0]
+
+
+def _run(enqueue: list[tuple], done, before_start: bool = False, timeout: float = 10.0) -> None:
+    """enqueue (card_id, url, payload) แล้วรัน dispatcher จน done() เป็นจริง"""
+    async def main():
+        if before_start:
+            for item in enqueue:
+                await webhooks.enqueue(*item)
+        webhooks.start()
+        try:
+            if not before_start:
+                for item in enqueue:
+                    await webhooks.enqueue(*item)
+            deadline = time.monotonic() + timeout
+            while not await db.run(done):
+                assert time.monotonic() < deadline, "dispatcher did not finish in time"
+                await asyncio.sleep(0.02)
+        finally:
+            await webhooks.stop()
+
+    asyncio.run(main())
+
+
+def test_5xx_is_retried_then_delivered(stub):
+    _run([("c1", stub.url + "/flaky", {"n": 1})], lambda: _status("c1") != "pending")
+    assert _status("c1") == "delivered"
+    assert len(stub.hits["/flaky"]) == 2
+
+
+def test_4xx_fails_without_retry(stub):
+    _run([("c1", stub.url + "/bad", {"n": 1})], lambda: _status("c1") != "pending")
+    assert _status("c1") == "failed"
+    time.sleep(0.2)   # เผื่อ retry ที่ไม่ควรเกิด
+    assert len(stub.hits["/bad"]) == 1
+
+
+def test_rapid_updates_coalesce_to_latest(stub):
+    items = [("c1", stub.url + "/ok", {"n": i}) for i in range(10)]
+    _run(items, lambda: _status("c1") == "delivered", before_start=True)
+    assert stub.hits["/ok"] == [{"n": 9}]
+
+
+def test_per_host_concurrency_cap(stub, monkeypatch):
+    monkeypatch.setattr(webhooks, "WEBHOOK_PER_HOST", 2)
+    items = [(f"c{i}", stub.url + "/slow", {"n": i}) for i in range(8)]
+    _run(items, lambda: db.count_webhooks("delivered") == 8)
+    assert len(stub.hits["/slow"]) == 8
+    assert stub.peak <= 2